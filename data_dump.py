@@ -1,9 +1,12 @@
-import os
+import os, sys
 import warnings, asyncio
 from dotenv import load_dotenv, find_dotenv
+from langchain_openai import OpenAIEmbeddings
 
-from src.utils import format_data_n_get_documents, get_vector_store, get_chunked_data, store_data_to_vdb
-from src.config import DATA_DUMP_FILE_PATH, QDRANT_COLLECTION_NAME, CHUNK_SIZE, CHUNK_OVERLAP, OPENAI_API_KEY
+from src.hybrid import LexicalIndex
+from src.embedding_cache import SQLiteEmbeddingCache
+from src.utils import iter_documents, get_vector_store, iter_chunked_documents, store_data_to_vdb
+from src.config import DATA_DUMP_FILE_PATH, QDRANT_COLLECTION_NAME, CHUNK_SIZE, CHUNK_OVERLAP, OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_CACHE_PATH, LEXICAL_INDEX_PATH
 
 
 load_dotenv(find_dotenv())
@@ -13,13 +16,30 @@ QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_HOST="https://f6599bdf-ee6e-46fb-a827-7d34ff7d1aeb.us-west-2-0.aws.cloud.qdrant.io:6333"
 
 async def main():
-    documents= await format_data_n_get_documents(DATA_DUMP_FILE_PATH=DATA_DUMP_FILE_PATH)
-
-    vector_store= await get_vector_store(QDRANT_HOST=QDRANT_HOST, API_KEY=QDRANT_API_KEY, QDRANT_COLLECTION_NAME=QDRANT_COLLECTION_NAME, OPENAI_API_KEY=OPENAI_API_KEY)
-
-    chunked_documents= await get_chunked_data(documents=documents, CHUNK_SIZE=CHUNK_SIZE, CHUNK_OVERLAP=CHUNK_OVERLAP)
-
-    await store_data_to_vdb(vector_store=vector_store, chunked_documents=chunked_documents)
+    # Rows are read, chunked and embedded lazily, so memory stays flat for any dump size
+    documents= iter_documents(DATA_DUMP_FILE_PATH=DATA_DUMP_FILE_PATH)
+
+    # Only chunks not seen in a previous run are sent to OpenAI
+    embeddings= SQLiteEmbeddingCache(
+        underlying=OpenAIEmbeddings(api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL),
+        path=EMBEDDING_CACHE_PATH,
+        model_name=EMBEDDING_MODEL
+    )
+
+    vector_store= await get_vector_store(QDRANT_HOST=QDRANT_HOST, API_KEY=QDRANT_API_KEY, QDRANT_COLLECTION_NAME=QDRANT_COLLECTION_NAME, OPENAI_API_KEY=OPENAI_API_KEY, embeddings=embeddings)
+
+    chunked_documents= iter_chunked_documents(documents=documents, CHUNK_SIZE=CHUNK_SIZE, CHUNK_OVERLAP=CHUNK_OVERLAP)
+
+    # BM25 index over the same chunks, for hybrid retrieval
+    lexical_index= LexicalIndex()
+
+    try:
+        # Diff against the collection unless a full re-upsert is requested
+        summary= await store_data_to_vdb(vector_store=vector_store, chunked_documents=chunked_documents, diff="--full" not in sys.argv, lexical_index=lexical_index)
+        lexical_index.save(LEXICAL_INDEX_PATH)
+        print(f"Rows added: {summary['added']}, updated: {summary['updated']}, deleted: {summary['deleted']}, skipped: {summary['skipped']} ({summary['docs_per_sec']} docs/sec)")
+    finally:
+        embeddings.close()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
+import json
 import uuid
+import asyncio
 import certifi
 import uvicorn
 import warnings
@@ -6,15 +8,24 @@ from typing import Annotated
 from typing import List, Dict
 from datetime import timedelta
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.security import OAuth2PasswordRequestForm, HTTPBearer, HTTPAuthorizationCredentials
 
 from src.logger import logging
-from src.config import QDRANT_COLLECTION_NAME, QDRANT_HOST, QDRANT_API_KEY, OPENAI_API_KEY, GROQ_API_KEY, MODEL_NAME_LLAMA, MONGODB_URI, ACCESS_TOKEN_EXPIRE_MINUTES, CONTEXT_WINDOW, users_collection, sessions_collection
-from src.utils import get_vector_store, get_retriever, get_response, Token, create_access_token, authenticate_user, get_password_hash, get_user, verify_token, UserInDB
+from src.config import ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_TRUST_TOKEN_CLAIMS_SECONDS, CONTEXT_WINDOW
+from src.analytics import AnalyticsPlan, describe_result
+from src.reasoning import GenerationOptions
+from src.admission import AdmissionController, AdmissionRejected
+from src.resilience import StageTimeout
+from src.resources import ResourceRegistry, install_reload_signal
+from src.metrics import RequestMetricsMiddleware, ResourceCollector, record_answer, span
+from src.utils import answer_query, answer_from_indexes, start_response, Token, create_access_token, authenticate_user, get_password_hash, get_user, resolve_user, token_claims, update_user, verify_token, UserInDB
 
 
 warnings.filterwarnings("ignore")
@@ -22,8 +33,18 @@ warnings.filterwarnings("ignore")
 # Security
 security = HTTPBearer()
 
+# Builds the shared Qdrant/OpenAI/Groq clients once per process and closes them on shutdown.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    resources = ResourceRegistry()
+    await resources.startup()
+    install_reload_signal(resources)    # `kill -HUP <pid>` re-reads .env and rebuilds the clients
+    app.state.resources = resources
+    yield
+    await resources.shutdown()
+
 # Create FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configures CORS to allow cross-origin requests.
 app.add_middleware(
@@ -32,13 +53,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Gives each request a correlation ID for its log records and times it, streamed bodies included.
+app.add_middleware(RequestMetricsMiddleware)
+
+# Exports the shared caches, coalescing, admission and breaker counters at scrape time.
+REGISTRY.register(ResourceCollector(lambda: getattr(app.state, "resources", None)))
+
 # Defines query request structure with user_id, session_id, and user_query.
 class QueryRequest(BaseModel):
     user_id: str  # Add user_id to the request model
     session_id: str  # Unique session ID for maintaining context
     user_query: str
+    options: GenerationOptions | None = None  # Model routing and token caps, server defaults when omitted
+
+# Defines an analytics request: a natural-language question, or an explicit plan.
+class AnalyticsRequest(BaseModel):
+    question: str | None = None
+    plan: AnalyticsPlan | None = None
 
 # Defines the session start request.
 class StartSessionRequest(BaseModel):
@@ -51,29 +85,50 @@ class UserCreate(BaseModel):
     email: str | None = None
     full_name: str | None = None
 
+# Defines a password change: the current password and the new one.
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
+# Returns the process-wide resource registry created in the lifespan hook.
+def get_resources(request: Request) -> ResourceRegistry:
+    return request.app.state.resources
+
 # Validates authentication token and retrieves user info.
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    resources: ResourceRegistry = Depends(get_resources)
+):
     token = credentials.credentials
-    payload = await verify_token(token)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = await get_user(username=payload.get("sub"))
+    with span("auth"):
+        payload = await verify_token(token)
+        if not payload:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid authentication credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        # Signed claims (fresh tokens), then the principal cache, then Mongo
+        user = await resolve_user(payload, resources.users, resources.principals, AUTH_TRUST_TOKEN_CLAIMS_SECONDS)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    if user.disabled:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is disabled")
     return user
 
 @app.get("/")
 async def home():
     return {"message": "Server is up and running."}
 
+# Prometheus scrape endpoint: stage and request latency histograms, token counts and cache hit ratios.
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Checks if username exists, hashes the password, and saves user to MongoDB.
 @app.post("/register")
-async def register_user(user_data: UserCreate):
-    existing_user = await get_user(username=user_data.username)
+async def register_user(user_data: UserCreate, resources: ResourceRegistry = Depends(get_resources)):
+    existing_user = await get_user(username=user_data.username, users_collection=resources.users)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
@@ -88,7 +143,7 @@ async def register_user(user_data: UserCreate):
         # Let MongoDB generate the _id automatically
     }
     
-    result = users_collection.insert_one(user_dict)
+    result = await resources.users.insert_one(user_dict)
     return {
         "message": "User created successfully",
         "user_id": str(result.inserted_id)  # Return string ID
@@ -106,8 +161,11 @@ async def get_user_info(current_user: UserInDB = Depends(get_current_user)):
 
 # Authenticates user and generates a JWT access token.
 @app.post("/generate_access_token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await authenticate_user(form_data.username, form_data.password)
+async def login_for_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    resources: ResourceRegistry = Depends(get_resources)
+):
+    user = await authenticate_user(form_data.username, form_data.password, resources.users)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -116,15 +174,41 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = await create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, **token_claims(user, AUTH_TRUST_TOKEN_CLAIMS_SECONDS)}, expires_delta=access_token_expires
     )
     return Token(access_token=access_token, token_type="bearer")
 
+# Changes the caller's password; tokens issued before it stop working and the cached principal is dropped.
+@app.post("/change_password")
+async def change_password(
+    request: PasswordChange,
+    current_user: UserInDB = Depends(get_current_user),
+    resources: ResourceRegistry = Depends(get_resources)
+):
+    if not await authenticate_user(current_user.username, request.current_password, resources.users):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password")
+    hashed_password = await get_password_hash(request.new_password)
+    await update_user(current_user.username, {"hashed_password": hashed_password}, resources.users, resources.principals)
+    return {"message": "Password changed, sign in again"}
+
+# Disables the caller's account; its tokens are rejected from the next request on.
+@app.post("/disable_user")
+async def disable_user(
+    current_user: UserInDB = Depends(get_current_user),
+    resources: ResourceRegistry = Depends(get_resources)
+):
+    await update_user(current_user.username, {"disabled": True}, resources.users, resources.principals)
+    return {"message": "User disabled"}
+
 # Creates a new session and stores it in MongoDB.
 @app.post("/start_session")
-async def start_session(request: StartSessionRequest, current_user: UserInDB = Depends(get_current_user)):
+async def start_session(
+    request: StartSessionRequest,
+    current_user: UserInDB = Depends(get_current_user),
+    resources: ResourceRegistry = Depends(get_resources)
+):
     session_id = str(uuid.uuid4())
-    sessions_collection.insert_one({
+    await resources.sessions.insert_one({
         "user_id": request.user_id,  # Now accepts string
         "session_id": session_id,
         "history": [],
@@ -132,60 +216,179 @@ async def start_session(request: StartSessionRequest, current_user: UserInDB = D
     })
     return {"message": "Session started", "session_id": session_id}
 
-# Fetches session history, queries Qdrant for relevant data, generates a response, and stores conversation history.
+# Loads the caller's session, projecting only the last CONTEXT_WINDOW history entries.
+async def find_session(sessions_collection, request: QueryRequest, username: str):
+    with span("session_load"):
+        return await sessions_collection.find_one(
+            {"session_id": request.session_id, "user_id": request.user_id, "username": username},
+            {"history": {"$slice": -CONTEXT_WINDOW}}
+        )
+
+# Appends a turn to the session history in one atomic update, keeping the last CONTEXT_WINDOW entries.
+async def save_history(sessions_collection, session_document, query: str, response: str):
+    with span("history_write"):
+        await sessions_collection.update_one(
+            {"_id": session_document["_id"]},
+            {"$push": {"history": {"$each": [{"query": query, "response": response}], "$slice": -CONTEXT_WINDOW}}}
+        )
+
+# Formats one server-sent event.
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Turns a saturated LLM queue or a provider rate limit into a 429 with Retry-After, None for other errors.
+def too_many_requests(error: Exception, admission: AdmissionController) -> HTTPException | None:
+    if isinstance(error, AdmissionRejected):
+        retry_after = error.retry_after
+    elif getattr(error, "status_code", None) == 429:       # groq/openai RateLimitError after the SDK's own retries
+        retry_after = admission.retry_after()
+    else:
+        return None
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(error), headers={"Retry-After": str(retry_after)})
+
+# Fetches session history, answers from the movie catalog or queries Qdrant and the LLM, and stores conversation history.
 @app.post("/query")
 async def query_qdrant(
     request: QueryRequest,
-    current_user: UserInDB = Depends(get_current_user)
+    current_user: UserInDB = Depends(get_current_user),
+    resources: ResourceRegistry = Depends(get_resources)
 ):
     try:
         # Verify session belongs to authenticated user
-        session_document = sessions_collection.find_one({
-            "user_id": request.user_id,
-            "session_id": request.session_id,
-            "username": current_user.username
-        })
+        session_document = await find_session(resources.sessions, request, current_user.username)
 
         if not session_document:
             raise HTTPException(status_code=404, detail="Session not found or unauthorized")
 
         chat_history: List[Dict] = session_document.get("history", [])
 
-        # Get vector store and retriever
-        vector_store = await get_vector_store(
-            QDRANT_HOST=QDRANT_HOST,
-            API_KEY=QDRANT_API_KEY,
-            QDRANT_COLLECTION_NAME=QDRANT_COLLECTION_NAME,
-            OPENAI_API_KEY=OPENAI_API_KEY
-        )
-        retriever = await get_retriever(
-            GROQ_API_KEY=GROQ_API_KEY,
-            MODEL_NAME_LLAMA=MODEL_NAME_LLAMA,
-            vector_store=vector_store
-        )
+        # Reuse the shared retriever built at startup
+        with span("resources"):
+            retriever = await resources.get_retriever()
 
-        # Get and store response
-        response = await get_response(
+        # Fact lookups and analytical questions are answered from the in-memory indexes, the rest by the RAG chain
+        result = await answer_query(
             query=request.user_query,
             retriever=retriever,
-            chat_history=chat_history
+            chat_history=chat_history,
+            cache=resources.cache,
+            catalog=resources.catalog,
+            table=resources.table,
+            options=request.options,
+            fast_llm=resources.fast_llm,
+            condenser=resources.condenser,
+            inflight=resources.inflight,
+            admission=resources.admission,
+            user=current_user.username,
+            models=resources.models,
+            people=resources.people
         )
+        response = result["answer"]
+        record_answer(result["served_by"], result.get("usage"))
 
         # Update history
-        new_history_entry = {"query": request.user_query, "response": response}
-        chat_history.append(new_history_entry)
-        if len(chat_history) > CONTEXT_WINDOW:
-            chat_history = chat_history[-CONTEXT_WINDOW:]
+        await save_history(resources.sessions, session_document, request.user_query, response)
 
-        sessions_collection.update_one(
-            {"_id": session_document["_id"]},
-            {"$set": {"history": chat_history}}
-        )
-
-        return {"answer": response}
+        return {"answer": response, "served_by": result["served_by"], "usage": result.get("usage")}
     except Exception as e:
+        busy = too_many_requests(e, resources.admission)
+        if busy is not None:
+            raise busy
+        if isinstance(e, StageTimeout):
+            logging.error(f"Query deadline missed: {e}")
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
         logging.error(f"An error occurred: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Same as /query, but streams the answer as server-sent events: "token" events while the LLM generates, then "done"
+# (or "error"). A full LLM queue is a 429 with Retry-After before the stream starts. History is saved once the stream
+# completes; a client disconnect cancels the LLM call.
+@app.post("/query/stream")
+async def query_qdrant_stream(
+    request: QueryRequest,
+    current_user: UserInDB = Depends(get_current_user),
+    resources: ResourceRegistry = Depends(get_resources)
+):
+    # Verify session belongs to authenticated user before the stream starts, so errors keep their status code
+    session_document = await find_session(resources.sessions, request, current_user.username)
+    if not session_document:
+        raise HTTPException(status_code=404, detail="Session not found or unauthorized")
+
+    chat_history: List[Dict] = session_document.get("history", [])
+    with span("resources"):
+        retriever = await resources.get_retriever()
+    with span("index_answer"):
+        result = answer_from_indexes(request.user_query, catalog=resources.catalog, table=resources.table)
+
+    # The cache lookup and the wait for an LLM slot happen before the 200 is sent, so a shed request gets a real 429
+    usage, release = None, (lambda: None)
+    if result is None:
+        usage = {}
+        try:
+            chunks, release = await start_response(request.user_query, retriever, chat_history=chat_history, cache=resources.cache,
+                                                   options=request.options, fast_llm=resources.fast_llm, usage=usage,
+                                                   condenser=resources.condenser, models=resources.models, people=resources.people,
+                                                   admission=resources.admission, user=current_user.username)
+        except Exception as e:
+            busy = too_many_requests(e, resources.admission)
+            if busy is not None:
+                raise busy
+            logging.error(f"An error occurred: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        served_by, parts = (result["served_by"], [result["answer"]]) if result else ("rag", [])
+        try:
+            if result:
+                yield sse_event("token", {"text": result["answer"]})
+            else:
+                async for text in chunks:
+                    parts.append(text)
+                    yield sse_event("token", {"text": text})
+        except asyncio.CancelledError:
+            logging.info(f"Client disconnected from session {request.session_id}, generation cancelled")
+            raise
+        except Exception as e:
+            logging.error(f"An error occurred while streaming: {e}")
+            yield sse_event("error", {"detail": str(e)})
+            return
+        finally:
+            if not result:
+                await chunks.aclose()      # Stops the upstream call when the client goes away
+            release()
+
+        response = "".join(parts)
+        record_answer(served_by, usage)
+        await save_history(resources.sessions, session_document, request.user_query, response)
+        yield sse_event("done", {"answer": response, "served_by": served_by, "usage": usage})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},   # Stop proxies from buffering the stream
+        background=BackgroundTask(release)      # Frees the LLM slot even if the client left before the stream started
+    )
+
+# Answers filter/sort/aggregate questions ("average rating of 1990s dramas") exactly from the movie table.
+@app.post("/analytics")
+async def analytics(
+    request: AnalyticsRequest,
+    current_user: UserInDB = Depends(get_current_user),
+    resources: ResourceRegistry = Depends(get_resources)
+):
+    if resources.table is None:
+        raise HTTPException(status_code=503, detail="Analytics table not available")
+    if request.plan is not None:
+        plan = request.plan
+    elif request.question:
+        plan = resources.table.plan(request.question)
+        if plan is None:
+            raise HTTPException(status_code=400, detail="Not an analytical question, use /query")
+    else:
+        raise HTTPException(status_code=400, detail="Provide a question or a plan")
+
+    result = resources.table.run(plan)
+    return {"answer": describe_result(plan, result), "plan": plan.model_dump(), "result": result}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
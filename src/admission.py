@@ -0,0 +1,230 @@
+import re
+import time
+import math
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+import httpx
+
+from src.logger import logging
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get an LLM slot in time; `retry_after` is in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a rate-limit reset header: plain seconds ("7") or Groq/OpenAI durations ("1m30.5s", "20ms").
+
+    Args:
+        value (Optional[str]): The header value.
+
+    Returns:
+        float | None: Seconds, or None when missing or unparsable.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    return sum(float(number) * units[unit] for number, unit in parts) if parts else None
+
+
+class AdmissionController:
+    """
+    Concurrency limiter for LLM work with a bounded, per-user fair wait queue.
+
+    At most `limit` calls run at once. Others wait in one FIFO per user, served round-robin,
+    so a single chatty user cannot starve the rest. A request that would overflow the queue,
+    or that waits longer than `queue_timeout`, is rejected with `AdmissionRejected`.
+
+    The limit follows the providers: a 429 or an exhausted rate-limit window halves it and
+    pauses admissions until the reset, successful calls grow it back by about one per round.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 64, max_queue_per_user: int = 4,
+                 queue_timeout: float = 10.0, min_concurrency: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.clock = clock          # For the provider pauses
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.queued = 0
+        self.paused_until = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()      # user -> waiting futures, in round-robin order
+        self._wakeup = None
+
+    def retry_after(self) -> int:
+        """
+        Returns the Retry-After hint in seconds: the provider pause if there is one, else the queue deadline.
+        """
+        return max(1, math.ceil(max(self.paused_until - self.clock(), 0) or self.queue_timeout))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        logging.warning(f"Admission rejected: {reason} ({self.stats()})")
+        raise AdmissionRejected(f"Too many requests in progress: {reason}", self.retry_after())
+
+    def _can_run(self) -> bool:
+        return self.active < int(self.limit) and self.clock() >= self.paused_until
+
+    async def acquire(self, user: str = ""):
+        """
+        Waits for an LLM slot. Every successful call must be paired with `release`.
+
+        Args:
+            user (str): The caller, for fair queueing. Defaults to "".
+        """
+        if self._can_run() and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queue:
+            self._reject("queue full")
+        queue = self._queues.setdefault(user, deque())
+        if len(queue) >= self.max_queue_per_user:
+            self._reject(f"{len(queue)} requests of this user already queued")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        self.queued += 1
+        self._dispatch()        # Schedules the wake-up when admissions are paused
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()              # Granted just as we gave up
+            else:
+                self._forget(user, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(f"no slot within {self.queue_timeout:g}s")
+            raise
+        self.admitted += 1
+
+    def _forget(self, user, waiter):
+        queue = self._queues.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self._queues[user]
+
+    def release(self):
+        """
+        Frees a slot and hands it to the next waiting user.
+        """
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._queues and self._can_run():
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+        # Paused by a provider limit: resume dispatching when the window resets
+        if self._queues and self.active < int(self.limit) and self._wakeup is None:
+            delay = max(self.paused_until - self.clock(), 0.01)
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._resume)
+
+    def _resume(self):
+        self._wakeup = None
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str = ""):
+        """
+        `async with controller.slot(user):` runs the block holding one LLM slot.
+        """
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def hold(self, user: str = ""):
+        """
+        Acquires a slot for work that outlives the caller, e.g. a streaming response.
+
+        Args:
+            user (str): The caller, for fair queueing. Defaults to "".
+
+        Returns:
+            Callable[[], None]: Releases the slot; safe to call more than once.
+        """
+        await self.acquire(user)
+        held = True
+
+        def release():
+            nonlocal held
+            if held:
+                held = False
+                self.release()
+        return release
+
+    def observe(self, status_code: int, headers) -> None:
+        """
+        Adjusts the limit from a provider response's status and rate-limit headers.
+
+        Args:
+            status_code (int): The HTTP status.
+            headers (Mapping[str, str]): The response headers.
+        """
+        now = self.clock()
+        if status_code == 429:
+            pause = parse_duration(headers.get("retry-after")) or parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0
+            self.limit = max(float(self.min_concurrency), self.limit / 2)
+            self.paused_until = max(self.paused_until, now + pause)
+            logging.warning(f"Provider rate limit hit, LLM concurrency now {int(self.limit)}, paused for {pause:.1f}s")
+            return
+
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 1.0
+                self.paused_until = max(self.paused_until, now + reset)
+                logging.info(f"Provider {kind} window exhausted, pausing LLM admissions for {reset:.1f}s")
+
+        if status_code < 400 and self.limit < self.max_concurrency:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        self._dispatch()
+
+    def http_client(self, timeout: float = 60.0) -> httpx.AsyncClient:
+        """
+        Returns an httpx client for the provider SDKs that reports every response to `observe`.
+
+        Args:
+            timeout (float): Read timeout in seconds. Defaults to 60.
+
+        Returns:
+            httpx.AsyncClient: The client; close it on shutdown.
+        """
+        async def on_response(response: httpx.Response):
+            self.observe(response.status_code, response.headers)
+
+        return httpx.AsyncClient(timeout=httpx.Timeout(timeout, connect=5.0), event_hooks={"response": [on_response]})
+
+    def stats(self) -> Dict[str, int]:
+        return {"limit": int(self.limit), "active": self.active, "queued": self.queued,
+                "admitted": self.admitted, "rejected": self.rejected}
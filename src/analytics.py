@@ -0,0 +1,387 @@
+import re
+import pandas as pd
+from typing import Any, Dict, Iterable, Literal, Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from src.filters import MOVIE_PAYLOAD_SCHEMA, GENRE_PATTERNS, extract_filters, normalize, people_index
+
+
+NUMERIC_FIELDS = ("rating", "gross", "votes", "runtime", "meta_score", "year")
+LIST_FIELDS = ("genre", "stars")
+_OPERATORS = {"gt", "gte", "lt", "lte", "eq", "any"}
+_PANDAS_OPERATORS = {"gt": "gt", "gte": "ge", "lt": "lt", "lte": "le"}
+
+# Words naming the column a question ranks or aggregates by, most specific first
+FIELD_PATTERNS = [
+    ("gross", r"\bgross\w*|\bbox office\b|\bearn\w*|\brevenue\b|\bmoney\b"),
+    ("votes", r"\bvotes?\b|\bvoted\b|\bpopular\b"),
+    ("meta_score", r"\bmeta ?scores?\b|\bcritics?\b"),
+    ("runtime", r"\bruntimes?\b|\blong(?:est|er)?\b|\bshort(?:est|er)?\b|\blength\b|\bduration\b|\bminutes\b"),
+    ("year", r"\boldest\b|\bnewest\b|\bearliest\b|\blatest\b|\b(?:most )?recent\b"),
+    ("rating", r"\bratings?\b|\brated\b|\bbest\b|\bworst\b|\bimdb\b|\bscores?\b"),
+]
+_ASCENDING = r"\b(?:lowest|least|worst|shortest|smallest|oldest|earliest|bottom)\b"
+_RANKING = r"\btop\b|\b(?:highest|most|best|longest|biggest|largest|lowest|least|worst|shortest|smallest|oldest|newest|earliest|latest)\b"
+_GROUPS = r"genre|director|star|actor|decade|year|certificate"
+
+# Capitalized words that are not names: genres and rating vocabulary
+_KNOWN_CAPITALIZED = {normalize(genre) for genre in GENRE_PATTERNS} | {"sci", "fi", "noir", "imdb", "metascore", "meta", "top", "i", "movies", "films"}
+
+# Requests for a recommendation or an explanation are left to the RAG chain
+OPEN_ENDED = re.compile(r"\b(?:recommend\w*|suggest\w*|similar|like|why|explain|describe|plot|story|about|summar\w*)\b")
+
+# Constraints the planner cannot express: a question naming one is left to the RAG chain rather than
+# answered over the whole catalogue. Certificates ("rated R", "PG-13") and genre-like words that are not
+# catalogue genres ("anime", "superhero"); catalogue genres count when the filters did not pick them up
+_CERTIFICATE = re.compile(r"\brated\s+(?:r|g|pg|nc|x|u|a)\b|\bpg-?13\b|\bnc-?17\b|\bpg\b|\btv-?(?:ma|14|pg|y)\b|\bu/a\b|\bcertifi\w*|\bage rating")
+_GENRE_LIKE = re.compile(
+    r"\b(?:anime|documentar\w*|superheroe?s?|indie|foreign|bollywood|christmas|kids?|children|cartoons?|disney|pixar|marvel|"
+    r"zombies?|slashers?|rom-?coms?|heists?|spy|spies|martial arts|musicals?|silent|black and white|\w+-language)\b"
+)
+_GENRE_TERMS = {genre: re.compile(rf"\b(?:{pattern})\b") for genre, pattern in GENRE_PATTERNS.items()}
+_YEAR_TERM = re.compile(r"\b(?:19|20)\d\d(?:'?s)?\b|(?<![\w.])'?\d0'?s\b")
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.]*\w)")
+_ALL_TIME = re.compile(r"\b(?:of all time|in (?:film |movie |cinema )?history|ever)\b")
+
+
+class AnalyticsPlan(BaseModel):
+    """
+    A safe, declarative query over the movie table: filter, then optionally group, then
+    aggregate or sort, then limit. Only whitelisted fields and operators are accepted.
+    """
+    filters: Dict[str, Dict[str, Any]] = {}
+    group_by: Optional[Literal["genre", "director", "stars", "decade", "year", "certificate"]] = None
+    metric: Literal["rows", "count", "mean", "sum", "min", "max"] = "rows"
+    field: Optional[Literal["rating", "gross", "votes", "runtime", "meta_score", "year"]] = None
+    descending: bool = True
+    limit: int = Field(10, ge=1, le=50)
+    min_group_size: int = Field(1, ge=1)
+
+    @field_validator("filters")
+    @classmethod
+    def check_filters(cls, filters):
+        for field, condition in filters.items():
+            if field not in MOVIE_PAYLOAD_SCHEMA:
+                raise ValueError(f"Unknown filter field: {field}")
+            if not condition or set(condition) - _OPERATORS:
+                raise ValueError(f"Unsupported condition for {field}: {condition}")
+            if len(condition) > 1 and set(condition) & {"eq", "any"}:
+                raise ValueError(f"eq and any cannot be combined with other operators: {field}")
+            # Values must match the column: numbers for numeric fields, strings for the rest
+            kind = (int, float) if field in NUMERIC_FIELDS else str
+            for op, value in condition.items():
+                if op == "any":
+                    if not isinstance(value, list) or not value or not all(isinstance(v, kind) and not isinstance(v, bool) for v in value):
+                        raise ValueError(f"any on {field} needs a non-empty list of {'numbers' if field in NUMERIC_FIELDS else 'strings'}")
+                elif field not in NUMERIC_FIELDS and op != "eq":
+                    raise ValueError(f"{op} needs a numeric field, {field} is text")
+                elif field in LIST_FIELDS:
+                    raise ValueError(f"{field} holds several values per movie, use any")
+                elif not isinstance(value, kind) or isinstance(value, bool):
+                    raise ValueError(f"{op} on {field} needs a {'number' if field in NUMERIC_FIELDS else 'string'}, got {value!r}")
+        return filters
+
+    @model_validator(mode="after")
+    def check_metric(self):
+        if self.metric in ("mean", "sum", "min", "max") and self.field is None:
+            raise ValueError(f"The {self.metric} metric needs a field")
+        return self
+
+
+class MovieTable:
+    """
+    Columnar in-memory table of the movie catalogue with typed Gross, No_of_Votes,
+    Runtime and Meta_score columns, answering filter/sort/aggregate questions exactly.
+    """
+
+    def __init__(self, movies: Iterable[Dict]):
+        movies = list(movies)
+        frame = pd.DataFrame.from_records(movies)
+        for field in ("year", "runtime", "votes", "gross"):
+            frame[field] = frame[field].astype("Int64")
+        for field in ("rating", "meta_score"):
+            frame[field] = frame[field].astype("Float64")
+        frame["decade"] = (frame["year"] // 10 * 10).astype("Int64")
+        self.frame = frame
+
+        # List columns as "|a|b|" strings, so membership tests run as vectorized str.contains
+        self._joined = {field: "|" + frame[field].map("|".join) + "|" for field in LIST_FIELDS}
+
+        # Bare surnames ("Nolan films", "Spielberg movies") resolve to full names when unique enough
+        self._people = people_index(movies)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def resolve_people(self, question: str) -> Dict[str, Dict]:
+        """
+        Finds director and star names (full or surname only) mentioned in a question.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            Dict[str, Dict]: {"director": {"any": [...]}} and/or {"stars": {"any": [...]}} filters.
+        """
+        words = normalize(question).split()
+        starring = re.search(r"\b(?:starring|with|acted|actor|actress|stars?)\b", " ".join(words))
+        found = {}
+        for size in (3, 2, 1):
+            for start in range(len(words) - size + 1):
+                key = " ".join(words[start:start + size])
+                if size == 1 and (len(key) < 4 or not re.search(rf"\b{re.escape(key.title())}\b|\b{re.escape(key)}'?s?\b", question.lower())):
+                    continue
+                order = ("stars", "director") if starring else ("director", "stars")
+                for field in order:
+                    names = self._people[field].get(key)
+                    if names and field not in found and len(names) <= 3:
+                        found[field] = {"any": sorted(names)}
+                        break
+                if found:
+                    return found
+        return found
+
+    def plan(self, question: str) -> Optional[AnalyticsPlan]:
+        """
+        Translates a question into an `AnalyticsPlan`, e.g. "average rating of 1990s dramas"
+        -> filter year 1990-1999 and genre Drama, mean of rating.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            AnalyticsPlan | None: The plan, or None when the question is not a filter/sort/aggregate question.
+        """
+        text = normalize(question)
+        if OPEN_ENDED.search(text):
+            return None
+
+        filters = extract_filters(question, self._people)
+        filters.update({field: condition for field, condition in self.resolve_people(question).items() if field not in filters})
+
+        field = next((name for name, pattern in FIELD_PATTERNS if re.search(pattern, text)), None)
+        group = re.search(rf"\b(?:per|by|for each|each|across)\s+({_GROUPS})\b|\bwhich\s+({_GROUPS})s?\b", text)
+        group_by = None
+        if group:
+            group_by = {"star": "stars", "actor": "stars"}.get(group.group(1) or group.group(2), group.group(1) or group.group(2))
+
+        plan = {"filters": filters, "group_by": group_by, "field": field}
+        if re.search(r"\bhow many\b|\bnumber of\b|\bcount\b", text) and not (group_by and field):
+            plan["metric"] = "count"
+        elif re.search(r"\baverage\b|\bmean\b|\btypical\b", text):
+            plan.update(metric="mean", field=field or "rating")
+        elif re.search(r"\btotal\b|\bcombined\b|\bsum\b", text) and field:
+            plan["metric"] = "sum"
+        elif group_by and re.search(_RANKING, text) and (field is None or re.search(r"\bmost (?:movies|films)\b", text)):
+            plan.update(metric="count", field=None)      # "Which director has the most movies?"
+        elif re.search(_RANKING, text) or (filters and re.search(r"^(?:list|which|what|show|name)\b", text)):
+            plan.update(metric="mean" if group_by else "rows", field=field or "rating")
+        else:
+            return None
+
+        if group_by and plan["metric"] in ("count", "rows"):
+            plan["metric"] = "count"
+        if group_by in ("director", "stars") and plan["metric"] == "mean":
+            plan["min_group_size"] = 3      # One-film directors would top every average
+        plan["descending"] = not re.search(_ASCENDING, text)
+        if plan["field"] == "year" and re.search(r"\b(?:newest|latest|recent)\b", text):
+            plan["descending"] = True
+
+        # A name we could not resolve ("total gross of Pixar films") would silently widen the filter
+        known = {word for condition in filters.values() for value in condition.get("any", []) for word in normalize(str(value)).split()}
+        unresolved = [word for word in re.findall(r"(?<!^)(?<![.?!] )\b[A-Z][\w'-]+", question.strip())
+                      if normalize(word) not in known and normalize(word) not in _KNOWN_CAPITALIZED]
+        if unresolved:
+            return None
+
+        limit = re.search(r"\btop\s+(\d+)\b|\b(\d+)\s+(?:\w+[- ])?(?:highest|most|best|longest|biggest|lowest|least|worst|shortest|oldest|newest|movies|films)\b", text)
+        if limit:
+            plan["limit"] = min(int(limit.group(1) or limit.group(2)), 50)
+        elif plan["metric"] == "rows" and not re.search(r"\b(?:movies|films)\b", text):
+            plan["limit"] = 1       # "the longest Kubrick film"
+
+        # "Who is the best director?" asks for a person, not for the movie row a plan without a group returns
+        if text.startswith("who ") and not group_by:
+            return None
+        if self._unused_constraint(question, plan):
+            return None
+        return AnalyticsPlan(**plan)
+
+    def _unused_constraint(self, question: str, plan: Dict[str, Any]) -> bool:
+        # True when the question names a year, number, certificate or genre the plan does not use,
+        # e.g. "top movies rated R": answering it over the whole catalogue would look exact but be wrong
+        lowered = _ALL_TIME.sub(" ", question.lower())
+        filters = plan["filters"]
+        if _YEAR_TERM.search(lowered) and "year" not in filters:
+            return True
+        used = {float(value) for condition in filters.values() for bound in condition.values()
+                for value in (bound if isinstance(bound, list) else [bound]) if isinstance(value, (int, float))}
+        if "limit" in plan:
+            used.add(float(plan["limit"]))
+        if any(float(number) not in used and float(number) * 60 not in used for number in _NUMBER.findall(lowered)):
+            return True      # Hours are matched against runtime filters in minutes
+        if _CERTIFICATE.search(lowered) and "certificate" not in filters and plan["group_by"] != "certificate":
+            return True
+        genres = filters.get("genre", {}).get("any", [])
+        return bool(_GENRE_LIKE.search(lowered)) or any(pattern.search(lowered) and genre not in genres for genre, pattern in _GENRE_TERMS.items())
+
+    def _mask(self, filters: Dict[str, Dict]):
+        mask = pd.Series(True, index=self.frame.index)
+        for field, condition in filters.items():
+            column = self.frame[field]
+            if "any" in condition:
+                if field in LIST_FIELDS:
+                    pattern = "|".join(re.escape(f"|{value}|") for value in condition["any"])
+                    mask &= self._joined[field].str.contains(pattern, regex=True)
+                else:
+                    mask &= column.isin(condition["any"])
+            elif "eq" in condition:
+                mask &= (column == condition["eq"]).fillna(False)
+            else:
+                for op, bound in condition.items():
+                    mask &= getattr(column, _PANDAS_OPERATORS[op])(bound).fillna(False)
+        return mask.astype(bool)
+
+    def run(self, plan: AnalyticsPlan) -> Dict[str, Any]:
+        """
+        Executes a plan with vectorized pandas operations.
+
+        Args:
+            plan (AnalyticsPlan): The plan to run.
+
+        Returns:
+            Dict[str, Any]: "matched" (rows after filtering) and "value" (a number) or "rows" (a list of dicts).
+        """
+        frame = self.frame[self._mask(plan.filters)]
+        result = {"matched": int(len(frame))}
+
+        if plan.group_by:
+            grouped = frame.explode(plan.group_by) if plan.group_by in LIST_FIELDS else frame
+            grouped = grouped.dropna(subset=[plan.group_by]).groupby(plan.group_by)
+            sizes = grouped.size()
+            if plan.metric == "count":
+                values = sizes
+            else:
+                values = grouped[plan.field].agg(plan.metric)[sizes >= plan.min_group_size].dropna()
+            values = values.sort_values(ascending=not plan.descending).head(plan.limit)
+            result["rows"] = [{"group": _plain(key), "value": _plain(value), "movies": int(sizes[key])} for key, value in values.items()]
+        elif plan.metric == "count":
+            result["value"] = result["matched"]
+        elif plan.metric == "rows":
+            field = plan.field or "rating"
+            top = frame.dropna(subset=[field]).sort_values(field, ascending=not plan.descending).head(plan.limit)
+            result["rows"] = [{"title": title, "year": _plain(year), field: _plain(value)} for title, year, value in zip(top["title"], top["year"], top[field])]
+        else:
+            value = frame[plan.field].agg(plan.metric)
+            result["value"] = None if pd.isna(value) else _plain(value)
+        return result
+
+    def answer(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Plans, runs and phrases the answer to a filter/sort/aggregate question.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            Dict[str, Any] | None: "answer" text, the "plan" and the raw "result"; None when the question is not analytical.
+        """
+        plan = self.plan(question)
+        if plan is None:
+            return None
+        result = self.run(plan)
+        return {"answer": describe_result(plan, result), "plan": plan.model_dump(), "result": result}
+
+
+def _plain(value):
+    # numpy/pandas scalars -> Python values for JSON responses
+    if pd.isna(value):
+        return None
+    value = value.item() if hasattr(value, "item") else value
+    return round(value, 2) if isinstance(value, float) else value
+
+
+METRIC_LABELS = {"mean": "average", "sum": "total", "min": "lowest", "max": "highest"}
+FIELD_LABELS = {"rating": "IMDb rating", "gross": "gross", "votes": "votes", "runtime": "runtime", "meta_score": "Metascore", "year": "release year"}
+
+
+def _format(field: Optional[str], value) -> str:
+    if value is None:
+        return "n/a"
+    if field == "gross":
+        return f"${value:,.0f}"
+    if field == "votes":
+        return f"{value:,.0f}"
+    if field == "runtime":
+        return f"{value:g} min"
+    return f"{value:g}" if isinstance(value, (int, float)) else str(value)
+
+
+def describe_filters(filters: Dict[str, Dict]) -> str:
+    """
+    Phrases plan filters for an answer, e.g. "Drama movies from 1990 to 1999 directed by Steven Spielberg".
+
+    Args:
+        filters (Dict[str, Dict]): Plan filters.
+
+    Returns:
+        str: The description.
+    """
+    words = {"gt": "above", "gte": "at least", "lt": "below", "lte": "at most"}
+    genre = " or ".join(filters["genre"]["any"]) + " " if "genre" in filters else ""
+    parts = [f"{genre}movies"]
+    for field, condition in filters.items():
+        if field == "genre":
+            continue
+        values = condition["any"] if "any" in condition else [condition["eq"]] if "eq" in condition else None
+        if field == "director":
+            parts.append(f"directed by {' or '.join(map(str, values))}")
+        elif field == "stars":
+            parts.append(f"starring {' or '.join(map(str, values))}")
+        elif field == "year" and values is None and set(condition) == {"gte", "lte"}:
+            parts.append(f"from {condition['gte']} to {condition['lte']}")
+        elif field == "year" and values is not None:
+            parts.append(f"released in {' or '.join(map(str, values))}")
+        elif values is not None:
+            parts.append(f"with {FIELD_LABELS.get(field, field)} {' or '.join(map(str, values))}")
+        else:
+            parts.append(" and ".join(f"with {FIELD_LABELS.get(field, field)} {words[op]} {_format(field, bound)}" for op, bound in condition.items()))
+    return " ".join(parts)
+
+
+def describe_result(plan: AnalyticsPlan, result: Dict[str, Any]) -> str:
+    """
+    Phrases a plan result as a short answer.
+
+    Args:
+        plan (AnalyticsPlan): The plan that was run.
+        result (Dict[str, Any]): Output of `MovieTable.run`.
+
+    Returns:
+        str: The answer text.
+    """
+    subject = describe_filters(plan.filters)
+    label = FIELD_LABELS.get(plan.field, plan.field)
+    if plan.group_by:
+        if not result["rows"]:
+            return f"No {subject} found in the catalogue."
+        what = "Number of movies" if plan.metric == "count" else f"{METRIC_LABELS[plan.metric].capitalize()} {label}"
+        values = "; ".join(
+            f"{row['group']}: {row['value'] if plan.metric == 'count' else _format(plan.field, row['value'])}" for row in result["rows"]
+        )
+        scope = f" for {subject}" if plan.filters else ""
+        return f"{what} per {plan.group_by}{scope}: {values}."
+    if plan.metric == "count":
+        return f"There are {result['value']} {subject} in the catalogue."
+    if plan.metric == "rows":
+        if not result["rows"]:
+            return f"No {subject} found in the catalogue."
+        order = "highest" if plan.descending else "lowest"
+        lines = [
+            f"{i}. {row['title']} ({row['year']})" + ("" if plan.field == "year" else f" - {_format(plan.field, row[plan.field])}")
+            for i, row in enumerate(result["rows"], start=1)
+        ]
+        return f"{subject[0].upper()}{subject[1:]} with the {order} {label} ({result['matched']} matched):\n" + "\n".join(lines)
+    if result["value"] is None:
+        return f"No {label} data for {subject} in the catalogue."
+    return f"The {METRIC_LABELS[plan.metric]} {label} of {subject} is {_format(plan.field, result['value'])} ({result['matched']} movies)."
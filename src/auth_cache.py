@@ -0,0 +1,100 @@
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def password_fingerprint(hashed_password: str) -> str:
+    """
+    Returns a short digest of a password hash, embedded in tokens so that a password
+    change invalidates tokens issued before it.
+
+    Args:
+        hashed_password (str): The stored bcrypt hash.
+
+    Returns:
+        str: 16 hex characters.
+    """
+    return hashlib.sha256(hashed_password.encode("utf-8")).hexdigest()[:16]
+
+
+class PrincipalCache:
+    """
+    Bounded TTL/LRU cache of authenticated users keyed by token subject (username), so an
+    authenticated request does not need a Mongo round-trip. Call `invalidate` whenever a
+    user is disabled or changes password (`update_user` does); the TTL bounds staleness across processes.
+    The time of each change is kept, so signed claims issued before it are no longer trusted either.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()     # username -> (expires_at, user)
+        self._changed: "OrderedDict[str, float]" = OrderedDict()     # username -> wall-clock time of the last change
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str):
+        """
+        Returns the cached user, or None when absent or expired.
+
+        Args:
+            username (str): The token subject.
+
+        Returns:
+            UserInDB | None: The cached user.
+        """
+        entry = self._entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user):
+        """
+        Caches a user loaded from the database, evicting the least recently used entry when full.
+
+        Args:
+            user (UserInDB): The user.
+        """
+        self._entries[user.username] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user.username)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        """
+        Drops one user from the cache, or every user when no username is given.
+
+        Args:
+            username (Optional[str]): The user to drop. Defaults to None (all).
+        """
+        if username is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(username, None)
+            self._changed[username] = time.time()
+            self._changed.move_to_end(username)
+            while len(self._changed) > self.max_entries:
+                self._changed.popitem(last=False)
+
+    def changed_since(self, username: str, issued_at: float) -> bool:
+        """
+        Returns True when the user was invalidated at or after `issued_at` (a token's iat).
+
+        Args:
+            username (str): The token subject.
+            issued_at (float): Unix time the token was issued.
+
+        Returns:
+            bool: Whether the token's claims predate a change to the user.
+        """
+        changed = self._changed.get(username)
+        return changed is not None and changed >= issued_at
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
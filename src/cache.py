@@ -0,0 +1,152 @@
+import time
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+from src.logger import logging
+
+
+class _CacheEntry:
+    __slots__ = ("scope", "vector", "answer", "expires_at", "nbytes")
+
+    def __init__(self, scope, vector, answer, expires_at):
+        self.scope = scope
+        self.vector = vector
+        self.answer = answer
+        self.expires_at = expires_at
+        self.nbytes = vector.nbytes + len(answer.encode("utf-8"))
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on the query embedding, so near-duplicate questions
+    ("who is in Inception", "Inception cast?") skip retrieval and the LLM call.
+
+    Entries are grouped by a scope derived from the session's chat history: a question
+    asked with no history can be served to anyone, while a follow-up only matches
+    entries created with exactly the same conversation context.
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl_seconds=3600, max_entries=5000, max_bytes=64 * 1024 * 1024):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()       # key -> _CacheEntry, least recently used first
+        self._scopes = {}                   # scope -> list of keys
+        self._matrices = {}                 # scope -> stacked vectors of that scope, rebuilt lazily
+        self._next_key = 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def scope_for(context: str) -> str:
+        """
+        Returns the cache scope for a chat-history context string.
+
+        Args:
+            context (str): The formatted chat history the query is asked in.
+
+        Returns:
+            str: A short hash; empty history maps to the shared "" scope.
+        """
+        if not context:
+            return ""
+        return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+    async def lookup(self, query: str, context: str = ""):
+        """
+        Embeds the query and looks for a cached answer above the similarity threshold.
+
+        Args:
+            query (str): The user's query.
+            context (str): The formatted chat history of the session.
+
+        Returns:
+            Tuple[str | None, np.ndarray]: The cached answer (None on a miss) and the
+            normalised query vector, to be passed back to `store` after a miss.
+        """
+        vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        vector /= (np.linalg.norm(vector) or 1.0)
+
+        scope = self.scope_for(context)
+        keys = self._scopes.get(scope)
+        if keys:
+            similarities = self._matrix(scope) @ vector
+            best = int(np.argmax(similarities))
+            key = keys[best]
+            entry = self._entries[key]
+            if similarities[best] >= self.threshold:
+                if entry.expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    logging.info(f"Semantic cache hit (similarity {similarities[best]:.3f})")
+                    return entry.answer, vector
+                self._remove(key)
+
+        self.misses += 1
+        return None, vector
+
+    def store(self, vector, context: str, answer: str):
+        """
+        Caches an answer under the query vector returned by `lookup`.
+
+        Args:
+            vector (np.ndarray): The normalised query vector.
+            context (str): The formatted chat history of the session.
+            answer (str): The answer to cache.
+        """
+        if not answer:
+            return
+
+        scope = self.scope_for(context)
+        key = self._next_key
+        self._next_key += 1
+
+        entry = _CacheEntry(scope, vector, answer, time.monotonic() + self.ttl_seconds)
+        self._entries[key] = entry
+        self._scopes.setdefault(scope, []).append(key)
+        self._matrices.pop(scope, None)
+        self.nbytes += entry.nbytes
+
+        # Evict least recently used entries until both caps hold
+        while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dict[str, float]: Entries, bytes, hits, misses, evictions and the hit ratio.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _matrix(self, scope):
+        matrix = self._matrices.get(scope)
+        if matrix is None:
+            matrix = np.vstack([self._entries[key].vector for key in self._scopes[scope]])
+            self._matrices[scope] = matrix
+        return matrix
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+        keys = self._scopes[entry.scope]
+        keys.remove(key)
+        if not keys:
+            del self._scopes[entry.scope]
+        self._matrices.pop(entry.scope, None)
@@ -0,0 +1,207 @@
+import re
+import difflib
+from typing import Dict, Iterable, List, Optional
+
+from src.hybrid import STOPWORDS
+from src.filters import extract_filters, normalize
+
+
+# Question words per answerable fact, checked against the normalized query
+FACT_PATTERNS = {
+    "cast": r"\b(?:actors?|actress(?:es)?|cast|stars?|starring|starred|acted|acts|plays?|played)\b|\bwho (?:is|was|are|were) in\b",
+    "director": r"\b(?:direct(?:ed|or|ors|s)?|filmmaker)\b|\bwho made\b",
+    "year": r"\b(?:what|which) year\b|\bwhen (?:was|did|is)\b|\breleased?\b|\brelease (?:date|year)\b|\bcame out\b",
+    "rating": r"\b(?:rating|rated|imdb score|meta ?score)\b",
+    "runtime": r"\bhow long\b|\b(?:runtime|run time|duration|length)\b|\bhow many minutes\b",
+    "genre": r"\bgenres?\b|\bwhat (?:kind|type|sort) of (?:movie|film)\b",
+}
+
+# Role questions ("who played the Joker", "starred as Batman") ask for a character, which the star list cannot answer
+ROLE_QUESTION = re.compile(
+    r"\b(?:play(?:s|ed|ing)?|portray(?:s|ed|ing)?|voic(?:es|ed|ing))\s+(?!in\b|on\b)\w+|\b(?:starred|acted|appeared|cast)\s+as\b|"
+    r"\bcharacters?\b|\broles?\b"
+)
+
+# Questions that need the overview, an opinion or reasoning go to the RAG chain
+OPEN_ENDED = re.compile(
+    r"\b(?:why|how does|how did|explain|describe|about|plot|story|summar\w*|recommend\w*|suggest\w*|similar|like|"
+    r"compare\w*|versus|vs|better|best|worst|review\w*|opinion|theme\w*|ending|meaning|should)\b"
+)
+
+# Vocabulary removed from a query before fuzzy-matching what is left against the titles
+_QUESTION_WORDS = frozenset(
+    "who whom what which when how many much long is was are were did does do in it its of the a an actors actor "
+    "actress actresses cast stars star starring starred acted acts play plays played direct directed director "
+    "directors directs made filmmaker year released release date came out rating rated imdb score metascore meta "
+    "runtime run time duration length minutes genre genres kind type sort movie film".split()
+)
+
+
+# Other words a plain lookup may contain; anything else outside the titles and names is a clause the
+# templates do not answer ("... and is it good?"), so the question goes to the RAG chain
+_LOOKUP_WORDS = frozenset(
+    "s t can could would you tell me please i want to know name names list show give find main lead leading all "
+    "come comes first originally total whole full exact".split()
+)
+_CONJUNCTIONS = frozenset("and or but also plus then".split())
+
+
+def _join(names: List[str]) -> str:
+    return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+class MovieCatalog:
+    """
+    In-memory title/director/star index over the typed movie metadata, used to answer
+    plain fact lookups ("Inception, who are actors in it?") without retrieval or the LLM.
+    """
+
+    def __init__(self, movies: Iterable[Dict], fuzzy_cutoff: float = 0.85):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.movies: List[Dict] = []
+        self.titles: Dict[str, List[Dict]] = {}       # normalized title -> movies (a few titles were remade)
+        self.directors: Dict[str, List[Dict]] = {}
+        self.stars: Dict[str, List[Dict]] = {}
+        self.names: Dict[str, str] = {}               # normalized person name -> display name
+
+        for movie in movies:
+            self.movies.append(movie)
+            title = normalize(movie["title"] or "")
+            for key in {title, title[4:] if title.startswith("the ") else title}:
+                if key:
+                    self.titles.setdefault(key, []).append(movie)
+            for index, names in ((self.directors, [movie["director"]]), (self.stars, movie["stars"])):
+                for name in filter(None, names):
+                    index.setdefault(normalize(name), []).append(movie)
+                    self.names[normalize(name)] = name
+
+        self._title_keys = list(self.titles)
+        self._max_words = max((key.count(" ") + 1 for key in list(self.titles) + list(self.names)), default=1)
+
+    def __len__(self):
+        return len(self.movies)
+
+    def _spans(self, words: List[str], index: Dict[str, List[Dict]]) -> List[str]:
+        # Longest-first, non-overlapping n-gram matches of the query words against an index
+        found, used = [], set()
+        for size in range(min(self._max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                span = range(start, start + size)
+                key = " ".join(words[start:start + size])
+                if key in index and not used.intersection(span):
+                    found.append(key)
+                    used.update(span)
+        return found
+
+    def find_movies(self, query: str, fuzzy: bool = True) -> List[Dict]:
+        """
+        Finds the movie a question is about, by exact normalized title first and fuzzy title second.
+
+        Args:
+            query (str): The user's query.
+            fuzzy (bool): Fall back to fuzzy matching when no title matches exactly. Defaults to True.
+
+        Returns:
+            List[Dict]: Metadata of the matching movies (more than one for remakes), or [] when none matched.
+        """
+        words = normalize(query).split()
+        for key in self._title_spans(query, words):
+            return self.titles[key]
+
+        subject = " ".join(word for word in words if word not in _QUESTION_WORDS and word not in STOPWORDS)
+        if not fuzzy or len(subject) < 4:
+            return []
+        match = difflib.get_close_matches(subject, self._title_keys, n=1, cutoff=self.fuzzy_cutoff)
+        return self.titles[match[0]] if match else []
+
+    def _title_spans(self, query: str, words: List[str]) -> List[str]:
+        # Titles such as "Up", "Her" or "Heat" are common words, so they must be capitalized in the query
+        return [
+            key for key in self._spans(words, self.titles)
+            if " " in key or (len(key) > 4 and key not in STOPWORDS and key not in _QUESTION_WORDS)
+            or re.search(rf"\b{re.escape(key.title())}\b", query)
+        ]
+
+    def find_people(self, query: str, index: Dict[str, List[Dict]]) -> List[str]:
+        """
+        Finds the full names of directors or stars mentioned in a question.
+
+        Args:
+            query (str): The user's query.
+            index (Dict[str, List[Dict]]): `directors` or `stars`.
+
+        Returns:
+            List[str]: Normalized names, longest match first.
+        """
+        return [key for key in self._spans(normalize(query).split(), index) if " " in key]
+
+    def answer(self, query: str) -> Optional[str]:
+        """
+        Answers cast, director, year, rating, runtime and genre questions straight from the index.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            str | None: The answer, or None when the question is open-ended or not about a known movie/person.
+        """
+        text = normalize(query)
+        facts = [fact for fact, pattern in FACT_PATTERNS.items() if re.search(pattern, text)]
+        if not facts or OPEN_ENDED.search(text) or ROLE_QUESTION.search(text):
+            return None
+        # Range and genre conditions ("Nolan films rated above 8") are not simple lookups
+        if set(extract_filters(query)) - {"director", "stars"}:
+            return None
+
+        # Compound questions ("Who directed Alien and Aliens?", "When was Heat released and is it good?")
+        # would only get their first part answered
+        titles = self._title_spans(query, text.split())
+        people = self.find_people(query, self.directors) + self.find_people(query, self.stars)
+        rest = f" {text} "
+        for key in titles + people:
+            rest = rest.replace(f" {key} ", " ", 1)
+        rest = rest.split()
+        if len(titles) > 1 or _CONJUNCTIONS.intersection(rest):
+            return None
+        plain = all(word in _QUESTION_WORDS or word in STOPWORDS or word in _LOOKUP_WORDS for word in rest)
+
+        movies = self.titles[titles[0]] if titles else []
+        if movies:
+            return self._describe_all(movies, facts) if plain else None
+        if people and not plain:
+            return None
+
+        # "Which films did Christopher Nolan direct?", "What movies has Tom Hanks acted in?"
+        for fact, index, verb in (("director", self.directors, "directed"), ("cast", self.stars, "starred in")):
+            if fact in facts:
+                for name in self.find_people(query, index):
+                    movies = sorted(index[name], key=lambda movie: movie["year"] or 0)
+                    titles = [f"{movie['title']} ({movie['year']})" if movie["year"] else movie["title"] for movie in movies]
+                    return f"{self.names[name]} {verb} {len(titles)} movies in the catalogue: {_join(titles)}."
+
+        # Misspelt titles ("Incepton cast") are only tried last, difflib is the slow part
+        movies = self.find_movies(query)
+        return self._describe_all(movies, facts) if movies else None
+
+    def _describe_all(self, movies: List[Dict], facts: List[str]) -> Optional[str]:
+        return " ".join(filter(None, (self._describe(movie, facts) for movie in movies))) or None
+
+    def _describe(self, movie: Dict, facts: List[str]) -> str:
+        title = f"{movie['title']} ({movie['year']})" if movie["year"] else movie["title"]
+        sentences = []
+        for fact in facts:
+            if fact == "cast" and movie["stars"]:
+                sentences.append(f"{title} stars {_join(movie['stars'])}.")
+            elif fact == "director" and movie["director"]:
+                sentences.append(f"{title} was directed by {movie['director']}.")
+            elif fact == "year":
+                sentences.append(f"{movie['title']} was released in {movie['year']}." if movie["year"]
+                                 else f"The release year of {movie['title']} is not recorded.")
+            elif fact == "rating" and movie["rating"] is not None:
+                meta_score = f" and a Metascore of {movie['meta_score']:g}" if movie["meta_score"] is not None else ""
+                sentences.append(f"{title} has an IMDb rating of {movie['rating']:g}{meta_score}.")
+            elif fact == "runtime" and movie["runtime"]:
+                sentences.append(f"{title} runs {movie['runtime']} minutes.")
+            elif fact == "genre" and movie["genre"]:
+                sentences.append(f"{title} is listed as {_join(movie['genre'])}.")
+        return " ".join(sentences)
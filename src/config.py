@@ -1,35 +1,131 @@
 import os
-import certifi
-from pymongo import MongoClient
 from dotenv import load_dotenv, find_dotenv
 
 
 load_dotenv(find_dotenv())
 
+# Vector store backend: "qdrant" (remote cluster) or "local" (in-process NumPy index saved under LOCAL_INDEX_DIR)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join("data", "local_index"))
+
+# Hybrid retrieval: BM25 index built by data_dump.py, fused with dense results by reciprocal rank
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join("data", "lexical_index.json"))
+HYBRID_K = int(os.getenv("HYBRID_K", 4))                          # Chunks passed to the LLM
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", 20))             # Candidates taken from each ranking before fusion
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", 1.0))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", 1.0))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_LEXICAL_ONLY_MAX_TERMS = int(os.getenv("HYBRID_LEXICAL_ONLY_MAX_TERMS", 3))   # Short keyword queries fully matched by BM25 skip the embedding call
+
+# Context assembly: ranked candidates are deduplicated by movie, diversified with MMR and packed into a token budget
+CONTEXT_ASSEMBLY_ENABLED = os.getenv("CONTEXT_ASSEMBLY_ENABLED", "true").lower() == "true"
+CONTEXT_K = int(os.getenv("CONTEXT_K", 4))                                  # Chunks passed to the LLM at most
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", 12))                     # Ranked candidates the chunks are picked from
+CONTEXT_SCORE_THRESHOLD = float(os.getenv("CONTEXT_SCORE_THRESHOLD", 0.0))  # Minimum dense relevance score in [0, 1]
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))            # 1.0 = relevance only, lower = more diverse
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 1500))             # Hard budget for the stuffed chunk texts
+
+# Structured fast path: fact lookups (cast, director, year, ...) answered from an in-memory index of the CSV
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+CATALOG_FILE_PATH = os.getenv("CATALOG_FILE_PATH", os.path.join("data", "imdb_top_1000.csv"))
+CATALOG_FUZZY_CUTOFF = float(os.getenv("CATALOG_FUZZY_CUTOFF", 0.85))     # difflib ratio needed to accept a misspelt title
+# Analytical questions (counts, averages, top-N) answered exactly from a pandas table of the same CSV
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+
 # Qdrant Configs
 QDRANT_COLLECTION_NAME = "imdb"
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_HOST=os.getenv("QDRANT_HOST")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"    # gRPC avoids JSON encoding of vectors
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
 
 # DB Connection
 MONGODB_URI = os.getenv("MONGODB_URI")
-# MongoDB Connection
-client = MongoClient(MONGODB_URI, tlsCAFile=certifi.where())  # SSL handshake failed
-db = client["chat_db"]  # Database Name
-sessions_collection = db["sessions"]  # Collection Name
-users_collection = db["users"]
+# MongoDB: one async client per process, opened in the FastAPI lifespan (see src/resources.py)
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "chat_db")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 100))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+MONGODB_TIMEOUT_MS = int(os.getenv("MONGODB_TIMEOUT_MS", 5000))     # Server selection timeout
 
 # LLM API Keys & COnfigs
 GROQ_API_KEY=os.getenv("GROQ_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME_LLAMA='deepseek-r1-distill-llama-70b'
+MODEL_NAME_FAST = os.getenv("MODEL_NAME_FAST", "llama-3.3-70b-versatile")     # Non-reasoning model for simple questions
+LLM_ROUTE_DEFAULT = os.getenv("LLM_ROUTE_DEFAULT", "auto")      # "auto", "reasoning" or "fast", when the request does not say
+SIMPLE_QUERY_MAX_WORDS = int(os.getenv("SIMPLE_QUERY_MAX_WORDS", 12))
+MAX_REASONING_TOKENS = int(os.getenv("MAX_REASONING_TOKENS", 0)) or None      # Default <think> budget per request, 0 = unlimited
+# Tried in order (after the fast model) when the routed model fails or misses its first-token deadline
+LLM_FALLBACK_MODELS = [name.strip() for name in os.getenv("LLM_FALLBACK_MODELS", "llama-3.1-8b-instant").split(",") if name.strip()]
+LLM_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT_SECONDS", 15))   # Per model attempt, 0 = no deadline
+LLM_STREAM_TIMEOUT_SECONDS = float(os.getenv("LLM_STREAM_TIMEOUT_SECONDS", 90))            # Whole generation, 0 = no deadline
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"           # Duplicate a request still silent after the hedge delay
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))                     # Hedge delay = this percentile of observed first-token latency
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", 2.0))              # Used until 20 latencies have been observed
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))                        # Consecutive failures that open a model's circuit
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+CONDENSE_TIMEOUT_SECONDS = float(os.getenv("CONDENSE_TIMEOUT_SECONDS", 3))              # Past it, retrieval uses the question as asked
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", 10))            # Embedding + vector search
+EMBEDDING_MODEL = "text-embedding-ada-002"     # 1536 dimensions, must match the Qdrant collection
 
 #  Data configs
 DATA_DUMP_FILE_PATH="C:/Users/saisu/Documents/Learning/RAG_project_imdb/data/imdb_top_1000.csv"
+DATA_READ_CHUNKSIZE = int(os.getenv("DATA_READ_CHUNKSIZE", 5000))     # CSV rows read per block while streaming documents
 CHUNK_SIZE=1000
 CHUNK_OVERLAP=50
+# On-disk cache of chunk embeddings, so re-ingesting an unchanged CSV makes no OpenAI calls
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "embedding_cache.sqlite3"))
+# Ingestion pipeline: documents per embedding/upsert batch, embedding requests in flight, retries per batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", 4))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", 5))
+INGEST_RETRY_BASE_DELAY = float(os.getenv("INGEST_RETRY_BASE_DELAY", 1.0))
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 5184000  # 10 years
+# Authenticated users cached by token subject, so a chat turn does not need a Mongo lookup
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", 300))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000))
+AUTH_TRUST_TOKEN_CLAIMS_SECONDS = int(os.getenv("AUTH_TRUST_TOKEN_CLAIMS_SECONDS", 0))     # Trust signed token claims this long after login, 0 = never
+# bcrypt worker threads and how many hash/verify calls may be running or queued before 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", 1))
 
 # Define a maximum context window (for last 5 messages)
-CONTEXT_WINDOW = 5
\ No newline at end of file
+CONTEXT_WINDOW = 5
+# Tokens of chat history in the answer prompt; older turns and long answers are cut first
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1000))
+# Follow-ups are rewritten into standalone questions with the fast model before retrieval
+CONDENSE_ENABLED = os.getenv("CONDENSE_ENABLED", "true").lower() == "true"
+CONDENSE_HISTORY_TOKENS = int(os.getenv("CONDENSE_HISTORY_TOKENS", 600))
+CONDENSE_MAX_TOKENS = int(os.getenv("CONDENSE_MAX_TOKENS", 64))
+CONDENSE_CACHE_SIZE = int(os.getenv("CONDENSE_CACHE_SIZE", 1024))
+
+# Identical queries asked in the same context while one is being answered share its answer
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+
+# Admission control for RAG queries: LLM calls running at once (lowered on provider 429s), and how many may wait, for how long
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 64))
+LLM_MAX_QUEUE_PER_USER = int(os.getenv("LLM_MAX_QUEUE_PER_USER", 4))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 10))
+
+# Seconds to keep the old clients open after a config hot-reload (SIGHUP), so in-flight queries can finish
+RESOURCE_RELOAD_GRACE_SECONDS = 30
+
+# Semantic answer cache in front of the RAG chain
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))     # Cosine similarity needed for a hit
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 5000))
+SEMANTIC_CACHE_MAX_BYTES = int(os.getenv("SEMANTIC_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Logging: records go through a queue to a background thread writing size-rotated files, as JSON lines or text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()                       # "json" or "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))           # Size at which the log file is rotated
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))                    # Rotated files kept
+# Queries, contexts and answers in the log: cut to this many characters, and only for this fraction of requests
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 500))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 1.0))
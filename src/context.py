@@ -0,0 +1,108 @@
+import math
+from collections import Counter
+from typing import Any, List
+from langchain.schema import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+
+from src.hybrid import tokenize
+from src.ingestion import get_row_key
+from src.conversation import estimate_tokens
+
+
+def movie_key(doc: Document) -> str:
+    """
+    Returns the movie a chunk belongs to, so duplicate points of one movie collapse into one.
+
+    Args:
+        doc (Document): A retrieved chunk.
+
+    Returns:
+        str: The row key, or title + year for legacy points without one.
+    """
+    metadata = doc.metadata
+    if metadata.get("row_key"):
+        return metadata["row_key"]
+    if metadata.get("title"):
+        return get_row_key(metadata["title"], metadata.get("year"))
+    return doc.page_content
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[token] for token, count in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def assemble_context(documents: List[Document], k: int = 4, max_tokens: int = 1500, mmr_lambda: float = 0.7) -> List[Document]:
+    """
+    Picks the chunks for the prompt from ranked candidates: one chunk per movie, diversified
+    with maximal marginal relevance, and packed into a hard token budget.
+
+    Relevance is taken from the retriever's ranking and redundancy from term overlap between
+    chunks, so the stage works the same after dense, hybrid or lexical-only retrieval.
+
+    Args:
+        documents (List[Document]): Candidates, best first.
+        k (int): Most chunks to keep. Defaults to 4.
+        max_tokens (int): Token budget for the chunk texts. Defaults to 1500.
+        mmr_lambda (float): 1.0 ranks by relevance only, lower values favour diversity. Defaults to 0.7.
+
+    Returns:
+        List[Document]: The selected chunks, in selection order.
+    """
+    unique, seen = [], set()
+    for doc in documents:
+        key = movie_key(doc)
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+
+    relevance = [1.0 - rank / len(unique) for rank in range(len(unique))]
+    terms = [Counter(tokenize(doc.page_content)) for doc in unique]
+    redundancy = [0.0] * len(unique)
+    remaining = list(range(len(unique)))
+    selected, budget = [], max_tokens
+
+    while remaining and len(selected) < k and budget > 0:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy[i])
+        remaining.remove(best)
+        doc, tokens = unique[best], estimate_tokens(unique[best].page_content)
+        if tokens > budget:
+            if selected:
+                continue        # A smaller chunk further down may still fit
+            # The best chunk alone is over budget: keep its beginning rather than nothing
+            doc = Document(page_content=doc.page_content[:budget * 4], metadata=doc.metadata, id=doc.id)
+            tokens = budget
+        selected.append(doc)
+        budget -= tokens
+        for i in remaining:
+            redundancy[i] = max(redundancy[i], _cosine(terms[i], terms[best]))
+    return selected
+
+
+class ContextRetriever(BaseRetriever):
+    """
+    Wraps the search retriever with `assemble_context`: the inner retriever returns `fetch_k`
+    ranked candidates, at most `k` distinct movies within `max_tokens` reach the prompt.
+    """
+
+    retriever: Any
+    k: int = 4
+    max_tokens: int = 1500
+    mmr_lambda: float = 0.7
+
+    def with_retriever(self, retriever) -> "ContextRetriever":
+        """
+        Returns a copy assembling the results of another (e.g. metadata-filtered) retriever.
+        """
+        return self.model_copy(update={"retriever": retriever})
+
+    def _assemble(self, documents: List[Document]) -> List[Document]:
+        return assemble_context(documents, k=self.k, max_tokens=self.max_tokens, mmr_lambda=self.mmr_lambda)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._assemble(self.retriever.invoke(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return self._assemble(await self.retriever.ainvoke(query))
@@ -0,0 +1,116 @@
+import re
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.logger import logging
+
+
+CONDENSE_INSTRUCTIONS = (
+    "You rewrite follow-up questions for a movie search engine. Given the conversation and a follow-up question, "
+    "rewrite the follow-up as a single standalone question that names every movie, person or criterion it refers to. "
+    "If it is already standalone, return it unchanged. Reply with the question only."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (about four characters per token), good enough for budgeting prompts.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + 3) // 4
+
+
+def history_within_budget(chat_history: List[Dict] = None, max_tokens: int = 1000) -> str:
+    """
+    Formats the most recent turns that fit in a token budget, newest kept first. Within a turn
+    the bot answer is truncated before the turn is dropped, since old answers matter least.
+
+    Args:
+        chat_history (Optional[List[Dict]]): Entries with "query" and "response", oldest first.
+        max_tokens (int): Token budget for the formatted history. Defaults to 1000.
+
+    Returns:
+        str: One "User: ...\nBot: ..." block per kept entry, oldest first.
+    """
+    blocks, remaining = [], max_tokens
+    for entry in reversed(chat_history or []):
+        user = f"User: {entry['query']}\nBot: "
+        room = remaining - estimate_tokens(user)
+        if room <= 0:
+            break
+        response = entry["response"]
+        if estimate_tokens(response) > room:
+            response = response[:room * 4].rsplit(" ", 1)[0] + " ..."
+        block = user + response
+        blocks.append(block)
+        remaining -= estimate_tokens(block)
+    return "\n".join(reversed(blocks))
+
+
+class QuestionCondenser:
+    """
+    Rewrites a follow-up question ("who directed it?") into a standalone one ("Who directed Inception?")
+    with a fast chat model, so retrieval embeds a short question instead of the whole conversation.
+
+    Rewrites are cached per session turn: the key is the history the rewrite saw plus the question,
+    so a retried or re-streamed turn does not pay for a second LLM call.
+    """
+
+    def __init__(self, llm, history_tokens: int = 600, max_tokens: int = 64, max_entries: int = 1024):
+        self.llm = llm.bind(max_tokens=max_tokens) if max_tokens else llm
+        self.history_tokens = history_tokens
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(history: str, query: str) -> str:
+        return hashlib.sha256(f"{history}\x00{query}".encode("utf-8")).hexdigest()
+
+    async def condense(self, query: str, chat_history: List[Dict] = None) -> str:
+        """
+        Returns the standalone version of a question.
+
+        Args:
+            query (str): The user's question.
+            chat_history (Optional[List[Dict]]): The session history. Defaults to None.
+
+        Returns:
+            str: The rewritten question, or `query` itself when there is no history or the rewrite fails.
+        """
+        if not chat_history:
+            return query
+        history = history_within_budget(chat_history, self.history_tokens)
+        key = self._key(history, query)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        self.misses += 1
+        try:
+            message = await self.llm.ainvoke([
+                SystemMessage(content=CONDENSE_INSTRUCTIONS),
+                HumanMessage(content=f"Conversation:\n{history}\n\nFollow-up question: {query}")
+            ])
+            standalone = re.sub(r"<think>.*?</think>", "", message.content, flags=re.DOTALL).strip().strip('"')
+        except Exception as e:
+            logging.warning(f"Could not condense the question, retrieving with it as asked: {e}")
+            return query
+        # An empty or rambling rewrite is worse than the original question
+        if not standalone or len(standalone) > 4 * len(query) + 200:
+            standalone = query
+
+        self._entries[key] = standalone
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return standalone
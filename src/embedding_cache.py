@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+from src.logger import logging
+
+
+class SQLiteEmbeddingCache(Embeddings):
+    """
+    Embeddings wrapper that persists document vectors in a local SQLite file, keyed by
+    a hash of the embedding model name and the chunk text. Re-ingesting an unchanged
+    CSV only reads the file; the provider is called for unseen chunks alone.
+    """
+
+    _LOOKUP_BATCH = 500     # Stay under SQLite's bound-parameter limit
+
+    def __init__(self, underlying: Embeddings, path: str, model_name: str):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._LOOKUP_BATCH):
+                batch = keys[start:start + self._LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _save(self, keys: List[str], vectors: List[List[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in zip(keys, vectors)]
+            )
+            self._conn.commit()
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(set(keys)))
+        missing = {}            # key -> text, de-duplicated so a repeated chunk is embedded once
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds documents, reading cached vectors and calling the provider only for new texts.
+
+        Args:
+            texts (List[str]): The chunk texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text, in order.
+        """
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            self._save(list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), vectors))
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async version of `embed_documents`.
+
+        Args:
+            texts (List[str]): The chunk texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text, in order.
+        """
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            self._save(list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), vectors))
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.underlying.aembed_query(text)
+
+    def close(self):
+        logging.info(f"Embedding cache: {self.hits} hits, {self.misses} misses")
+        with self._lock:
+            self._conn.close()
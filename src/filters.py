@@ -0,0 +1,247 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+from qdrant_client.http.models import Filter, FieldCondition, MatchAny, MatchValue, Range, PayloadSchemaType
+
+from src.local_store import LocalVectorStore
+
+
+# Typed movie metadata stored as Qdrant payload, with the index created for each field
+MOVIE_PAYLOAD_SCHEMA = {
+    "title": PayloadSchemaType.KEYWORD,
+    "year": PayloadSchemaType.INTEGER,
+    "genre": PayloadSchemaType.KEYWORD,
+    "rating": PayloadSchemaType.FLOAT,
+    "runtime": PayloadSchemaType.INTEGER,
+    "meta_score": PayloadSchemaType.FLOAT,
+    "votes": PayloadSchemaType.INTEGER,
+    "gross": PayloadSchemaType.INTEGER,
+    "director": PayloadSchemaType.KEYWORD,
+    "stars": PayloadSchemaType.KEYWORD,
+    "certificate": PayloadSchemaType.KEYWORD,
+}
+
+# Words that name a genre in a question, only when used as "<genre> movies/films" or in plural form
+GENRE_PATTERNS = {
+    "Action": r"action", "Adventure": r"adventure", "Animation": r"animat(?:ed|ion)", "Biography": r"biograph(?:y|ical)|biopics?",
+    "Comedy": r"comed(?:y|ies)", "Crime": r"crime", "Drama": r"dramas?", "Family": r"family", "Fantasy": r"fantasy",
+    "Film-Noir": r"film[- ]noir|noir", "History": r"histor(?:y|ical)", "Horror": r"horror", "Musical": r"musicals?",
+    "Mystery": r"myster(?:y|ies)", "Romance": r"roman(?:ce|tic)", "Sci-Fi": r"sci[- ]?fi|science[- ]fiction",
+    "Sport": r"sports?", "Thriller": r"thrillers?", "War": r"war", "Western": r"westerns?",
+}
+_MEDIA = r"(?:movies?|films?|pictures?|flicks?)"
+_PLURAL_GENRES = {"Comedy": r"comedies", "Drama": r"dramas", "Musical": r"musicals", "Thriller": r"thrillers", "Western": r"westerns"}
+
+_YEAR = r"((?:19|20)\d\d)(?!'?s\b)"      # A four-digit year, not a decade ("1990s")
+
+_COMPARATORS = {
+    "above": "gt", "over": "gt", "more than": "gt", "higher than": "gt", "greater than": "gt", "longer than": "gt",
+    "at least": "gte", "min": "gte", "minimum": "gte",
+    "below": "lt", "under": "lt", "less than": "lt", "lower than": "lt", "shorter than": "lt",
+    "at most": "lte", "max": "lte", "maximum": "lte",
+}
+_COMPARATOR = "|".join(sorted(map(re.escape, _COMPARATORS), key=len, reverse=True))
+
+
+def normalize(text: str) -> str:
+    """
+    Normalizes a title or name for matching: accents, case and punctuation are dropped.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: Lower-case ASCII words separated by single spaces.
+    """
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(re.findall(r"[a-z0-9]+", text.replace("&", " and ")))
+
+
+def people_index(movies: Iterable[Dict]) -> Dict[str, Dict[str, set]]:
+    """
+    Indexes director and star names by normalized full name and by surname, so names in a
+    question ("directed by Nolan") can be resolved to the exact payload values.
+
+    Args:
+        movies (Iterable[Dict]): Typed movie metadata, see `typed_metadata`.
+
+    Returns:
+        Dict[str, Dict[str, set]]: "director" and "stars" -> name key -> full names.
+    """
+    index = {"director": {}, "stars": {}}
+    for movie in movies:
+        for field, names in index.items():
+            values = movie.get(field)
+            for name in [values] if isinstance(values, str) else values if isinstance(values, list) else []:
+                key = normalize(name)
+                if key:
+                    names.setdefault(key, set()).add(name)
+                    names.setdefault(key.split()[-1], set()).add(name)
+    return index
+
+
+def resolve_name(name: str, names: Dict[str, set], max_matches: int = 3) -> List[str]:
+    """
+    Resolves a name taken from a question to known full names; trailing words that are not
+    part of the name ("Nolan In") are dropped until a match is found.
+
+    Args:
+        name (str): The name as written.
+        names (Dict[str, set]): One field of `people_index`.
+        max_matches (int): A name matching more people than this is too ambiguous. Defaults to 3.
+
+    Returns:
+        List[str]: The matching full names, empty when the name is unknown or ambiguous.
+    """
+    words = normalize(name).split()
+    for size in range(len(words), 0, -1):
+        matches = names.get(" ".join(words[:size]))
+        if matches:
+            return sorted(matches) if len(matches) <= max_matches else []
+    return []
+
+
+def extract_filters(query: str, people: Optional[Dict[str, Dict[str, set]]] = None) -> Dict[str, Dict]:
+    """
+    Extracts structured metadata filters from a natural-language question, e.g.
+    "90s crime films rated above 8.5" -> year 1990-1999, genre Crime, rating > 8.5.
+
+    Args:
+        query (str): The user's query.
+        people (Optional[Dict[str, Dict[str, set]]]): `people_index` of the catalogue, to resolve
+            director and star names. Without it names are used as written. Defaults to None.
+
+    Returns:
+        Dict[str, Dict]: Field -> condition, where a condition is {"gt"/"gte"/"lt"/"lte": number},
+        {"eq": value} or {"any": [values]}. Empty when nothing filterable was found.
+    """
+    text = query.lower()
+    filters = {}
+
+    # Decades: "90s", "1990s", "'90s", but not ages ("actors in their 40s")
+    for decade in re.finditer(r"(?<![\w.])(?:(19|20)|')?(\d)0'?s\b", text):
+        if re.search(r"\b(?:their|his|her|my|our|your)\s+(?:early\s+|late\s+|mid[- ]?)?'?$", text[:decade.start()]):
+            continue
+        century = decade.group(1) or ("20" if decade.group(2) in "012" else "19")
+        start = int(f"{century}{decade.group(2)}0")
+        filters["year"] = {"gte": start, "lte": start + 9}
+        break
+
+    # Year ranges: "between 1990 and 2000", "from 2015 to 2020", "1990-1999"; else single years:
+    # "in 1994", "of 2019", "during 1994", "2019 movies", "before 2000", "after 2010", "since 2010"
+    year_range = re.search(rf"\bbetween\s+{_YEAR}\s+and\s+{_YEAR}\b|\b{_YEAR}\s*(?:-|–|to|through|until|till)\s*{_YEAR}\b", text)
+    year = re.search(rf"\b(in|of|during|from|before|after|since)\s+(?:the\s+year\s+)?{_YEAR}\b|\b{_YEAR}\s+{_MEDIA}\b", text)
+    if year_range:
+        first, last = sorted(int(value) for value in year_range.groups() if value)
+        filters["year"] = {"gte": first, "lte": last}
+    elif year:
+        condition = {"before": "lt", "after": "gt", "since": "gte"}.get(year.group(1), "eq")
+        filters["year"] = {condition: int(year.group(2) or year.group(3))}
+
+    # Ratings: "rated above 8.5", "rating of at least 8", "imdb rating over 8"
+    rating = re.search(rf"\b(?:rated|rating|imdb(?: rating)?)\s+(?:of\s+)?({_COMPARATOR})\s+(\d+(?:\.\d+)?)", text)
+    if rating:
+        filters["rating"] = {_COMPARATORS[rating.group(1)]: float(rating.group(2))}
+
+    # Metascore: "metascore above 80"
+    meta_score = re.search(rf"\bmeta[- ]?score\s+(?:of\s+)?({_COMPARATOR})\s+(\d+)", text)
+    if meta_score:
+        filters["meta_score"] = {_COMPARATORS[meta_score.group(1)]: float(meta_score.group(2))}
+
+    # Runtime: "under 2 hours", "longer than 150 minutes"
+    runtime = re.search(rf"\b({_COMPARATOR})\s+(\d+(?:\.\d+)?)\s*(hours?|hrs?|minutes?|mins?)\b", text)
+    if runtime:
+        minutes = float(runtime.group(2)) * (60 if runtime.group(3).startswith("h") else 1)
+        filters["runtime"] = {_COMPARATORS[runtime.group(1)]: int(minutes)}
+
+    # Genres, e.g. "crime films", "comedies"
+    genres = [
+        genre for genre, pattern in GENRE_PATTERNS.items()
+        if re.search(rf"\b(?:{pattern})\s+{_MEDIA}\b", text)
+        or (genre in _PLURAL_GENRES and re.search(rf"\b{_PLURAL_GENRES[genre]}\b", text))
+    ]
+    if genres:
+        filters["genre"] = {"any": genres}
+
+    # Directors and cast: "directed by Christopher Nolan", "starring Tom Cruise" (case kept from the original query).
+    # Names are matched exactly, so one that does not resolve to a known person is left out rather than matching nothing
+    for field, phrase in (("director", "directed by"), ("stars", "starring")):
+        match = re.search(rf"\b{phrase}[ ]+((?:[A-Z][\w.'-]*[ ]?){{1,4}})", query)
+        if not match:
+            continue
+        name = match.group(1).strip().rstrip(".,;:!?'-")
+        names = resolve_name(name, people[field]) if people is not None else [name]
+        if names:
+            filters[field] = {"any": names}
+
+    return filters
+
+
+def build_qdrant_filter(filters: Dict[str, Dict], metadata_key: str = "metadata"):
+    """
+    Converts filters from `extract_filters` into a Qdrant payload filter.
+
+    Args:
+        filters (Dict[str, Dict]): Field -> condition.
+        metadata_key (str): Payload key the metadata is stored under. Defaults to "metadata".
+
+    Returns:
+        Filter | None: The Qdrant filter, or None when there is nothing to filter on.
+    """
+    conditions = []
+    for field, condition in filters.items():
+        key = f"{metadata_key}.{field}"
+        if "any" in condition:
+            conditions.append(FieldCondition(key=key, match=MatchAny(any=condition["any"])))
+        elif "eq" in condition:
+            conditions.append(FieldCondition(key=key, match=MatchValue(value=condition["eq"])))
+        else:
+            conditions.append(FieldCondition(key=key, range=Range(**condition)))
+    return Filter(must=conditions) if conditions else None
+
+
+def matches_filters(metadata: Dict, filters: Dict[str, Dict]) -> bool:
+    """
+    Evaluates filters from `extract_filters` against one document's metadata in Python.
+
+    Args:
+        metadata (Dict): The document metadata.
+        filters (Dict[str, Dict]): Field -> condition.
+
+    Returns:
+        bool: True when every condition holds.
+    """
+    for field, condition in filters.items():
+        value = metadata.get(field)
+        if "any" in condition:
+            values = value if isinstance(value, list) else [value]
+            if not set(condition["any"]).intersection(values):
+                return False
+        elif "eq" in condition:
+            if value != condition["eq"]:
+                return False
+        else:
+            if value is None:
+                return False
+            for op, bound in condition.items():
+                if not {"gt": value > bound, "gte": value >= bound, "lt": value < bound, "lte": value <= bound}[op]:
+                    return False
+    return True
+
+
+def to_search_filter(vector_store, filters: Dict[str, Dict]):
+    """
+    Converts filters into the form the vector store's search expects.
+
+    Args:
+        vector_store (Qdrant | LocalVectorStore): The store that will run the search.
+        filters (Dict[str, Dict]): Field -> condition.
+
+    Returns:
+        Filter | Dict | None: A Qdrant filter, the filters unchanged for the local backend, or None.
+    """
+    if not filters:
+        return None
+    if isinstance(vector_store, LocalVectorStore):
+        return filters      # The local backend evaluates the filters directly
+    return build_qdrant_filter(filters, vector_store.metadata_payload_key)
@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import math
+import heapq
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from langchain.schema import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+
+from src.logger import logging
+from src.filters import matches_filters, to_search_filter
+
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which who whom "
+    "with me show find give list tell movie movies film films about user bot".split()     # "User:"/"Bot:" prefix history turns
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cases and splits text into word tokens, dropping stopwords.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The tokens.
+    """
+    return [token for token in re.findall(r"\w+", text.lower()) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunk Documents produced at ingestion time. It is
+    strong exactly where embeddings are weak: director and actor names, rare titles.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Document] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}     # term -> [(document position, term frequency)]
+        self.lengths: List[int] = []
+        self._positions: Dict[str, int] = {}                     # document id -> position
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Adds Documents to the index; a Document whose id is already indexed is skipped.
+
+        Args:
+            documents (List[Document]): Chunk Documents with an id.
+        """
+        for doc in documents:
+            if doc.id in self._positions:
+                continue
+            position = len(self.documents)
+            self._positions[doc.id] = position
+            self.documents.append(doc)
+            terms = Counter(tokenize(doc.page_content))
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, []).append((position, frequency))
+
+    def search(self, query: str, k: int = 4, filters: Optional[Dict[str, Dict]] = None) -> List[Tuple[Document, float]]:
+        """
+        Ranks documents against the query with BM25.
+
+        Args:
+            query (str): The query.
+            k (int): Number of documents to return. Defaults to 4.
+            filters (Optional[Dict[str, Dict]]): Metadata filters from `extract_filters`.
+
+        Returns:
+            List[Tuple[Document, float]]: Documents and BM25 scores, best first.
+        """
+        if not self.documents:
+            return []
+        total, average_length = len(self.documents), sum(self.lengths) / len(self.documents)
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        if filters:
+            candidates = ((score, position) for position, score in scores.items()
+                          if matches_filters(self.documents[position].metadata, filters))
+        else:
+            candidates = ((score, position) for position, score in scores.items())
+        return [(self.documents[position], score) for score, position in heapq.nlargest(k, candidates)]
+
+    def covers(self, query: str, document: Document) -> bool:
+        """
+        Returns True when every query term appears in the document, i.e. a keyword-style hit.
+        """
+        terms = set(tokenize(query))
+        return bool(terms) and terms.issubset(tokenize(document.page_content))
+
+    def save(self, path: str):
+        """
+        Writes the index as JSON, replacing the previous file atomically.
+
+        Args:
+            path (str): File to write.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1, "b": self.b, "lengths": self.lengths, "postings": self.postings,
+                "documents": [{"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata} for doc in self.documents],
+            }, f)
+        os.replace(f"{path}.tmp", path)
+        logging.info(f"Lexical index with {len(self.documents)} documents saved to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        """
+        Loads an index saved with `save`.
+
+        Args:
+            path (str): File to read.
+
+        Returns:
+            LexicalIndex | None: The index, or None when the file does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.documents = [Document(**doc) for doc in data["documents"]]
+        index.lengths = data["lengths"]
+        index.postings = {term: [tuple(entry) for entry in postings] for term, postings in data["postings"].items()}
+        index._positions = {doc.id: position for position, doc in enumerate(index.documents)}
+        return index
+
+
+def _document_key(doc: Document) -> str:
+    # Qdrant results carry the point ID in metadata["_id"], local and lexical results in doc.id
+    return str(doc.id or doc.metadata.get("_id") or doc.page_content)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], weights: List[float], k: int, rrf_k: int = 60) -> List[Document]:
+    """
+    Fuses ranked lists with weighted reciprocal-rank fusion: score = sum(weight / (rrf_k + rank)).
+
+    Args:
+        rankings (List[List[Document]]): Ranked result lists, best first.
+        weights (List[float]): One weight per list.
+        k (int): Number of documents to return.
+        rrf_k (int): Rank damping constant. Defaults to 60.
+
+    Returns:
+        List[Document]: The top k fused documents.
+    """
+    scores, documents = Counter(), {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            key = _document_key(doc)
+            scores[key] += weight / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key, _ in scores.most_common(k)]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining dense vector search with the BM25 `LexicalIndex` via reciprocal-rank
+    fusion. Keyword-style queries fully covered by a lexical hit skip the embedding call.
+    """
+
+    vector_store: Any
+    lexical_index: Any
+    k: int = 4
+    fetch_k: int = 20
+    dense_weight: float = 1.0
+    lexical_weight: float = 1.0
+    rrf_k: int = 60
+    lexical_only_max_terms: int = 3
+    score_threshold: float = 0.0        # Minimum dense relevance score in [0, 1], 0 keeps every candidate
+    filters: Dict[str, Dict] = {}
+
+    def with_filters(self, filters: Dict[str, Dict]) -> "HybridRetriever":
+        """
+        Returns a copy of the retriever restricted by metadata filters.
+        """
+        return self.model_copy(update={"filters": filters})
+
+    def _lexical(self, query: str):
+        lexical = [doc for doc, _ in self.lexical_index.search(query, k=self.fetch_k, filters=self.filters)]
+        keyword_style = 0 < len(tokenize(query)) <= self.lexical_only_max_terms
+        return lexical, keyword_style and bool(lexical) and self.lexical_index.covers(query, lexical[0])
+
+    def _fuse(self, dense: List[Document], lexical: List[Document]) -> List[Document]:
+        return reciprocal_rank_fusion([dense, lexical], [self.dense_weight, self.lexical_weight], k=self.k, rrf_k=self.rrf_k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        lexical, lexical_only = self._lexical(query)
+        if lexical_only:
+            return lexical[:self.k]
+        search_filter = to_search_filter(self.vector_store, self.filters)
+        if self.score_threshold:
+            scored = self.vector_store.similarity_search_with_relevance_scores(
+                query, k=self.fetch_k, filter=search_filter, score_threshold=self.score_threshold)
+            dense = [doc for doc, _ in scored]
+        else:
+            dense = self.vector_store.similarity_search(query, k=self.fetch_k, filter=search_filter)
+        return self._fuse(dense, lexical)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        lexical, lexical_only = self._lexical(query)
+        if lexical_only:
+            return lexical[:self.k]
+        search_filter = to_search_filter(self.vector_store, self.filters)
+        if self.score_threshold:
+            scored = await self.vector_store.asimilarity_search_with_relevance_scores(
+                query, k=self.fetch_k, filter=search_filter, score_threshold=self.score_threshold)
+            dense = [doc for doc, _ in scored]
+        else:
+            dense = await self.vector_store.asimilarity_search(query, k=self.fetch_k, filter=search_filter)
+        return self._fuse(dense, lexical)
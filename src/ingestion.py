@@ -0,0 +1,283 @@
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+from itertools import groupby
+from typing import Dict, Iterable
+from langchain.schema import Document
+from qdrant_client.http.models import PointStruct
+
+from src.logger import logging
+from src.exception import ImdbException
+from src.local_store import LocalVectorStore
+from src.config import INGEST_BATCH_SIZE, INGEST_EMBED_CONCURRENCY, INGEST_MAX_RETRIES, INGEST_RETRY_BASE_DELAY
+
+
+# Fixed namespace so the same movie chunk always maps to the same Qdrant point ID
+POINT_ID_NAMESPACE = uuid.UUID("6f1c3a52-93d4-4c59-9a57-0d3b8e2f7a41")
+
+
+def get_row_key(title, year) -> str:
+    """
+    Returns the identity of a movie row: Series_Title + Released_Year.
+
+    Args:
+        title (str): The movie title.
+        year (str | int): The release year.
+
+    Returns:
+        str: The row key.
+    """
+    return f"{title}|{year}"
+
+
+def get_point_id(row_key: str, chunk_index: int) -> str:
+    """
+    Returns a deterministic Qdrant point ID for one chunk of a movie row, so
+    re-running the ingestion overwrites points instead of duplicating them.
+
+    Args:
+        row_key (str): The row identity from `get_row_key` (Series_Title + Released_Year).
+        chunk_index (int): Position of the chunk within the row's text.
+
+    Returns:
+        str: A UUID5 string.
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{row_key}|{chunk_index}"))
+
+
+def get_row_hash(document: Document) -> str:
+    """
+    Returns a content hash of a movie Document, used to detect changed rows.
+
+    Args:
+        document (Document): The row-level Document built from the CSV.
+
+    Returns:
+        str: A sha256 hex digest of the page content and metadata.
+    """
+    payload = json.dumps(document.metadata, sort_keys=True, default=str) + "\x00" + document.page_content
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def fetch_existing_rows(vector_store, page_size: int = 1000):
+    """
+    Scrolls the collection and groups the stored point IDs by row key.
+
+    Args:
+        vector_store (Qdrant | LocalVectorStore): Vector store with an async Qdrant client, or the local index.
+        page_size (int): Points fetched per scroll request.
+
+    Returns:
+        Tuple[Dict[str, Dict], List[str]]: {row_key: {"row_hash": str, "ids": set}} and the
+        IDs of legacy points without a row key (left over from random-ID ingestion runs).
+    """
+    existing, legacy_ids = {}, []
+
+    def add(point_id, metadata):
+        key = metadata.get("row_key")
+        if key is None:
+            legacy_ids.append(point_id)
+            return
+        row = existing.setdefault(key, {"row_hash": metadata.get("row_hash"), "ids": set()})
+        row["ids"].add(str(point_id))
+
+    if isinstance(vector_store, LocalVectorStore):
+        for point_id, metadata in vector_store.iter_metadata():
+            add(point_id, metadata)
+        return existing, legacy_ids
+
+    metadata_key = vector_store.metadata_payload_key
+    offset = None
+
+    while True:
+        points, offset = await vector_store.async_client.scroll(
+            collection_name=vector_store.collection_name,
+            with_payload=[f"{metadata_key}.row_key", f"{metadata_key}.row_hash"],
+            with_vectors=False,
+            limit=page_size,
+            offset=offset
+        )
+        for point in points:
+            add(point.id, (point.payload or {}).get(metadata_key) or {})
+        if offset is None:
+            break
+
+    return existing, legacy_ids
+
+
+async def with_retry(func, *args, retries: int = INGEST_MAX_RETRIES, base_delay: float = INGEST_RETRY_BASE_DELAY, label: str = "request"):
+    """
+    Awaits `func(*args)`, retrying with jittered exponential backoff on failure.
+
+    Args:
+        func (Callable): Coroutine function to call.
+        retries (int): Retries after the first attempt. Defaults to INGEST_MAX_RETRIES.
+        base_delay (float): Delay in seconds before the first retry; doubled on each retry.
+        label (str): Name used in the log message.
+
+    Returns:
+        Any: The result of `func`.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = base_delay * 2 ** attempt * (0.5 + random.random())
+            logging.warning(f"{label} failed (attempt {attempt + 1}/{retries + 1}): {e}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def _batched(documents: Iterable[Document], batch_size: int):
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def upsert_documents(vector_store, documents: Iterable[Document], batch_size: int = INGEST_BATCH_SIZE,
+                           concurrency: int = INGEST_EMBED_CONCURRENCY) -> Dict[str, float]:
+    """
+    Streams Documents into Qdrant as a producer/consumer pipeline: up to `concurrency`
+    batches are embedded at once while earlier batches are being upserted. Each embedding
+    and upsert call is retried on its own, so a transient error does not abort the load.
+
+    Args:
+        vector_store (Qdrant | LocalVectorStore): Vector store with an async Qdrant client, or the local index.
+        documents (Iterable[Document]): Documents with a point ID; may be a generator.
+        batch_size (int): Documents per embedding request and upsert. Defaults to INGEST_BATCH_SIZE.
+        concurrency (int): Embedding requests in flight. Defaults to INGEST_EMBED_CONCURRENCY.
+
+    Returns:
+        Dict[str, float]: Documents and batches written, elapsed seconds and docs/sec.
+    """
+    embeddings = vector_store.embeddings
+    queue = asyncio.Queue(maxsize=concurrency)
+    slots = asyncio.Semaphore(concurrency)
+    report = {"documents": 0, "batches": 0}
+    start = time.perf_counter()
+
+    async def embed(batch):
+        try:
+            vectors = await with_retry(embeddings.aembed_documents, [doc.page_content for doc in batch], label="Embedding batch")
+            await queue.put((batch, vectors))
+        finally:
+            slots.release()
+
+    async def upsert(batch, vectors):
+        if isinstance(vector_store, LocalVectorStore):
+            vector_store.add_vectors([doc.id for doc in batch], vectors, [doc.page_content for doc in batch], [doc.metadata for doc in batch])
+            return
+        points = [
+            PointStruct(
+                id=doc.id,
+                vector={vector_store.vector_name: vector} if vector_store.vector_name else vector,
+                payload={vector_store.content_payload_key: doc.page_content, vector_store.metadata_payload_key: doc.metadata}
+            )
+            for doc, vector in zip(batch, vectors)
+        ]
+        await vector_store.async_client.upsert(collection_name=vector_store.collection_name, points=points)
+
+    async def consume():
+        while (item := await queue.get()) is not None:
+            batch, vectors = item
+            await with_retry(upsert, batch, vectors, label="Vector store upsert")
+
+            report["documents"] += len(batch)
+            report["batches"] += 1
+            elapsed = time.perf_counter() - start
+            logging.info(f"Upserted {report['documents']} documents in {elapsed:.1f}s ({report['documents'] / elapsed:.1f} docs/sec)")
+
+    # A failure in any stage (after its retries) cancels the whole pipeline
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(consume())
+            embed_tasks = []
+            for batch in _batched(documents, batch_size):
+                await slots.acquire()
+                embed_tasks.append(group.create_task(embed(batch)))
+            await asyncio.gather(*embed_tasks)
+            await queue.put(None)
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0]
+
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    report["docs_per_sec"] = round(report["documents"] / report["seconds"], 1) if report["seconds"] else 0.0
+    return report
+
+
+async def sync_collection(vector_store, chunked_documents: Iterable[Document], diff: bool = True,
+                          batch_size: int = INGEST_BATCH_SIZE, concurrency: int = INGEST_EMBED_CONCURRENCY,
+                          lexical_index=None) -> Dict[str, float]:
+    """
+    Upserts chunked movie Documents under their deterministic IDs. In diff mode the CSV
+    is compared with the collection first: unchanged rows are skipped, changed rows are
+    re-upserted, and rows (or legacy points) no longer in the CSV are deleted.
+
+    Args:
+        vector_store (Qdrant | LocalVectorStore): Vector store with an async Qdrant client, or the local index.
+        chunked_documents (Iterable[Document]): Chunks from `get_chunked_data`, carrying
+            row_key/row_hash metadata and a point ID; chunks of a row must be consecutive.
+        diff (bool): Compare against the collection before writing. Defaults to True.
+        batch_size (int): Documents per embedding request and upsert. Defaults to INGEST_BATCH_SIZE.
+        concurrency (int): Embedding requests in flight. Defaults to INGEST_EMBED_CONCURRENCY.
+        lexical_index (Optional[LexicalIndex]): BM25 index to fill with every chunk, changed or not.
+
+    Returns:
+        Dict[str, float]: Rows added, updated, deleted and skipped, points upserted and
+        deleted, and the upsert throughput in docs/sec.
+    """
+    try:
+        existing, stale_ids = (await fetch_existing_rows(vector_store)) if diff else ({}, [])
+        summary = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
+        seen = set()
+
+        # Lazily yields only the chunks of new or changed rows
+        def changed_chunks():
+            for key, docs in groupby(chunked_documents, key=lambda doc: doc.metadata["row_key"]):
+                docs = list(docs)
+                seen.add(key)
+                if lexical_index is not None:
+                    lexical_index.add_documents(docs)
+                current = existing.get(key)
+                if current is None:
+                    summary["added"] += 1
+                elif current["row_hash"] == docs[0].metadata["row_hash"]:
+                    summary["skipped"] += 1
+                    continue
+                else:
+                    summary["updated"] += 1
+                    # A changed row can have fewer chunks than before, drop the leftovers
+                    stale_ids.extend(current["ids"] - {doc.id for doc in docs})
+                yield from docs
+
+        report = await upsert_documents(vector_store, changed_chunks(), batch_size=batch_size, concurrency=concurrency)
+
+        for key, current in existing.items():
+            if key not in seen:
+                summary["deleted"] += 1
+                stale_ids.extend(current["ids"])
+
+        for start in range(0, len(stale_ids), 1000):
+            await with_retry(vector_store.adelete, stale_ids[start:start + 1000], label="Vector store delete")
+
+        if isinstance(vector_store, LocalVectorStore):
+            vector_store.save()
+
+        summary["points_upserted"] = report["documents"]
+        summary["points_deleted"] = len(stale_ids)
+        summary["docs_per_sec"] = report["docs_per_sec"]
+        logging.info(f"Ingestion summary: {summary}")
+        return summary
+
+    except Exception as e:
+        raise ImdbException(e, sys)
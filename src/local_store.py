@@ -0,0 +1,240 @@
+import os
+import json
+import uuid
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store over a float32 NumPy matrix, for catalogues small enough
+    (1k-100k movies) that a network hop per search costs more than the search itself.
+
+    Vectors are saved as `vectors.npy` and memory-mapped on load; texts and metadata are
+    kept in `records.json`. Search takes the same filters as the Qdrant backend, in the
+    form returned by `src.filters.extract_filters`.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: Optional[str] = None):
+        self._embeddings = embeddings
+        self.path = path
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._rows: Dict[str, int] = {}     # id -> row in the matrix
+        self._columns: Dict[str, Any] = {}  # field -> array of metadata values, built lazily for filtering
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def __len__(self):
+        return len(self._ids)
+
+    @classmethod
+    def load(cls, path: str, embeddings: Embeddings) -> "LocalVectorStore":
+        """
+        Loads an index saved with `save`, memory-mapping the vectors. A missing index gives an empty store.
+
+        Args:
+            path (str): Directory of the index.
+            embeddings (Embeddings): Embeddings used for queries and new texts.
+
+        Returns:
+            LocalVectorStore: The loaded store.
+        """
+        store = cls(embeddings, path)
+        vectors_path, records_path = os.path.join(path, "vectors.npy"), os.path.join(path, "records.json")
+        if os.path.exists(vectors_path) and os.path.exists(records_path):
+            store._vectors = np.load(vectors_path, mmap_mode="r")
+            with open(records_path, encoding="utf-8") as f:
+                records = json.load(f)
+            store._ids, store._texts, store._metadatas = records["ids"], records["texts"], records["metadatas"]
+            store._rows = {point_id: row for row, point_id in enumerate(store._ids)}
+        return store
+
+    def save(self, path: Optional[str] = None):
+        """
+        Writes the index to disk, replacing the previous files atomically.
+
+        Args:
+            path (Optional[str]): Directory to write to. Defaults to the path the store was loaded from.
+        """
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "vectors.tmp.npy"), "wb") as f:
+            np.save(f, np.ascontiguousarray(self._vectors, dtype=np.float32))
+        with open(os.path.join(path, "records.tmp.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "texts": self._texts, "metadatas": self._metadatas}, f)
+        os.replace(os.path.join(path, "vectors.tmp.npy"), os.path.join(path, "vectors.npy"))
+        os.replace(os.path.join(path, "records.tmp.json"), os.path.join(path, "records.json"))
+        self.path = path
+
+    def iter_metadata(self) -> Iterable[Tuple[str, Dict]]:
+        """
+        Yields (id, metadata) for every stored point.
+        """
+        return zip(self._ids, self._metadatas)
+
+    def add_vectors(self, ids: List[str], vectors: List[List[float]], texts: List[str], metadatas: List[Dict]):
+        """
+        Upserts precomputed vectors; an existing ID is overwritten in place.
+
+        Args:
+            ids (List[str]): Point IDs.
+            vectors (List[List[float]]): One embedding per text.
+            texts (List[str]): Page contents.
+            metadatas (List[Dict]): Metadata per text.
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)     # Cosine as a dot product
+
+        # A memory-mapped matrix is read-only, copy it before the first write
+        vectors_in_memory = self._vectors if len(self._ids) == 0 or self._vectors.flags.writeable else np.array(self._vectors)
+        base, new_rows = len(self._ids), []
+        for point_id, vector, text, metadata in zip(ids, matrix, texts, metadatas):
+            row = self._rows.get(point_id)
+            if row is None:
+                self._rows[point_id] = len(self._ids)
+                new_rows.append(vector)
+                self._ids.append(point_id)
+                self._texts.append(text)
+                self._metadatas.append(metadata)
+                continue
+            if row < base:
+                vectors_in_memory[row] = vector
+            else:       # Repeated ID within this batch
+                new_rows[row - base] = vector
+            self._texts[row], self._metadatas[row] = text, metadata
+
+        if new_rows:
+            new_rows = np.vstack(new_rows)
+            vectors_in_memory = new_rows if vectors_in_memory.size == 0 else np.vstack([vectors_in_memory, new_rows])
+        self._vectors = vectors_in_memory
+        self._columns = {}
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self.add_vectors(ids, self._embeddings.embed_documents(texts), texts, metadatas or [{} for _ in texts])
+        return ids
+
+    async def aadd_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self.add_vectors(ids, await self._embeddings.aembed_documents(texts), texts, metadatas or [{} for _ in texts])
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        removed = {self._rows[point_id] for point_id in ids or [] if point_id in self._rows}
+        if not removed:
+            return True
+        keep = [row for row in range(len(self._ids)) if row not in removed]
+        self._vectors = np.array(self._vectors[keep]) if keep else np.zeros((0, 0), dtype=np.float32)
+        self._ids = [self._ids[row] for row in keep]
+        self._texts = [self._texts[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        self._rows = {point_id: row for row, point_id in enumerate(self._ids)}
+        self._columns = {}
+        return True
+
+    async def adelete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        return self.delete(ids)
+
+    def _column(self, field: str):
+        if field not in self._columns:
+            values = np.empty(len(self._metadatas), dtype=object)      # Element-wise, so list values stay lists
+            for row, metadata in enumerate(self._metadatas):
+                values[row] = metadata.get(field)
+            self._columns[field] = values
+        return self._columns[field]
+
+    def _numbers(self, field: str):
+        key = f"{field}#numeric"
+        if key not in self._columns:
+            self._columns[key] = np.array([np.nan if v is None else v for v in self._column(field)], dtype=float)
+        return self._columns[key]
+
+    def _mask(self, filters: Optional[Dict[str, Dict]]):
+        mask = np.ones(len(self._ids), dtype=bool)
+        for field, condition in (filters or {}).items():
+            values = self._column(field)
+            if "any" in condition:
+                wanted = set(condition["any"])
+                mask &= np.fromiter(
+                    (bool(wanted.intersection(v)) if isinstance(v, list) else v in wanted for v in values),
+                    dtype=bool, count=len(values)
+                )
+            elif "eq" in condition:
+                mask &= values == condition["eq"]
+            else:
+                numbers = self._numbers(field)
+                with np.errstate(invalid="ignore"):
+                    for op, bound in condition.items():
+                        mask &= {"gt": np.greater, "gte": np.greater_equal, "lt": np.less, "lte": np.less_equal}[op](numbers, bound)
+        return mask
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Dict] = None,
+                                               score_threshold: Optional[float] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        Returns the k most similar documents with their cosine similarity.
+
+        Args:
+            embedding (List[float]): Query vector.
+            k (int): Number of documents to return. Defaults to 4.
+            filter (Optional[Dict]): Filters from `extract_filters`, applied before ranking.
+            score_threshold (Optional[float]): Drop results below this similarity.
+
+        Returns:
+            List[Tuple[Document, float]]: Documents and scores, best first.
+        """
+        if not self._ids:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+
+        candidates = np.flatnonzero(self._mask(filter)) if filter else np.arange(len(self._ids))
+        if candidates.size == 0:
+            return []
+        scores = self._vectors[candidates] @ query if filter else self._vectors @ query
+        top = np.argpartition(-scores, min(k, scores.size) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for position in top:
+            score = float(scores[position])
+            if score_threshold is not None and score < score_threshold:
+                continue
+            row = int(candidates[position])
+            results.append((Document(id=self._ids[row], page_content=self._texts[row], metadata=self._metadatas[row]), score))
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k=k, filter=filter, **kwargs)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = await self._embeddings.aembed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k=k, filter=filter, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score      # Already cosine similarity
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[Dict]] = None,
+                   ids: Optional[List[str]] = None, path: Optional[str] = None, **kwargs: Any) -> "LocalVectorStore":
+        store = cls(embedding, path)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -1,6 +1,14 @@
 import os
+import json
+import zlib
+import queue
+import atexit
 import logging
 from datetime import datetime
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from src.config import LOG_FORMAT, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_PAYLOAD_MAX_CHARS, LOG_PAYLOAD_SAMPLE_RATE
 
 
 #log file name
@@ -16,8 +24,75 @@ os.makedirs(LOG_FILE_DIR,exist_ok=True)
 
 LOG_FILE_PATH = os.path.join(LOG_FILE_DIR,LOG_FILE_NAME)
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[%(asctime)s] %(lineno)d - %(filename)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s",
-    level=logging.INFO,
-)
\ No newline at end of file
+TEXT_FORMAT = "[%(asctime)s] %(request_id)s %(lineno)d - %(filename)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s"
+
+#correlation id of the request being handled, set by the metrics middleware
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+#attributes every LogRecord has; anything else was passed with `extra=` and goes into the JSON line
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request's correlation id to every record as `request_id`."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, `extra=` fields included."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "file": record.filename,
+            "line": record.lineno,
+            "function": record.funcName,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def shorten_payload(text) -> str:
+    """
+    Shortens a query, context or answer for the log: at most LOG_PAYLOAD_MAX_CHARS characters,
+    and only its length for requests outside the LOG_PAYLOAD_SAMPLE_RATE sample.
+
+    Args:
+        text (Any): The body to log.
+
+    Returns:
+        str: The text to put in the log message.
+    """
+    text = str(text)
+    if LOG_PAYLOAD_SAMPLE_RATE < 1:
+        # Sampled per request, so a request's records either all carry their bodies or none do
+        if zlib.crc32(request_id.get().encode("utf-8")) % 10000 >= LOG_PAYLOAD_SAMPLE_RATE * 10000:
+            return f"<{len(text)} chars>"
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        return f"{text[:LOG_PAYLOAD_MAX_CHARS]}... <{len(text) - LOG_PAYLOAD_MAX_CHARS} more chars>"
+    return text
+
+
+#the file handler runs on the listener's thread, so formatting and disk writes stay off the event loop
+file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+#callers only put the record on the queue; the request id is read here, in the caller's context
+queue_handler = QueueHandler(queue.SimpleQueue())
+queue_handler.addFilter(RequestIdFilter())
+
+logging.root.setLevel(LOG_LEVEL)
+logging.root.addHandler(queue_handler)
+
+listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)     # Flushes the queued records on exit
@@ -0,0 +1,218 @@
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from src.logger import logging, request_id
+
+
+# Seconds per pipeline stage: auth, session_load, resources, index_answer, queue_wait, cache_lookup,
+# condense, embedding (query embeddings, also those made for the cache lookup), vector_search
+# (retrieval without its embedding), first_token, generation, history_write
+STAGE_SECONDS = Histogram(
+    "imdb_rag_stage_seconds", "Time spent in one stage of a query", ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+REQUEST_SECONDS = Histogram(
+    "imdb_rag_request_seconds", "Time from request start to the last response byte", ["path", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+# Tokens per model answer; prompt tokens are estimated from the characters sent, completions counted as streamed
+ANSWER_TOKENS = Histogram(
+    "imdb_rag_answer_tokens", "Tokens per model answer", ["model", "kind"],
+    buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+)
+ANSWERS = Counter("imdb_rag_answers_total", "Answers by the component that served them", ["served_by"])
+
+# Per-request stage durations, read back by the middleware for the request's log line
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+# The innermost open span, which is told how long the spans nested in it took
+_current_span: ContextVar[Optional[List[float]]] = ContextVar("current_span", default=None)
+# Query vectors the request already has (from the semantic cache lookup), by text
+_known_vectors: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("known_vectors", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    """
+    Records a stage duration in the histogram and in the current request's timings.
+
+    Args:
+        stage (str): The stage name.
+        seconds (float): Its duration.
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+
+
+@contextmanager
+def span(stage: str, exclusive: bool = False):
+    """
+    `with span("condense"):` times the block as one stage, also when it raises. With `exclusive`
+    the time of spans nested in the block is left out, e.g. the embedding inside a vector search.
+    """
+    start, nested = time.perf_counter(), [0.0]
+    parent, token = _current_span.get(), _current_span.set(nested)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        elapsed = time.perf_counter() - start
+        if parent is not None:
+            parent[0] += elapsed
+        observe_stage(stage, elapsed - nested[0] if exclusive else elapsed)
+
+
+@contextmanager
+def reuse_query_vector(text: str, vector: List[float]):
+    """
+    `with reuse_query_vector(query, vector):` makes `TimedEmbeddings` answer `text` with `vector`
+    inside the block instead of calling the provider again, e.g. for the search after a cache miss.
+    """
+    token = _known_vectors.set({text: vector})
+    try:
+        yield
+    finally:
+        _known_vectors.reset(token)
+
+
+class TimedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper timing every query embedding as the "embedding" stage. Queries passed
+    to `reuse_query_vector` are answered from the known vector without a provider call.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        known = _known_vectors.get()
+        if known is not None and text in known:
+            return list(known[text])
+        with span("embedding"):
+            return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        known = _known_vectors.get()
+        if known is not None and text in known:
+            return list(known[text])
+        with span("embedding"):
+            return await self.embeddings.aembed_query(text)
+
+
+def record_answer(served_by: str, usage: Optional[Dict] = None):
+    """
+    Counts an answer and, for answers generated by a model, its prompt, hidden (<think>) and visible tokens.
+
+    Args:
+        served_by (str): "catalog", "analytics" or "rag".
+        usage (Optional[Dict]): The usage filled by `stream_response`.
+    """
+    usage = usage or {}
+    if usage.get("model") == "cache":
+        served_by = "cache"
+    elif usage.get("coalesced"):
+        served_by = "coalesced"     # Its tokens were counted for the call that did the work
+    ANSWERS.labels(served_by).inc()
+    if served_by == "rag" and usage.get("model"):
+        for kind in ("prompt", "hidden", "visible"):
+            ANSWER_TOKENS.labels(usage["model"], kind).observe(usage.get(f"{kind}_tokens", 0))
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware giving every request a correlation ID (the X-Request-ID header, or a new one)
+    that is attached to its log records and echoed in the response. When the last body byte is
+    sent (so streamed answers are timed in full) it records the request duration and logs the stage timings.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        correlation_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        id_token, timings_token = request_id.set(correlation_id), _stage_timings.set({})
+        timings, start, status = _stage_timings.get(), time.perf_counter(), [500]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", correlation_id.encode("latin-1"))]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                elapsed = time.perf_counter() - start
+                path = scope["path"] if status[0] != 404 else "unmatched"     # Unknown paths would explode the label set
+                REQUEST_SECONDS.labels(path, str(status[0])).observe(elapsed)
+                logging.info(f"{scope['method']} {scope['path']} {status[0]} in {elapsed:.3f}s, stages: {timings}",
+                             extra={"status": status[0], "duration_seconds": round(elapsed, 4), "stages": dict(timings)})
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(id_token)
+            _stage_timings.reset(timings_token)
+
+
+class ResourceCollector:
+    """
+    Exports the counters kept by the shared resources at scrape time: cache hits and misses
+    (semantic answers, principals, condensed questions), coalescing, admission and circuit breakers.
+    """
+
+    def __init__(self, get_resources):
+        self.get_resources = get_resources
+
+    def collect(self):
+        resources = self.get_resources()
+        if resources is None:
+            return
+
+        lookups = CounterMetricFamily("imdb_rag_cache_lookups", "Cache lookups by cache and result", labels=["cache", "result"])
+        ratios = GaugeMetricFamily("imdb_rag_cache_hit_ratio", "Hits over lookups since startup", labels=["cache"])
+        for name, cache in (("semantic", resources.cache), ("principal", resources.principals), ("condense", resources.condenser)):
+            if cache is not None:
+                lookups.add_metric([name, "hit"], cache.hits)
+                lookups.add_metric([name, "miss"], cache.misses)
+                ratios.add_metric([name], cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0)
+        yield lookups
+        yield ratios
+
+        if resources.inflight is not None:
+            coalescing = CounterMetricFamily("imdb_rag_singleflight_calls", "RAG calls that did the work or shared it", labels=["role"])
+            coalescing.add_metric(["leader"], resources.inflight.leaders)
+            coalescing.add_metric(["coalesced"], resources.inflight.coalesced)
+            yield coalescing
+
+        admission = resources.admission.stats()
+        gauges = GaugeMetricFamily("imdb_rag_admission", "LLM admission controller state", labels=["field"])
+        for field in ("limit", "active", "queued"):
+            gauges.add_metric([field], admission[field])
+        yield gauges
+        rejected = CounterMetricFamily("imdb_rag_admission_rejected", "Requests shed with a 429")
+        rejected.add_metric([], admission["rejected"])
+        yield rejected
+
+        breakers = GaugeMetricFamily("imdb_rag_circuit_open", "1 when the model's circuit breaker is open", labels=["model"])
+        for model, breaker in resources.models.breakers.items():
+            breakers.add_metric([model], float(breaker.state == "open"))
+        yield breakers
+        hedges = CounterMetricFamily("imdb_rag_hedged_requests", "Duplicate LLM requests sent after the hedge delay", labels=["outcome"])
+        hedges.add_metric(["sent"], resources.models.hedges)
+        hedges.add_metric(["won"], resources.models.hedge_wins)
+        yield hedges
@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when more password operations are queued than the pool accepts."""
+
+
+class PasswordPool:
+    """
+    Runs bcrypt hashing and verification on a small dedicated thread pool, off the event loop
+    (bcrypt releases the GIL while it works). At most `max_pending` operations may be running
+    or waiting; beyond that calls fail fast instead of queueing, so a login burst is turned
+    away with a 503 rather than delaying every other request.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None       # Started on first use, so the pool can be used again after `shutdown`
+
+    async def run(self, func, *args):
+        """
+        Runs `func(*args)` on the pool.
+
+        Args:
+            func (Callable): The blocking password function.
+
+        Returns:
+            Any: The result of `func`.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolSaturated(f"{self.pending} password operations already queued")
+        self.pending += 1
+        try:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        """
+        Stops the worker threads; queued operations are cancelled.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
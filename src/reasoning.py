@@ -0,0 +1,111 @@
+import re
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+
+# Questions that benefit from the reasoning model; anything else short enough is "simple"
+COMPLEX_QUERY = re.compile(
+    r"\b(?:why|how|explain|compare\w*|differen\w*|analy[sz]\w*|recommend\w*|suggest\w*|similar|better|worse|versus|vs|"
+    r"theme\w*|meaning|ending|interpret\w*|opinion|should|would)\b"
+)
+
+
+class GenerationOptions(BaseModel):
+    """
+    Per-request generation settings.
+
+    model: "reasoning" uses MODEL_NAME_LLAMA, "fast" the non-reasoning MODEL_NAME_FAST,
+    "auto" picks "fast" for simple questions. max_tokens caps the whole completion,
+    max_reasoning_tokens the hidden <think> block (on overflow the answer is regenerated
+    with the fast model).
+    """
+    model: Literal["auto", "reasoning", "fast"] = "auto"
+    max_tokens: Optional[int] = Field(None, ge=1)
+    max_reasoning_tokens: Optional[int] = Field(None, ge=1)
+
+
+def is_simple_query(query: str, max_words: int = 12) -> bool:
+    """
+    Returns True for short lookup-style questions that do not need step-by-step reasoning.
+
+    Args:
+        query (str): The user's query.
+        max_words (int): Longest query still considered simple. Defaults to 12.
+
+    Returns:
+        bool: Whether the fast model is good enough.
+    """
+    return len(query.split()) <= max_words and not COMPLEX_QUERY.search(query.lower())
+
+
+class ThinkTagFilter:
+    """
+    Streaming state machine that drops <think>...</think> content chunk by chunk, so the
+    visible answer can be forwarded as soon as the reasoning block closes. Tags split
+    across chunks ("<thi" + "nk>") are held back until they can be decided.
+
+    Streamed chunks are counted as hidden or visible tokens (Groq sends about one token per chunk).
+    """
+
+    OPEN, CLOSE = "<think>", "</think>"
+
+    def __init__(self):
+        self.inside = False
+        self.hidden_tokens = 0
+        self.visible_tokens = 0
+        self._pending = ""
+        self._started = False       # Visible text emitted yet; leading whitespace is dropped until then
+
+    def _partial_tag(self, data: str, tag: str) -> int:
+        # Length of the longest suffix of data that could be the start of tag
+        for size in range(min(len(tag) - 1, len(data)), 0, -1):
+            if data.endswith(tag[:size]):
+                return size
+        return 0
+
+    def _emit(self, visible: str) -> str:
+        if not self._started:
+            visible = visible.lstrip()
+            self._started = bool(visible)
+        return visible
+
+    def feed(self, text: str) -> str:
+        """
+        Consumes one streamed chunk.
+
+        Args:
+            text (str): The chunk text.
+
+        Returns:
+            str: The visible part of the chunk, possibly empty.
+        """
+        data, self._pending = self._pending + text, ""
+        visible, hidden = [], self.inside
+        while data:
+            tag = self.CLOSE if self.inside else self.OPEN
+            position = data.find(tag)
+            if position >= 0:
+                if not self.inside:
+                    visible.append(data[:position])
+                data = data[position + len(tag):]
+                self.inside, hidden = not self.inside, True
+                continue
+            keep = self._partial_tag(data, tag)
+            if not self.inside:
+                visible.append(data[:len(data) - keep])
+            self._pending = data[len(data) - keep:] if keep else ""
+            break
+
+        visible = self._emit("".join(visible))
+        if visible:
+            self.visible_tokens += 1
+        elif hidden:
+            self.hidden_tokens += 1
+        return visible
+
+    def flush(self) -> str:
+        """
+        Returns text held back at the end of the stream; an unclosed <think> block is dropped.
+        """
+        pending, self._pending = self._pending, ""
+        return "" if self.inside else self._emit(pending)
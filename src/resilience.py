@@ -0,0 +1,272 @@
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.logger import logging
+
+
+class StageTimeout(TimeoutError):
+    """Raised when a pipeline stage (retrieval, generation) misses its deadline."""
+
+    def __init__(self, stage: str, seconds: float):
+        super().__init__(f"{stage} timed out after {seconds:g}s")
+        self.stage = stage
+        self.seconds = seconds
+
+
+async def with_deadline(awaitable, seconds: Optional[float], stage: str):
+    """
+    Awaits `awaitable` within `seconds`, raising `StageTimeout` when it takes longer.
+
+    Args:
+        awaitable (Awaitable): The stage to run.
+        seconds (Optional[float]): The deadline; None or 0 waits forever.
+        stage (str): Name used in the error.
+
+    Returns:
+        Any: The result of `awaitable`.
+    """
+    if not seconds:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, seconds)
+    except asyncio.TimeoutError:
+        raise StageTimeout(stage, seconds)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+
+_END = object()     # First "chunk" of a stream that ended without any
+
+
+class CircuitBreaker:
+    """
+    Stops calling a model after `failure_threshold` consecutive failures. After `reset_seconds`
+    one trial call is let through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.clock() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures, self.opened_at, self._trial = 0, None, False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = self.clock()
+
+    def abandon(self):
+        # The call ended without an outcome (cancelled), so the next one may be the trial
+        self._trial = False
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent latencies, used to derive the hedging delay (e.g. the p95 time to first token).
+    """
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class ModelFallbackChain:
+    """
+    Guards LLM streams with deadlines, optional hedging and per-model circuit breakers.
+
+    `open` starts a stream for one model: if no chunk arrives within the hedge delay (the model's
+    observed first-token percentile, or `hedge_delay` until enough samples exist) a duplicate request
+    is started and whichever answers first wins. No first chunk within `first_token_timeout`, or an
+    error before it, counts as a failure and the caller moves on to the next model in `fallbacks`.
+    """
+
+    def __init__(self, fallbacks: List[Tuple[str, object]] = None, first_token_timeout: float = 0, stream_timeout: float = 0,
+                 hedge: bool = False, hedge_delay: float = 2.0, hedge_percentile: float = 95, hedge_min_samples: int = 20,
+                 failure_threshold: int = 3, reset_seconds: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.fallbacks = fallbacks or []        # (name, chat model), in the order they are tried
+        self.first_token_timeout = first_token_timeout
+        self.stream_timeout = stream_timeout
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock          # For the breakers' reset timers
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_seconds, self.clock)
+        return self.breakers[model]
+
+    def _hedge_after(self, model: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        tracker = self.latency.get(model)
+        if tracker is not None and len(tracker.samples) >= self.hedge_min_samples:
+            return tracker.percentile(self.hedge_percentile)
+        return self.hedge_delay
+
+    async def _first_chunk(self, model: str, factory):
+        # Races the primary stream (and, past the hedge delay, a duplicate) for the first chunk
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        hedge_after = self._hedge_after(model)
+        pending: Dict[asyncio.Future, Tuple[object, bool]] = {}     # task -> (stream, is the hedge)
+        error = None
+
+        def launch(hedged=False):
+            stream = factory()
+            pending[asyncio.ensure_future(stream.__anext__())] = (stream, hedged)
+
+        launch()
+        try:
+            while pending:
+                elapsed = loop.time() - start
+                waits = [self.first_token_timeout - elapsed] if self.first_token_timeout else []
+                if hedge_after is not None:
+                    waits.append(hedge_after - elapsed)
+                timeout = max(min(waits), 0) if waits else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    stream, hedged = pending.pop(task)
+                    if task.exception() is None or isinstance(task.exception(), StopAsyncIteration):
+                        self.hedge_wins += hedged
+                        self.latency.setdefault(model, LatencyTracker()).add(loop.time() - start)
+                        return (_END if task.exception() else task.result()), stream
+                    error = task.exception()
+                    await stream.aclose()
+
+                elapsed = loop.time() - start
+                if self.first_token_timeout and elapsed >= self.first_token_timeout:
+                    raise StageTimeout(f"{model} first token", self.first_token_timeout)
+                if hedge_after is not None and elapsed >= hedge_after and pending:
+                    logging.info(f"No first token from {model} after {hedge_after:.2f}s, sending a hedged request")
+                    self.hedges += 1
+                    hedge_after = None
+                    launch(hedged=True)
+            raise error
+        finally:
+            # The losing (or timed-out) requests are cancelled, which stops their upstream calls
+            for task, (stream, _) in pending.items():
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await stream.aclose()
+
+    async def open(self, model: str, factory):
+        """
+        Opens a guarded stream for one model.
+
+        Args:
+            model (str): The model name, for its breaker and latency statistics.
+            factory (Callable[[], AsyncIterator]): Starts a fresh stream of chunks for the model.
+
+        Returns:
+            AsyncIterator: The stream's chunks; raises `StageTimeout` when the whole stream takes
+            longer than `stream_timeout`. Opening raises `CircuitOpen`, `StageTimeout` or the
+            model's error when no first chunk arrives.
+        """
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            raise CircuitOpen(f"Circuit breaker for {model} is open")
+        try:
+            first, stream = await self._first_chunk(model, factory)
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.abandon()
+            raise
+        # A first chunk settles a half-open trial, even if the caller then closes the stream early
+        if breaker.state != "closed":
+            breaker.record_success()
+        return self._rest(model, breaker, first, stream)
+
+    async def open_first(self, attempts: List[Tuple[str, object]]):
+        """
+        Opens the first model in `attempts` that starts streaming; the others are skipped or fall through.
+
+        Args:
+            attempts (List[Tuple[str, Callable[[], AsyncIterator]]]): (model, stream factory) pairs in fallback order.
+
+        Returns:
+            Tuple[str, AsyncIterator]: The model that answered and its stream. The last model's error
+            is raised when none of them starts.
+        """
+        for index, (model, factory) in enumerate(attempts):
+            try:
+                return model, await self.open(model, factory)
+            except Exception as e:
+                if index == len(attempts) - 1:
+                    raise
+                logging.warning(f"{model} failed before its first token ({e}), falling back to {attempts[index + 1][0]}")
+
+    async def _rest(self, model, breaker, first, stream):
+        deadline = time.monotonic() + self.stream_timeout if self.stream_timeout else None
+        try:
+            if first is not _END:
+                yield first
+                while True:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    try:
+                        chunk = await (stream.__anext__() if remaining is None else asyncio.wait_for(stream.__anext__(), max(remaining, 0)))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise StageTimeout(f"{model} generation", self.stream_timeout)
+                    yield chunk
+            breaker.record_success()
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "breakers": {model: breaker.state for model, breaker in self.breakers.items()},
+            "p95_first_token": {model: tracker.percentile(95) for model, tracker in self.latency.items()},
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins
+        }
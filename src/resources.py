@@ -0,0 +1,281 @@
+import os
+import sys
+import signal
+import asyncio
+from dotenv import load_dotenv, find_dotenv
+
+from src import config
+from src.logger import logging
+from src.cache import SemanticCache
+from src.auth_cache import PrincipalCache
+from src.singleflight import SingleFlight
+from src.admission import AdmissionController
+from src.resilience import ModelFallbackChain
+from src.conversation import QuestionCondenser
+from src.catalog import MovieCatalog
+from src.analytics import MovieTable
+from src.hybrid import LexicalIndex
+from src.filters import people_index
+from src.exception import ImdbException
+from src.local_store import LocalVectorStore
+from src.utils import get_vector_store, get_retriever, get_llm, get_mongo_client, iter_documents, password_pool
+
+
+async def load_service_config():
+    """
+    Re-read the .env file and collect the settings used to build the shared clients.
+
+    Returns:
+        Dict[str, str]: Qdrant, OpenAI and Groq settings, with src.config values as defaults.
+    """
+    load_dotenv(find_dotenv(), override=True)
+    return {
+        "QDRANT_HOST": os.getenv("QDRANT_HOST", config.QDRANT_HOST),
+        "QDRANT_API_KEY": os.getenv("QDRANT_API_KEY", config.QDRANT_API_KEY),
+        "QDRANT_COLLECTION_NAME": os.getenv("QDRANT_COLLECTION_NAME", config.QDRANT_COLLECTION_NAME),
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", config.OPENAI_API_KEY),
+        "GROQ_API_KEY": os.getenv("GROQ_API_KEY", config.GROQ_API_KEY),
+        "MODEL_NAME_LLAMA": os.getenv("MODEL_NAME_LLAMA", config.MODEL_NAME_LLAMA),
+        "MODEL_NAME_FAST": os.getenv("MODEL_NAME_FAST", config.MODEL_NAME_FAST),
+        "LLM_FALLBACK_MODELS": [name.strip() for name in os.getenv("LLM_FALLBACK_MODELS", ",".join(config.LLM_FALLBACK_MODELS)).split(",") if name.strip()],
+    }
+
+
+class ResourceRegistry:
+    """
+    Process-lifetime holder for the Qdrant vector store, the RetrievalQA chain and the
+    pooled async MongoDB client.
+
+    The clients are built once (at startup or on first use) and shared by every request,
+    so a query no longer pays for a new Qdrant/OpenAI/Groq/Mongo client and a collection check.
+    """
+
+    def __init__(self):
+        self.settings = {}
+        self.vector_store = None
+        self.retriever = None
+        self.fast_llm = None
+        self.cache = None
+        self.condenser = None
+        self.catalog = None
+        self.table = None
+        self.people = None      # Director/star names for resolving names in metadata filters
+        self.mongo = None
+        self.inflight = SingleFlight() if config.COALESCE_ENABLED else None
+        self.admission = AdmissionController(
+            max_concurrency=config.LLM_MAX_CONCURRENCY,
+            max_queue=config.LLM_MAX_QUEUE,
+            max_queue_per_user=config.LLM_MAX_QUEUE_PER_USER,
+            queue_timeout=config.LLM_QUEUE_TIMEOUT_SECONDS
+        )
+        self.models = ModelFallbackChain(
+            first_token_timeout=config.LLM_FIRST_TOKEN_TIMEOUT_SECONDS,
+            stream_timeout=config.LLM_STREAM_TIMEOUT_SECONDS,
+            hedge=config.LLM_HEDGE_ENABLED,
+            hedge_delay=config.LLM_HEDGE_DELAY_SECONDS,
+            hedge_percentile=config.LLM_HEDGE_PERCENTILE,
+            failure_threshold=config.LLM_BREAKER_FAILURES,
+            reset_seconds=config.LLM_BREAKER_RESET_SECONDS
+        )
+        self._provider_http = None     # httpx client feeding Groq rate-limit headers to the admission controller
+        self.principals = PrincipalCache(max_entries=config.AUTH_CACHE_MAX_ENTRIES, ttl_seconds=config.AUTH_CACHE_TTL_SECONDS)
+        self._lock = asyncio.Lock()
+        self._background_tasks = set()
+        self._retired = []
+
+    async def _build(self, settings):
+        if self._provider_http is None:
+            self._provider_http = self.admission.http_client()
+        vector_store = await get_vector_store(
+            QDRANT_HOST=settings["QDRANT_HOST"],
+            API_KEY=settings["QDRANT_API_KEY"],
+            QDRANT_COLLECTION_NAME=settings["QDRANT_COLLECTION_NAME"],
+            OPENAI_API_KEY=settings["OPENAI_API_KEY"]      # Not the LLM client: an embeddings 429 says nothing about Groq's capacity
+        )
+        lexical_index = LexicalIndex.load(config.LEXICAL_INDEX_PATH) if config.HYBRID_SEARCH_ENABLED else None
+        if config.HYBRID_SEARCH_ENABLED and lexical_index is None:
+            logging.warning(f"No lexical index at {config.LEXICAL_INDEX_PATH}, using dense retrieval only")
+        retriever = await get_retriever(
+            GROQ_API_KEY=settings["GROQ_API_KEY"],
+            MODEL_NAME_LLAMA=settings["MODEL_NAME_LLAMA"],
+            vector_store=vector_store,
+            lexical_index=lexical_index,
+            http_async_client=self._provider_http
+        )
+        fast_llm = await get_llm(settings["GROQ_API_KEY"], settings["MODEL_NAME_FAST"], self._provider_http) if settings["MODEL_NAME_FAST"] else None
+        fallbacks = [
+            (name, await get_llm(settings["GROQ_API_KEY"], name, self._provider_http))
+            for name in settings["LLM_FALLBACK_MODELS"] if name not in (settings["MODEL_NAME_LLAMA"], settings["MODEL_NAME_FAST"])
+        ]
+        return vector_store, retriever, fast_llm, fallbacks
+
+    def _build_cache(self, vector_store):
+        if not config.SEMANTIC_CACHE_ENABLED:
+            return None
+        return SemanticCache(
+            embeddings=vector_store.embeddings,
+            threshold=config.SEMANTIC_CACHE_THRESHOLD,
+            ttl_seconds=config.SEMANTIC_CACHE_TTL_SECONDS,
+            max_entries=config.SEMANTIC_CACHE_MAX_ENTRIES,
+            max_bytes=config.SEMANTIC_CACHE_MAX_BYTES
+        )
+
+    def _build_condenser(self, fast_llm):
+        if not config.CONDENSE_ENABLED or fast_llm is None:
+            return None
+        return QuestionCondenser(
+            fast_llm,
+            history_tokens=config.CONDENSE_HISTORY_TOKENS,
+            max_tokens=config.CONDENSE_MAX_TOKENS,
+            max_entries=config.CONDENSE_CACHE_SIZE
+        )
+
+    def _build_indexes(self):
+        # Catalog, analytics table and the name index for filters share one read of the CSV
+        try:
+            movies = [doc.metadata for doc in iter_documents(config.CATALOG_FILE_PATH)]
+            catalog = MovieCatalog(movies, fuzzy_cutoff=config.CATALOG_FUZZY_CUTOFF) if config.FAST_PATH_ENABLED else None
+            table = MovieTable(movies) if config.ANALYTICS_ENABLED else None
+            logging.info(f"Movie catalog and analytics table with {len(movies)} movies loaded from {config.CATALOG_FILE_PATH}")
+            return catalog, table, people_index(movies)
+        except Exception as e:
+            logging.warning(f"Movie catalog not available, every query goes to the RAG chain: {e}")
+            return None, None, None
+
+    async def startup(self):
+        """
+        Build the shared clients. A failure is logged rather than raised so the auth
+        endpoints stay available; the build is retried on the first query.
+        """
+        self.catalog, self.table, self.people = self._build_indexes()
+        self.mongo = get_mongo_client(os.getenv("MONGODB_URI", config.MONGODB_URI))
+        self._track(asyncio.create_task(self._ensure_indexes()))     # In the background, an unreachable Mongo must not delay startup
+        try:
+            await self.get_retriever()
+            logging.info("Shared vector store and retriever initialised")
+        except Exception as e:
+            logging.error(f"Could not initialise shared resources at startup: {e}")
+
+    async def _ensure_indexes(self):
+        try:
+            # Every session lookup filters on these three fields
+            await self.sessions.create_index([("session_id", 1), ("user_id", 1), ("username", 1)], name="session_owner")
+        except Exception as e:
+            logging.error(f"Could not create the sessions index: {e}")
+
+    @property
+    def users(self):
+        return self.mongo[config.MONGODB_DB_NAME]["users"]
+
+    @property
+    def sessions(self):
+        return self.mongo[config.MONGODB_DB_NAME]["sessions"]
+
+    async def get_retriever(self):
+        """
+        Returns the shared RetrievalQA chain, building it on first use.
+
+        Returns:
+            RetrievalQA: The process-wide retriever instance.
+        """
+        if self.retriever is not None:
+            return self.retriever
+
+        async with self._lock:
+            if self.retriever is None:      # Another request may have built it while we waited
+                self.settings = await load_service_config()
+                self.vector_store, self.retriever, self.fast_llm, self.models.fallbacks = await self._build(self.settings)
+                self.cache = self._build_cache(self.vector_store)
+                self.condenser = self._build_condenser(self.fast_llm)
+        return self.retriever
+
+    async def reload(self):
+        """
+        Re-read the configuration and swap in freshly built clients. Requests already
+        holding the old chain finish on it; the old Qdrant client is closed after a grace period.
+        """
+        async with self._lock:
+            settings = await load_service_config()
+            try:
+                vector_store, retriever, fast_llm, fallbacks = await self._build(settings)
+            except Exception as e:
+                raise ImdbException(e, sys)
+
+            old_vector_store = self.vector_store
+            self.settings, self.vector_store, self.retriever, self.fast_llm = settings, vector_store, retriever, fast_llm
+            self.models.fallbacks = fallbacks
+            self.cache = self._build_cache(vector_store)      # Answers from the old model/collection are stale
+            self.condenser = self._build_condenser(fast_llm)
+            self.catalog, self.table, self.people = self._build_indexes()
+
+        if old_vector_store is not None:
+            self._retired.append(old_vector_store)
+            self._track(asyncio.create_task(self._close_later(old_vector_store, config.RESOURCE_RELOAD_GRACE_SECONDS)))
+        logging.info("Shared resources reloaded")
+
+    def _track(self, task):
+        # Keep a reference so background tasks are not garbage collected mid-flight
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _close_later(self, vector_store, delay):
+        await asyncio.sleep(delay)
+        if vector_store in self._retired:
+            self._retired.remove(vector_store)
+            await self._close(vector_store)
+
+    async def _close(self, vector_store):
+        if isinstance(vector_store, LocalVectorStore):    # In-process index, nothing to close
+            return
+        try:
+            vector_store.client.close()
+            if vector_store.async_client is not None:
+                await vector_store.async_client.close()
+        except Exception as e:
+            logging.warning(f"Error while closing Qdrant client: {e}")
+
+    async def shutdown(self):
+        """
+        Close every client held by the registry, including ones waiting on a reload grace period.
+        """
+        for task in list(self._background_tasks):
+            task.cancel()
+        async with self._lock:
+            for vector_store in self._retired + [self.vector_store]:
+                if vector_store is not None:
+                    await self._close(vector_store)
+            self._retired = []
+            self.vector_store, self.retriever, self.fast_llm, self.cache, self.condenser = None, None, None, None, None
+            self.catalog, self.table, self.people = None, None, None
+            if self.mongo is not None:
+                await self.mongo.close()
+                self.mongo = None
+            if self._provider_http is not None:
+                await self._provider_http.aclose()
+                self._provider_http = None
+        password_pool.shutdown()
+        logging.info("Shared resources closed")
+
+
+def install_reload_signal(resources):
+    """
+    Reload the registry on SIGHUP, where the platform supports it (not on Windows).
+
+    Args:
+        resources (ResourceRegistry): The registry to reload.
+    """
+    if not hasattr(signal, "SIGHUP"):
+        return
+
+    async def _reload():
+        try:
+            await resources.reload()
+        except Exception as e:
+            logging.error(f"Config reload failed, keeping current clients: {e}")
+
+    try:
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: resources._track(asyncio.create_task(_reload())))
+    except (NotImplementedError, RuntimeError):
+        pass
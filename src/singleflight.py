@@ -0,0 +1,80 @@
+import re
+import asyncio
+import hashlib
+from typing import Dict
+
+
+def flight_key(query: str, context: str = "", *extra: str) -> str:
+    """
+    Returns the coalescing key of a query: case, whitespace and trailing punctuation are
+    ignored, the conversation context and any extra settings (model routing) are not.
+
+    Args:
+        query (str): The user's query.
+        context (str): The chat history the query is asked in. Defaults to "".
+        *extra (str): Further settings that change the answer.
+
+    Returns:
+        str: A sha256 hex digest.
+    """
+    normalized = re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!. ")
+    return hashlib.sha256("\x00".join((normalized, context, *extra)).encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls: while a call for a key is running, further callers
+    with the same key wait for its result instead of starting their own. A failure reaches
+    every waiter; the upstream call is cancelled only once all of its waiters have gone.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0            # Calls that did the work
+        self.coalesced = 0          # Calls served by another call's work
+        self.failures = 0
+
+    async def do(self, key: str, func):
+        """
+        Awaits `func()`, or the identical call already in flight.
+
+        Args:
+            key (str): The coalescing key, see `flight_key`.
+            func (Callable): Coroutine function doing the work.
+
+        Returns:
+            Tuple[Any, bool]: The result, and whether it was shared from another caller's call.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.create_task(func()))
+            flight.task.add_done_callback(lambda task: self._finish(key, flight, task))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+
+    def _finish(self, key, flight, task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced, "failures": self.failures}
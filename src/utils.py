@@ -1,9 +1,11 @@
+import certifi
 import pandas as pd
 import qdrant_client
-import re, os, jwt, sys
+import re, os, jwt, sys, time, asyncio
 from typing import List, Dict
+from contextlib import nullcontext
 from pydantic import BaseModel
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 from langchain_groq import ChatGroq
 from langchain_qdrant import Qdrant
 from langchain.schema import Document
@@ -16,92 +18,189 @@ from datetime import datetime, timedelta, timezone
 from qdrant_client.http.models import VectorParams, Distance
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-from src.logger import logging
+from src.logger import logging, shorten_payload
 from src.exception import ImdbException
-from src.config import MONGODB_URI
+from src.filters import MOVIE_PAYLOAD_SCHEMA, extract_filters, to_search_filter
+from src.ingestion import get_row_key, get_row_hash, get_point_id, sync_collection
+from src.hybrid import HybridRetriever
+from src.context import ContextRetriever
+from src.auth_cache import password_fingerprint
+from src.passwords import PasswordPool, PasswordPoolSaturated
+from src.conversation import estimate_tokens, history_within_budget
+from src.metrics import TimedEmbeddings, span, observe_stage, reuse_query_vector
+from src.singleflight import flight_key
+from src.resilience import StageTimeout, with_deadline
+from src.reasoning import GenerationOptions, ThinkTagFilter, is_simple_query
+from src.local_store import LocalVectorStore
+from src.config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_RETRY_AFTER_SECONDS, MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE, MONGODB_TIMEOUT_MS, QDRANT_PREFER_GRPC, QDRANT_GRPC_PORT, EMBEDDING_MODEL, DATA_READ_CHUNKSIZE, VECTOR_BACKEND, LOCAL_INDEX_DIR, HYBRID_K, HYBRID_FETCH_K, HYBRID_DENSE_WEIGHT, HYBRID_LEXICAL_WEIGHT, HYBRID_RRF_K, HYBRID_LEXICAL_ONLY_MAX_TERMS, CONTEXT_ASSEMBLY_ENABLED, CONTEXT_K, CONTEXT_FETCH_K, CONTEXT_SCORE_THRESHOLD, CONTEXT_MMR_LAMBDA, CONTEXT_MAX_TOKENS, LLM_ROUTE_DEFAULT, SIMPLE_QUERY_MAX_WORDS, MAX_REASONING_TOKENS, HISTORY_TOKEN_BUDGET, CONDENSE_TIMEOUT_SECONDS, RETRIEVAL_TIMEOUT_SECONDS
+
+
+# CSV columns rendered into each movie's page content
+DOCUMENT_TEXT_COLUMNS = ["Series_Title", "Released_Year", "Genre", "IMDB_Rating", "Director", "Overview", "Star1", "Star2", "Star3", "Star4"]
+
+def typed_metadata(frame):
+    """
+    Convert a block of CSV rows into typed movie metadata, column-wise.
 
+    Args:
+        frame (pd.DataFrame): Rows of the IMDb data dump.
 
-async def format_data_n_get_documents(DATA_DUMP_FILE_PATH):
+    Returns:
+        List[Dict]: One metadata dict per row; numbers are int/float and missing values None,
+        so they can be indexed and range-filtered in Qdrant (see src.filters.MOVIE_PAYLOAD_SCHEMA).
     """
-    Read the IMDb data dump CSV file and convert each row into a LangChain Document format.
+    def split(column):
+        return frame[column].fillna("").str.split(",").map(lambda values: [v.strip() for v in values if v.strip()])
+
+    def values(series):
+        # Object dtype turns NaN/NA into None and numpy scalars into plain Python values
+        series = series.astype(object)
+        return series.where(series.notna(), None).tolist()
+
+    columns = {
+        "title": values(frame["Series_Title"]),
+        "year": values(pd.to_numeric(frame["Released_Year"], errors="coerce").astype("Int64")),
+        "genre": split("Genre").tolist(),
+        "rating": values(frame["IMDB_Rating"].astype(float)),
+        "runtime": values(pd.to_numeric(frame["Runtime"].str.extract(r"(\d+)", expand=False), errors="coerce").astype("Int64")),
+        "meta_score": values(pd.to_numeric(frame["Meta_score"], errors="coerce")),
+        "votes": values(pd.to_numeric(frame["No_of_Votes"], errors="coerce").astype("Int64")),
+        "gross": values(pd.to_numeric(frame["Gross"].astype(str).str.replace(",", ""), errors="coerce").astype("Int64")),
+        "director": values(frame["Director"]),
+        "stars": frame[["Star1", "Star2", "Star3", "Star4"]].values.tolist(),
+        "certificate": values(frame["Certificate"]),
+    }
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+def iter_documents(DATA_DUMP_FILE_PATH, chunksize=DATA_READ_CHUNKSIZE):
+    """
+    Stream the IMDb data dump CSV as LangChain Documents, `chunksize` rows at a time.
+    The page content of each block is built column-wise with vectorized string ops, and
+    Documents are yielded lazily, so memory stays flat regardless of the file size.
 
     Args:
         DATA_DUMP_FILE_PATH (str): The path to the IMDb data dump CSV file.
+        chunksize (int): Rows read per block. Defaults to DATA_READ_CHUNKSIZE.
 
-    Returns:
-        List[Document]: A list of LangChain Document objects, each containing metadata and page content.
+    Yields:
+        Document: One Document per movie, containing metadata and page content.
     """
-    df = pd.read_csv(DATA_DUMP_FILE_PATH)
-
     try:
-        # Convert rows into LangChain Document format containing metadata and structured content.
-        documents = [
-            Document(           # Maintain metadata
-                metadata={"title": row["Series_Title"], "year": row["Released_Year"], "genre": row["Genre"], "rating": row["IMDB_Rating"]},
-                page_content=(
-                    f"Movie: {row['Series_Title']}, Released: {row['Released_Year']}, Genre: {row['Genre']}, "
-                    f"Rating: {row['IMDB_Rating']}, Director: {row['Director']},  Overview: {row['Overview']}"
-                    f"Starring: {row['Star1']}, {row['Star2']}, {row['Star3']}, {row['Star4']}."
-                )
+        # Fix the year and rating dtypes, otherwise each block infers its own (int vs str for rows like "PG",
+        # and a block of whole ratings would render "8" instead of "8.0")
+        for frame in pd.read_csv(DATA_DUMP_FILE_PATH, chunksize=chunksize, dtype={"Released_Year": str, "IMDB_Rating": float}):
+            text = {column: frame[column].astype(str) for column in DOCUMENT_TEXT_COLUMNS}
+            page_content = (
+                "Movie: " + text["Series_Title"] + ", Released: " + text["Released_Year"] + ", Genre: " + text["Genre"]
+                + ", Rating: " + text["IMDB_Rating"] + ", Director: " + text["Director"] + ",  Overview: " + text["Overview"]
+                + "Starring: " + text["Star1"] + ", " + text["Star2"] + ", " + text["Star3"] + ", " + text["Star4"] + "."
             )
-            for _, row in df.iterrows()
-        ]
+            # Identity uses the raw year text, so rows like ("Apollo 13", "PG") keep a stable key
+            row_keys = text["Series_Title"] + "|" + text["Released_Year"]
+
+            for row_key, metadata, content in zip(row_keys, typed_metadata(frame), page_content):
+                yield Document(     # Maintain typed metadata, stored as Qdrant payload
+                    metadata={**metadata, "row_key": row_key},
+                    page_content=content
+                )
     except Exception as e:
         raise ImdbException(e, sys)
 
-    return documents
+async def format_data_n_get_documents(DATA_DUMP_FILE_PATH):
+    """
+    Read the IMDb data dump CSV file and convert each row into a LangChain Document format.
+
+    Args:
+        DATA_DUMP_FILE_PATH (str): The path to the IMDb data dump CSV file.
 
-async def get_vector_store(QDRANT_HOST, API_KEY, QDRANT_COLLECTION_NAME, OPENAI_API_KEY):
+    Returns:
+        List[Document]: A list of LangChain Document objects, each containing metadata and page content.
+        Use `iter_documents` to stream large dumps instead.
     """
-    Initialize Qdrant client and vector store with OpenAI embeddings, to set Up Qdrant Vector Store.
+    return list(iter_documents(DATA_DUMP_FILE_PATH))
+
+async def get_vector_store(QDRANT_HOST, API_KEY, QDRANT_COLLECTION_NAME, OPENAI_API_KEY, PREFER_GRPC=QDRANT_PREFER_GRPC, embeddings=None,
+                           http_async_client=None):
+    """
+    Initialize Qdrant clients and vector store with OpenAI embeddings, to set Up Qdrant Vector Store.
 
     Args:
         QDRANT_HOST (str): The URL of the Qdrant server.
         API_KEY (str): The API key for the Qdrant server.
         QDRANT_COLLECTION_NAME (str): The name of the Qdrant collection.
         OPENAI_API_KEY (str): The API key for the OpenAI embeddings.
+        PREFER_GRPC (bool): Talk to Qdrant over gRPC instead of REST. Defaults to QDRANT_PREFER_GRPC.
+        embeddings (Optional[Embeddings]): Embeddings to use instead of plain OpenAIEmbeddings,
+            e.g. a SQLiteEmbeddingCache during ingestion. Defaults to None.
+        http_async_client (Optional[httpx.AsyncClient]): Client for the OpenAI API of the default embeddings. Defaults to the SDK's own.
 
     Returns:
-        Qdrant: The initialized vector store with OpenAI embeddings.
+        Qdrant | LocalVectorStore: The initialized vector store with OpenAI embeddings. For Qdrant, the
+        async methods (asimilarity_search, aadd_texts, ...) go through the AsyncQdrantClient. With
+        VECTOR_BACKEND="local" the index in LOCAL_INDEX_DIR is memory-mapped instead and Qdrant is not contacted.
     """
+    if embeddings is None:
+        embeddings = TimedEmbeddings(OpenAIEmbeddings(api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL, http_async_client=http_async_client))
+
+    if VECTOR_BACKEND == "local":
+        try:
+            return LocalVectorStore.load(LOCAL_INDEX_DIR, embeddings)
+        except Exception as e:
+            raise ImdbException(e, sys)
 
     try:
-        # Initialize Qdrant Client
-        client = qdrant_client.QdrantClient(url=QDRANT_HOST, api_key=API_KEY, timeout=120)
+        # Initialize Qdrant Clients, the sync one is kept for ingestion scripts. Its constructor makes a blocking
+        # version check, so it runs in a thread: a SIGHUP reload must not stall requests on the event loop
+        client = await asyncio.to_thread(
+            qdrant_client.QdrantClient, url=QDRANT_HOST, api_key=API_KEY, timeout=120, prefer_grpc=PREFER_GRPC, grpc_port=QDRANT_GRPC_PORT
+        )
+        async_client = qdrant_client.AsyncQdrantClient(
+            url=QDRANT_HOST, api_key=API_KEY, timeout=120, prefer_grpc=PREFER_GRPC, grpc_port=QDRANT_GRPC_PORT,
+            check_compatibility=False       # Already checked by the sync client
+        )
 
         # Check if collection exists, then create it
-        if not client.collection_exists(QDRANT_COLLECTION_NAME):
-            client.create_collection(
+        if not await async_client.collection_exists(QDRANT_COLLECTION_NAME):
+            await async_client.create_collection(
                 collection_name=QDRANT_COLLECTION_NAME,
                 vectors_config=VectorParams(size=1536, distance=Distance.COSINE)    # 1536 used by OpenAI embeddings
             )
 
+        # Index the movie metadata so filters are applied inside Qdrant before the ANN search
+        collection = await async_client.get_collection(QDRANT_COLLECTION_NAME)
+        for field, schema in MOVIE_PAYLOAD_SCHEMA.items():
+            if f"{Qdrant.METADATA_KEY}.{field}" not in (collection.payload_schema or {}):
+                await async_client.create_payload_index(
+                    collection_name=QDRANT_COLLECTION_NAME,
+                    field_name=f"{Qdrant.METADATA_KEY}.{field}",
+                    field_schema=schema
+                )
+
     except Exception as e:
         raise ImdbException(e, sys)
 
-    # Initialize embeddings
-    embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-
     # Connects Qdrant with LangChain for storing and retrieving vectorized documents.
     vector_store = Qdrant(
         client=client,
+        async_client=async_client,
         collection_name=QDRANT_COLLECTION_NAME,
         embeddings=embeddings
     )
     
     return vector_store
 
-async def get_chunked_data(documents, CHUNK_SIZE, CHUNK_OVERLAP):
+def iter_chunked_documents(documents, CHUNK_SIZE, CHUNK_OVERLAP):
     """
-    Asynchronous function to split documents into smaller text chunks.
+    Lazily split documents into smaller text chunks.
 
     Args:
-        documents (list[Document]): List of documents to split.
+        documents (Iterable[Document]): Documents to split; may be a generator such as `iter_documents`.
         CHUNK_SIZE (int): Size of each chunk in characters.
         CHUNK_OVERLAP (int): Overlap of each chunk in characters.
 
-    Returns:
-        list[str]: List of chunked documents as strings.
+    Yields:
+        Document: Chunk Documents keeping the movie metadata, plus row_key, row_hash and
+        chunk_index, with a deterministic point ID derived from Series_Title + Released_Year + chunk index.
     """
     try:
         # Define text splitter
@@ -112,46 +211,88 @@ async def get_chunked_data(documents, CHUNK_SIZE, CHUNK_OVERLAP):
         )
 
         # Process documents and split text correctly
-        chunked_documents = []
         for doc in documents:
+            row_key = doc.metadata.get("row_key") or get_row_key(doc.metadata["title"], doc.metadata["year"])
+            row_metadata = {**doc.metadata, "row_key": row_key, "row_hash": get_row_hash(doc)}
             chunks = text_splitter.split_text(doc.page_content)  # Use page_content instead of passing Document object
-            chunked_documents.extend(chunks)
-
-        # Display some chunked samples
-        logging.info(chunked_documents[:5])
+            for chunk_index, chunk in enumerate(chunks):
+                yield Document(
+                    id=get_point_id(row_key, chunk_index),
+                    page_content=chunk,
+                    metadata={**row_metadata, "chunk_index": chunk_index}
+                )
 
-        return chunked_documents
-    
     except Exception as e:
         raise ImdbException(e, sys)
 
-async def store_data_to_vdb(vector_store, chunked_documents):
+async def get_chunked_data(documents, CHUNK_SIZE, CHUNK_OVERLAP):
+    """
+    Asynchronous function to split documents into smaller text chunks.
+
+    Args:
+        documents (list[Document]): List of documents to split.
+        CHUNK_SIZE (int): Size of each chunk in characters.
+        CHUNK_OVERLAP (int): Overlap of each chunk in characters.
+
+    Returns:
+        list[Document]: Chunk Documents, see `iter_chunked_documents`.
+    """
+    chunked_documents = list(iter_chunked_documents(documents, CHUNK_SIZE, CHUNK_OVERLAP))
+
+    # Display some chunked samples
+    logging.info(chunked_documents[:5])
+
+    return chunked_documents
+
+async def store_data_to_vdb(vector_store, chunked_documents, diff=True, lexical_index=None):
     """
     Asynchronous function to store chunked documents to Vector DB (Qdrant).
+    Points are upserted under deterministic IDs, so re-running is idempotent.
     
     Args:
         vector_store (Qdrant): Qdrant vector store.
-        chunked_documents (list[str]): List of chunked documents as strings.
+        chunked_documents (Iterable[Document]): Chunk Documents from `get_chunked_data` or `iter_chunked_documents`.
+        diff (bool): Only upsert changed rows and delete removed ones. Defaults to True.
+        lexical_index (Optional[LexicalIndex]): BM25 index to fill with every chunk, changed or not.
     
     Returns:
-        None
+        Dict[str, int]: Count of rows added, updated, deleted and skipped.
     """
     try:
         # Store data to Qdrant
-        vector_store.add_texts(chunked_documents)
+        summary = await sync_collection(vector_store, chunked_documents, diff=diff, lexical_index=lexical_index)
         logging.info("Data stored to Vector DB successfully")
+        return summary
 
     except Exception as e:
         raise ImdbException(e, sys)
 
-async def get_retriever(GROQ_API_KEY, MODEL_NAME_LLAMA, vector_store):
+async def get_llm(GROQ_API_KEY, MODEL_NAME, http_async_client=None):
+    """
+    Creates a streaming ChatGroq chat model.
+
+    Args:
+        GROQ_API_KEY (str): API key for ChatGroq.
+        MODEL_NAME (str): Groq model name.
+        http_async_client (Optional[httpx.AsyncClient]): Client for the Groq API, e.g. one reporting
+            rate-limit headers to the admission controller. Defaults to the SDK's own.
+
+    Returns:
+        ChatGroq: The chat model.
+    """
+    return ChatGroq(api_key=GROQ_API_KEY, model=MODEL_NAME, temperature=0.5, streaming=True, http_async_client=http_async_client)
+
+async def get_retriever(GROQ_API_KEY, MODEL_NAME_LLAMA, vector_store, lexical_index=None, http_async_client=None):
     """
     Asynchronous function to get a retriever instance from ChatGroq and Qdrant vector store.
 
     Args:
         GROQ_API_KEY (str): API key for ChatGroq.
         MODEL_NAME_LLAMA (str): Model name for the LLaMA model.
-        vector_store (Qdrant): Qdrant vector store.
+        vector_store (Qdrant | LocalVectorStore): Vector store.
+        lexical_index (Optional[LexicalIndex]): BM25 index; when given, dense and lexical results
+            are fused with reciprocal-rank fusion. Defaults to None.
+        http_async_client (Optional[httpx.AsyncClient]): Client for the Groq API. Defaults to the SDK's own.
 
     Returns:
         retriever (RetrievalQA): Retriever instance.
@@ -160,53 +301,405 @@ async def get_retriever(GROQ_API_KEY, MODEL_NAME_LLAMA, vector_store):
         ImdbException: If there is an error in initializing the retriever.
     """
     try:
+        # With context assembly on, the search returns more candidates and the assembler picks CONTEXT_K of them
+        candidates = max(CONTEXT_FETCH_K, CONTEXT_K) if CONTEXT_ASSEMBLY_ENABLED else None
+        if lexical_index is not None:
+            search = HybridRetriever(
+                vector_store=vector_store,
+                lexical_index=lexical_index,
+                k=candidates or HYBRID_K,
+                fetch_k=max(HYBRID_FETCH_K, candidates or 0),
+                dense_weight=HYBRID_DENSE_WEIGHT,
+                lexical_weight=HYBRID_LEXICAL_WEIGHT,
+                rrf_k=HYBRID_RRF_K,
+                lexical_only_max_terms=HYBRID_LEXICAL_ONLY_MAX_TERMS,
+                score_threshold=CONTEXT_SCORE_THRESHOLD
+            )
+        elif CONTEXT_SCORE_THRESHOLD:
+            search = vector_store.as_retriever(
+                search_type="similarity_score_threshold",
+                search_kwargs={"k": candidates or 4, "score_threshold": CONTEXT_SCORE_THRESHOLD}
+            )
+        else:
+            search = vector_store.as_retriever(search_kwargs={"k": candidates or 4})
+
+        if CONTEXT_ASSEMBLY_ENABLED:
+            search = ContextRetriever(retriever=search, k=CONTEXT_K, max_tokens=CONTEXT_MAX_TOKENS, mmr_lambda=CONTEXT_MMR_LAMBDA)
+
         # Initialize retriever
         retriever= RetrievalQA.from_chain_type(
-            llm=ChatGroq(api_key=GROQ_API_KEY, model=MODEL_NAME_LLAMA, temperature=0.5, streaming=True),
+            llm=await get_llm(GROQ_API_KEY, MODEL_NAME_LLAMA, http_async_client=http_async_client),
             chain_type='stuff',
-            retriever=vector_store.as_retriever()
+            retriever=search
             )
         return retriever
     
     except Exception as e:
         raise ImdbException(e, sys)
     
-async def get_response(query: str, retriever, chat_history: List[Dict] = None) -> str:
+async def get_filtered_retriever(retriever, filters):
+    """
+    Returns a copy of the RetrievalQA chain whose vector search applies metadata filters.
+    Only the retriever is rebuilt; the LLM and prompt are shared with the original chain.
+
+    Args:
+        retriever (RetrievalQA): The shared retriever.
+        filters (Dict[str, Dict]): Filters from `extract_filters`.
+
+    Returns:
+        RetrievalQA: A retriever restricted to matching movies.
+    """
+    assembler = retriever.retriever if isinstance(retriever.retriever, ContextRetriever) else None
+    search = assembler.retriever if assembler is not None else retriever.retriever
+    if isinstance(search, HybridRetriever):
+        search = search.with_filters(filters)
+    else:
+        vector_store = search.vectorstore
+        search_kwargs = {**search.search_kwargs, "filter": to_search_filter(vector_store, filters)}
+        search = vector_store.as_retriever(search_type=search.search_type, search_kwargs=search_kwargs)
+    if assembler is not None:
+        search = assembler.with_retriever(search)
+    return RetrievalQA(combine_documents_chain=retriever.combine_documents_chain, retriever=search)
+
+def with_llm(retriever, llm=None, max_tokens=None):
+    """
+    Returns a copy of the RetrievalQA chain answering with another chat model and/or a completion cap.
+    The prompt and the document retriever are shared with the original chain.
+
+    Args:
+        retriever (RetrievalQA): The shared retriever.
+        llm (Optional[BaseChatModel]): Chat model to use instead. Defaults to the chain's own model.
+        max_tokens (Optional[int]): Completion token cap for this request. Defaults to None.
+
+    Returns:
+        RetrievalQA: The chain to invoke.
+    """
+    if llm is None and max_tokens is None:
+        return retriever
+    llm_chain = retriever.combine_documents_chain.llm_chain
+    llm = llm or llm_chain.llm
+    if max_tokens is not None:
+        llm = llm.bind(max_tokens=max_tokens)
+    combine_documents_chain = retriever.combine_documents_chain.model_copy(update={"llm_chain": llm_chain.model_copy(update={"llm": llm})})
+    return RetrievalQA(combine_documents_chain=combine_documents_chain, retriever=retriever.retriever)
+
+async def prepare_rag_query(query: str, retriever, context: str, search_query: str = None, people: Dict = None):
     """
-    Gets a response to a query from the model.
+    Builds the inputs of the RAG chain and narrows the retriever to metadata filters found in the question.
+
+    Args:
+        query (str): The user's query.
+        retriever (RetrievalQA): The shared retriever.
+        context (str): The chat history, already cut to the prompt's token budget.
+        search_query (Optional[str]): Standalone question used for retrieval. Defaults to the history + query.
+        people (Optional[Dict]): `people_index` of the catalogue, to resolve director and star names. Defaults to None.
+
+    Returns:
+        Tuple[str, str, RetrievalQA]: The question for the answer prompt (history + query),
+        the retrieval query and the retriever to use.
+    """
+    prompt_question = f"{context}\nUser: {query}" if context else query
+    # Filters come from the standalone question or the question as asked, never from earlier answers in the history
+    filter_source = search_query or query
+    search_query = search_query or prompt_question
+    logging.info(f"Retrieval query: {shorten_payload(search_query)}")
+
+    # Pre-filter the vector search on metadata mentioned in the question ("90s crime films rated above 8.5")
+    filters = extract_filters(filter_source, people)
+    if filters:
+        logging.info(f"Metadata filters: {filters}")
+        retriever = await get_filtered_retriever(retriever, filters)
+    return prompt_question, search_query, retriever
+
+async def get_response(query: str, retriever, chat_history: List[Dict] = None, cache=None, options: GenerationOptions = None,
+                       fast_llm=None, usage: Dict = None, condenser=None, inflight=None, admission=None, user: str = "",
+                       models=None, people: Dict = None) -> str:
+    """
+    Gets a response to a query from the model. With `inflight`, identical queries asked in the
+    same context while one is already being answered wait for that answer instead of calling the model.
 
     Args:
         query (str): The query to get a response to.
         retriever (RetrievalQA): The retriever to get the response from.
         chat_history (Optional[List[Dict]]): The chat history to use as context. Defaults to None.
+        cache (Optional[SemanticCache]): Semantic answer cache checked before calling the model. Defaults to None.
+        options (Optional[GenerationOptions]): Model routing and token caps. Defaults to None.
+        fast_llm (Optional[BaseChatModel]): Non-reasoning model for simple questions. Defaults to None.
+        usage (Optional[Dict]): Filled with the model used and the hidden/visible token counts.
+        condenser (Optional[QuestionCondenser]): Rewrites follow-ups into standalone retrieval queries. Defaults to None.
+        inflight (Optional[SingleFlight]): Coalesces concurrent identical queries. Defaults to None.
+        admission (Optional[AdmissionController]): Limits concurrent LLM work; raises AdmissionRejected when saturated.
+        user (str): The caller, for fair queueing in `admission`. Defaults to "".
+        models (Optional[ModelFallbackChain]): Deadlines, hedging, circuit breakers and fallback models. Defaults to None.
+        people (Optional[Dict]): `people_index` of the catalogue, to resolve names in metadata filters. Defaults to None.
 
     Returns:
-        str: The response to the query.
+        str: The response to the query, without the <think> block.
     """
-    if chat_history is None:        # Corner case
-        chat_history = []
+    usage = {} if usage is None else usage
+
+    # Only the call doing the work can take an LLM slot, coalesced duplicates just wait for it
+    async def generate():
+        run_usage = {}
+        parts = [text async for text in stream_response(query, retriever, chat_history=chat_history, cache=cache,
+                                                         options=options, fast_llm=fast_llm, usage=run_usage, condenser=condenser,
+                                                         models=models, people=people, admission=admission, user=user)]
+        return "".join(parts), run_usage
+
+    if inflight is None:
+        response, run_usage = await generate()
+    else:
+        context = history_within_budget(chat_history, HISTORY_TOKEN_BUDGET)
+        key = flight_key(query, context, options.model_dump_json() if options else "")
+        (response, run_usage), shared = await inflight.do(key, generate)
+        if shared:
+            logging.info(f"Coalesced with an identical query in flight: {shorten_payload(query)}")
+            run_usage = {**run_usage, "coalesced": True}
+    usage.update(run_usage)
+    return response
 
-    # Format the chat history into a context string
-    context = "\n".join([f"User: {entry['query']}\nBot: {entry['response']}" for entry in chat_history])
+async def stream_response(query: str, retriever, chat_history: List[Dict] = None, cache=None, options: GenerationOptions = None,
+                          fast_llm=None, usage: Dict = None, condenser=None, models=None, people: Dict = None, admission=None,
+                          user: str = ""):
+    """
+    Streams the response to a query token by token, as the LLM generates it. The reasoning
+    model's <think> block is dropped on the fly, so the visible answer starts as soon as it closes.
+
+    Args:
+        query (str): The query to get a response to.
+        retriever (RetrievalQA): The retriever to get the response from.
+        chat_history (Optional[List[Dict]]): The chat history to use as context. Defaults to None.
+        cache (Optional[SemanticCache]): Semantic answer cache checked before calling the model. Defaults to None.
+        options (Optional[GenerationOptions]): Model routing and token caps. Defaults to None.
+        fast_llm (Optional[BaseChatModel]): Non-reasoning model for simple questions. Defaults to None.
+        usage (Optional[Dict]): Filled with the model used and the hidden/visible token counts.
+        condenser (Optional[QuestionCondenser]): Rewrites follow-ups into standalone retrieval queries. Defaults to None.
+        models (Optional[ModelFallbackChain]): Deadlines, hedging, circuit breakers and fallback models. Defaults to None.
+        people (Optional[Dict]): `people_index` of the catalogue, to resolve names in metadata filters. Defaults to None.
+        admission (Optional[AdmissionController]): Limits concurrent LLM work; a cache miss waits for a slot,
+            raising AdmissionRejected when saturated. Defaults to None.
+        user (str): The caller, for fair queueing in `admission`. Defaults to "".
+
+    Yields:
+        str: Pieces of the visible response text. Closing the generator cancels the upstream LLM call.
+    """
+    chunks, release = await start_response(query, retriever, chat_history=chat_history, cache=cache, options=options,
+                                           fast_llm=fast_llm, usage=usage, condenser=condenser, models=models, people=people,
+                                           admission=admission, user=user)
+    try:
+        async for text in chunks:
+            yield text
+    finally:
+        await chunks.aclose()      # Stops the upstream call when the caller stops early
+        release()
+
+async def _single(text: str):
+    yield text
+
+async def start_response(query: str, retriever, chat_history: List[Dict] = None, cache=None, options: GenerationOptions = None,
+                         fast_llm=None, usage: Dict = None, condenser=None, models=None, people: Dict = None, admission=None,
+                         user: str = ""):
+    """
+    The part of `stream_response` that runs before the first token: the semantic cache lookup and, on a miss,
+    the wait for an LLM slot. HTTP handlers await it before sending the status line, so a full queue
+    is answered with a real 429 rather than an error inside a 200 stream.
 
-    logging.info(f"Context: {context}")
-    logging.info(f"User's query: {query}")
+    Args:
+        Same as `stream_response`.
 
-    # Combine the context with the current query
-    full_query = f"{context}\nUser: {query}"
-    logging.info(f"Full query: {full_query}")
+    Returns:
+        Tuple[AsyncIterator[str], Callable[[], None]]: The visible response text, and the release of the LLM
+        slot. The stream releases the slot when it ends; call the release as well in case it is never iterated.
+    """
+    start = time.perf_counter()
+    default_options = GenerationOptions(model=LLM_ROUTE_DEFAULT, max_reasoning_tokens=MAX_REASONING_TOKENS)
+    options = options or default_options
+    usage = {} if usage is None else usage
+    context = history_within_budget(chat_history, HISTORY_TOKEN_BUDGET)
+
+    logging.info(f"Context: {shorten_payload(context)}")
+    logging.info(f"User's query: {shorten_payload(query)}")
+
+    # Serve near-duplicate questions asked in the same context from the cache. Answers cut by a caller's
+    # token caps or made by another model must not reach other callers: non-default options get their own scope
+    cache_context = context if options == default_options else f"{context}\x00{options.model_dump_json()}"
+    if cache is not None:
+        with span("cache_lookup"):
+            cached_response, query_vector = await cache.lookup(query, cache_context)
+        if cached_response is not None:
+            usage.update(model="cache", hidden_tokens=0, visible_tokens=0)
+            return _single(cached_response), (lambda: None)
+
+    # Only work that calls a model takes an LLM slot: cached answers above are never queued or shed
+    with span("queue_wait"):
+        release = await admission.hold(user) if admission is not None else (lambda: None)
+
+    async def answer():
+        nonlocal retriever
+        try:
+            # Retrieve once with the standalone question; the answer prompt gets the history separately
+            search_query = None
+            if condenser is not None:
+                try:
+                    with span("condense"):
+                        search_query = await with_deadline(condenser.condense(query, chat_history), CONDENSE_TIMEOUT_SECONDS, "condense")
+                except StageTimeout as e:
+                    logging.warning(f"{e}, retrieving with the question as asked")
+            # Filter extraction and the search, timed without the query embedding, which is its own stage
+            with span("vector_search", exclusive=True):
+                prompt_question, search_query, retriever = await prepare_rag_query(query, retriever, context, search_query, people)
+                # The cache lookup already embedded the question: a dense search for the same text reuses that vector,
+                # and a keyword query the lexical index answers alone never asks for it
+                known = reuse_query_vector(query, query_vector.tolist()) if cache is not None else nullcontext()
+                with known:
+                    documents = await with_deadline(retriever.retriever.ainvoke(search_query), RETRIEVAL_TIMEOUT_SECONDS, "retrieval")
+
+            use_fast = fast_llm is not None and (
+                options.model == "fast" or (options.model == "auto" and is_simple_query(query, SIMPLE_QUERY_MAX_WORDS))
+            )
+            parts = []
+
+            inputs = {"input_documents": documents, "question": prompt_question}
+            usage["prompt_tokens"] = estimate_tokens(prompt_question) + sum(estimate_tokens(doc.page_content) for doc in documents)
+
+            async def generate(attempts, budget):
+                # attempts: (model, chain) pairs tried in order until one starts streaming
+                think = ThinkTagFilter()
+                generation_start = time.perf_counter()
+                if models is not None:
+                    model, chunks = await models.open_first([(model, lambda chain=chain: stream_model_chunks(chain, inputs)) for model, chain in attempts])
+                else:
+                    model, chunks = attempts[0][0], stream_model_chunks(attempts[0][1], inputs)
+                budget = budget if model == "reasoning" else None
+                usage.update(model=model, hidden_tokens=usage.get("hidden_tokens", 0), visible_tokens=usage.get("visible_tokens", 0))
+                try:
+                    async for content in chunks:
+                        text = think.feed(content)
+                        if text:
+                            if not parts:
+                                observe_stage("first_token", time.perf_counter() - generation_start)
+                                logging.info(f"Time to first token: {time.perf_counter() - start:.2f}s")
+                            parts.append(text)
+                            yield text
+                        elif budget is not None and think.hidden_tokens > budget:
+                            usage["reasoning_budget_exceeded"] = True
+                            break
+                    text = think.flush()
+                    if text:
+                        parts.append(text)
+                        yield text
+                finally:
+                    await chunks.aclose()      # Stops the upstream call when we stop early or the client goes away
+                    observe_stage("generation", time.perf_counter() - generation_start)
+                    usage["hidden_tokens"] += think.hidden_tokens
+                    usage["visible_tokens"] += think.visible_tokens
+
+            # Fallback order: the routed model, the fast model, then the configured fallback models
+            fallbacks = [("fast", with_llm(retriever, fast_llm, options.max_tokens))] if fast_llm is not None else []
+            if models is not None:
+                fallbacks += [(name, with_llm(retriever, llm, options.max_tokens)) for name, llm in models.fallbacks]
+            if use_fast:
+                attempts, budget = fallbacks, None
+            else:
+                attempts, budget = [("reasoning", with_llm(retriever, max_tokens=options.max_tokens))] + fallbacks, options.max_reasoning_tokens
+            async for text in generate(attempts, budget if fast_llm is not None else None):
+                yield text
+
+            # Reasoning went over budget before any visible text: answer with the fast model instead
+            if usage.get("reasoning_budget_exceeded"):
+                logging.info(f"Reasoning budget of {budget} tokens exceeded, regenerating with the fast model")
+                async for text in generate(fallbacks, None):
+                    yield text
+
+            response = "".join(parts)
+            usage["seconds"] = round(time.perf_counter() - start, 2)
+            logging.info(f"Response from model in {usage['seconds']}s ({usage}): {shorten_payload(response)}")
+            if cache is not None:
+                cache.store(query_vector, cache_context, response)
+        finally:
+            release()
+
+    return answer(), release
+
+async def stream_model_chunks(chain, inputs: Dict):
+    """
+    Streams the raw chat-model chunks of a stuff chain call.
 
-    # Get the response from the retriever
-    response = retriever.invoke(full_query)
-    logging.info(f"Response from model: {response}\n")
+    Args:
+        chain (RetrievalQA): The chain whose combine_documents_chain is called.
+        inputs (Dict): "input_documents" and "question".
 
-    # Clean up the response if necessary
-    if 'query' in response:
-        response = await remove_query(response)
-    if "<think>" in response:
-        response = await remove_think_tags(response)
+    Yields:
+        str: Chunk texts, <think> block included. Closing the generator cancels the upstream call.
+    """
+    events = chain.combine_documents_chain.astream_events(inputs, version="v2")
+    try:
+        async for event in events:
+            if event["event"] == "on_chat_model_stream":
+                yield event["data"]["chunk"].content or ""
+    finally:
+        await events.aclose()
 
-    return response
+def answer_from_indexes(query: str, catalog=None, table=None) -> Dict[str, str] | None:
+    """
+    Answers fact lookups from the movie catalog and filter/sort/aggregate questions from the analytics table.
+
+    Args:
+        query (str): The user's query.
+        catalog (Optional[MovieCatalog]): In-memory movie index. Defaults to None.
+        table (Optional[MovieTable]): In-memory movie table. Defaults to None.
+
+    Returns:
+        Dict[str, str] | None: The "answer" and "served_by" ("catalog" or "analytics"), or None when the RAG chain is needed.
+    """
+    if catalog is not None:
+        answer = catalog.answer(query)
+        if answer is not None:
+            logging.info(f"Answered from the movie catalog: {shorten_payload(answer)}")
+            return {"answer": answer, "served_by": "catalog"}
+
+    if table is not None:
+        result = table.answer(query)
+        if result is not None:
+            logging.info(f"Answered from the analytics table with plan {result['plan']}")
+            return {"answer": result["answer"], "served_by": "analytics"}
+    return None
+
+async def answer_query(query: str, retriever, chat_history: List[Dict] = None, cache=None, catalog=None, table=None,
+                       options: GenerationOptions = None, fast_llm=None, condenser=None, inflight=None, admission=None,
+                       user: str = "", models=None, people: Dict = None) -> Dict:
+    """
+    Routes a query: plain fact lookups are answered from the movie catalog, filter/sort/aggregate
+    questions from the analytics table, everything else goes through `get_response`.
+
+    Args:
+        query (str): The query to get a response to.
+        retriever (RetrievalQA): The retriever used for open-ended questions.
+        chat_history (Optional[List[Dict]]): The chat history to use as context. Defaults to None.
+        cache (Optional[SemanticCache]): Semantic answer cache for the RAG path. Defaults to None.
+        catalog (Optional[MovieCatalog]): In-memory movie index for the fast path. Defaults to None.
+        table (Optional[MovieTable]): In-memory movie table for analytical questions. Defaults to None.
+        options (Optional[GenerationOptions]): Model routing and token caps for the RAG path. Defaults to None.
+        fast_llm (Optional[BaseChatModel]): Non-reasoning model for simple questions. Defaults to None.
+        condenser (Optional[QuestionCondenser]): Rewrites follow-ups into standalone retrieval queries. Defaults to None.
+        inflight (Optional[SingleFlight]): Coalesces concurrent identical RAG queries. Defaults to None.
+        admission (Optional[AdmissionController]): Limits concurrent LLM work for the RAG path. Defaults to None.
+        user (str): The caller, for fair queueing in `admission`. Defaults to "".
+        models (Optional[ModelFallbackChain]): Deadlines, hedging, circuit breakers and fallback models. Defaults to None.
+        people (Optional[Dict]): `people_index` of the catalogue, to resolve names in metadata filters. Defaults to None.
+
+    Returns:
+        Dict: The "answer", "served_by" ("catalog", "analytics" or "rag") and, for RAG, the token "usage".
+    """
+    result = answer_from_indexes(query, catalog=catalog, table=table)
+    if result is not None:
+        return result
+
+    usage = {}
+    answer = await get_response(query=query, retriever=retriever, chat_history=chat_history, cache=cache,
+                                options=options, fast_llm=fast_llm, usage=usage, condenser=condenser, inflight=inflight,
+                                admission=admission, user=user, models=models, people=people)
+    return {"answer": answer, "served_by": "rag", "usage": usage}
 
 async def remove_think_tags(text):
     """
@@ -240,6 +733,8 @@ ALGORITHM = os.getenv("ALGORITHM")
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt runs on its own bounded pool so logins do not stall the event loop
+password_pool = PasswordPool(workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING)
 # OAuth2 scheme for authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -267,6 +762,26 @@ class RequestState(BaseModel):
     message: str
 
 # JWT Authentication Functions
+async def run_password_task(func, *args):
+    """
+    Runs a bcrypt call on the password pool, answering 503 with Retry-After when it is saturated.
+
+    Args:
+        func (Callable): `pwd_context.verify` or `pwd_context.hash`.
+
+    Returns:
+        Any: The result of `func`.
+    """
+    try:
+        return await password_pool.run(func, *args)
+    except PasswordPoolSaturated as e:
+        logging.warning(f"Password pool saturated: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-ins in progress, please retry shortly",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+
 async def verify_password(plain_password, hashed_password):
     """
     Verifies that a plain text password matches its hashed counterpart.
@@ -279,7 +794,7 @@ async def verify_password(plain_password, hashed_password):
         bool: True if the plain text password matches the hashed password, False otherwise.
     """
 
-    return pwd_context.verify(plain_password, hashed_password)
+    return await run_password_task(pwd_context.verify, plain_password, hashed_password)
 
 async def get_password_hash(password):
     """
@@ -291,46 +806,138 @@ async def get_password_hash(password):
     Returns:
         str: The hashed password.
     """
-    return pwd_context.hash(password)
+    return await run_password_task(pwd_context.hash, password)
+
+def get_mongo_client(MONGODB_URI, max_pool_size=MONGODB_MAX_POOL_SIZE, min_pool_size=MONGODB_MIN_POOL_SIZE):
+    """
+    Creates the process-wide async MongoDB client. Connections are opened lazily and pooled.
+
+    Args:
+        MONGODB_URI (str): The MongoDB connection string.
+        max_pool_size (int): Connections kept per server at most. Defaults to MONGODB_MAX_POOL_SIZE.
+        min_pool_size (int): Connections kept open when idle. Defaults to MONGODB_MIN_POOL_SIZE.
+
+    Returns:
+        AsyncMongoClient: The client.
+    """
+    return AsyncMongoClient(
+        MONGODB_URI,
+        tlsCAFile=certifi.where(),
+        maxPoolSize=max_pool_size,
+        minPoolSize=min_pool_size,
+        serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS
+    )
 
-async def get_user(username: str):
+async def get_user(username: str, users_collection):
     """
     Retrieves a user from the database based on their username.
 
     Args:
         username (str): The username to retrieve the user by.
+        users_collection (AsyncCollection): The shared users collection.
 
     Returns:
         UserInDB: The user associated with the given username, or None if no user is found.
     """
-    client = MongoClient(MONGODB_URI)
-    db = client["chat_db"]
-    users_collection = db["users"]
-    user_data = users_collection.find_one({"username": username})
+    user_data = await users_collection.find_one({"username": username})
     if user_data:
         # Convert MongoDB document to Pydantic model
         user_data["id"] = str(user_data["_id"])  # Ensure string type
         return UserInDB(**user_data)
     return None
 
-async def authenticate_user(username: str, password: str):
+async def authenticate_user(username: str, password: str, users_collection):
     """
     Authenticates a user based on their username and password.
 
     Args:
         username (str): The username to authenticate.
         password (str): The password to authenticate with.
+        users_collection (AsyncCollection): The shared users collection.
 
     Returns:
         UserInDB | False: The authenticated user if successful, False otherwise.
     """
-    user = await get_user(username)
+    user = await get_user(username, users_collection)
     if not user:
         return False
     if not await verify_password(password, user.hashed_password):
         return False
     return user
 
+def token_claims(user, trust_claims_seconds: int = 0) -> Dict:
+    """
+    Returns the user claims signed into an access token: a password fingerprint so a password
+    change revokes old tokens and, only when claims are trusted for a while after login, the
+    profile fields. With claim trust off the token carries no personal data.
+
+    Args:
+        user (UserInDB): The authenticated user.
+        trust_claims_seconds (int): The claim-trust window, see `resolve_user`. Defaults to 0 (never).
+
+    Returns:
+        Dict: Claims to merge into the token data.
+    """
+    claims = {"pwd": password_fingerprint(user.hashed_password)}
+    if trust_claims_seconds:
+        claims.update(uid=user.id, email=user.email, name=user.full_name, disabled=bool(user.disabled))
+    return claims
+
+async def resolve_user(payload: Dict, users_collection, principal_cache=None, trust_claims_seconds: int = 0):
+    """
+    Resolves the user behind a verified token payload without a database round-trip when possible:
+    from the signed claims if the token is younger than `trust_claims_seconds`, else from the
+    principal cache, else from Mongo (and then cached).
+
+    Args:
+        payload (Dict): The decoded JWT payload.
+        users_collection (AsyncCollection): The shared users collection.
+        principal_cache (Optional[PrincipalCache]): Cache of users keyed by username. Defaults to None.
+        trust_claims_seconds (int): How long after issuance the token claims are trusted. Defaults to 0 (never).
+
+    Returns:
+        UserInDB | None: The user, or None when unknown. Raises a 401 when the token predates a password change.
+    """
+    username = payload.get("sub")
+    issued_at = payload.get("iat")
+    # Tokens issued while claim trust was off carry no profile ("uid" and the rest) and always take the lookup,
+    # as do tokens issued before the user was last changed (disabled, new password)
+    changed = principal_cache is not None and issued_at and principal_cache.changed_since(username, issued_at)
+    if trust_claims_seconds and "uid" in payload and issued_at and not changed and time.time() - issued_at <= trust_claims_seconds:
+        return UserInDB(
+            username=username, id=payload.get("uid"), email=payload.get("email"), full_name=payload.get("name"),
+            disabled=payload.get("disabled"), hashed_password=""
+        )
+
+    user = principal_cache.get(username) if principal_cache is not None else None
+    if user is None:
+        user = await get_user(username, users_collection)
+        if user is not None and principal_cache is not None:
+            principal_cache.put(user)
+
+    if user is not None and "pwd" in payload and payload["pwd"] != password_fingerprint(user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token was issued before a password change",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+async def update_user(username: str, updates: Dict, users_collection, principal_cache=None):
+    """
+    Updates a user document (e.g. "disabled" or "hashed_password") and drops the cached principal,
+    so the change applies from the next request on.
+
+    Args:
+        username (str): The user to update.
+        updates (Dict): Fields to $set.
+        users_collection (AsyncCollection): The shared users collection.
+        principal_cache (Optional[PrincipalCache]): Cache to invalidate. Defaults to None.
+    """
+    await users_collection.update_one({"username": username}, {"$set": updates})
+    if principal_cache is not None:
+        principal_cache.invalidate(username)
+
 async def create_access_token(data: dict, expires_delta: timedelta | None = None):
     """
     Creates a JWT access token based on the given data and optional expiration delta.
@@ -351,7 +958,7 @@ async def create_access_token(data: dict, expires_delta: timedelta | None = None
             expire = datetime.now(timezone.utc) + expires_delta
         else:
             expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-        to_encode.update({"exp": expire})
+        to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     except Exception as e:
@@ -1,18 +1,750 @@
+import sys
+import time
+import uuid
+import inspect
+import asyncio
+import tempfile
 import warnings
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from pydantic import ValidationError
+from fastapi.testclient import TestClient
+from langchain.schema import Document
+from langchain.chains import RetrievalQA
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.language_models import GenericFakeChatModel
+from pymongo import AsyncMongoClient
 
-from src.utils import get_vector_store, get_retriever, get_response
+from src.catalog import MovieCatalog
+from src.analytics import AnalyticsPlan, MovieTable
+from src.filters import extract_filters, people_index
+from src.singleflight import SingleFlight
+from src.resilience import ModelFallbackChain, StageTimeout
+from src.resources import ResourceRegistry
+from src.admission import AdmissionController, AdmissionRejected
+from src.local_store import LocalVectorStore
+from src.ingestion import sync_collection
+from src.reasoning import GenerationOptions, ThinkTagFilter
+from src.cache import SemanticCache
+from src.metrics import TimedEmbeddings
+from src.auth_cache import PrincipalCache
+from src import config
+from src.utils import get_vector_store, get_retriever, get_response, stream_response, start_response, answer_query, get_user, token_claims, get_mongo_client, iter_documents, iter_chunked_documents
 from src.config import QDRANT_COLLECTION_NAME, QDRANT_HOST, QDRANT_API_KEY, OPENAI_API_KEY, GROQ_API_KEY, MODEL_NAME_LLAMA
 
 
 warnings.filterwarnings("ignore")
 
-# Connect vector store
-vector_store = get_vector_store(QDRANT_HOST=QDRANT_HOST, API_KEY=QDRANT_API_KEY, QDRANT_COLLECTION_NAME=QDRANT_COLLECTION_NAME, OPENAI_API_KEY=OPENAI_API_KEY)
 
+class SlowRetriever:
+    """Stand-in for the RetrievalQA chain: streams one token after a wait, like a slow Groq call."""
 
-retriever=get_retriever(GROQ_API_KEY=GROQ_API_KEY, MODEL_NAME_LLAMA=MODEL_NAME_LLAMA, vector_store=vector_store)
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.retriever = self.combine_documents_chain = self
 
+    async def ainvoke(self, query):
+        return []
 
-query="Inception, who are actors in it?"
-print(get_response(query=query, retriever=retriever))
+    async def astream_events(self, query, version):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        yield {"event": "on_chat_model_stream", "data": {"chunk": AIMessageChunk(content="<think>plan</think>stub answer")}}
 
+
+# N concurrent slow queries must overlap on one event loop: ~1 latency in total, not N.
+def test_concurrent_queries_do_not_block_event_loop(n=20, latency=0.5):
+    async def run():
+        retriever = SlowRetriever(latency)
+        start = time.perf_counter()
+        answers = await asyncio.gather(*(get_response(query=f"query {i}", retriever=retriever) for i in range(n)))
+        return answers, time.perf_counter() - start
+
+    answers, elapsed = asyncio.run(run())
+    assert answers == ["stub answer"] * n
+    assert elapsed < 2 * latency, f"{n} queries took {elapsed:.2f}s, expected about {latency}s"
+    print(f"{n} concurrent queries with {latency}s latency finished in {elapsed:.2f}s")
+
+
+# Identical queries arriving together share one upstream call; a different query gets its own.
+def test_identical_queries_are_coalesced(n=20, latency=0.3):
+    async def run():
+        retriever, inflight = SlowRetriever(latency), SingleFlight()
+        queries = ["Who directed Inception?", "who directed inception "] * (n // 2) + ["Movies like Inception"]
+        answers = await asyncio.gather(*(get_response(query=query, retriever=retriever, inflight=inflight) for query in queries))
+        return answers, retriever.calls, inflight.stats()
+
+    answers, calls, stats = asyncio.run(run())
+    assert answers == ["stub answer"] * (n + 1)
+    assert calls == 2, f"{n + 1} queries made {calls} upstream calls, expected 2"
+    assert stats["coalesced"] == n - 1 and stats["in_flight"] == 0
+    print(f"{n + 1} queries, {calls} upstream calls: {stats}")
+
+
+class SlowCollection:
+    """Stand-in for an AsyncMongoClient collection: every call waits on the network without blocking the loop."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def find_one(self, query, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return {"_id": "1", "username": query.get("username", "user"), "hashed_password": "x", "history": []}
+
+    async def update_one(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+class SlowMongoClient:
+    """Stand-in for AsyncMongoClient: client[db]["users"] and client[db]["sessions"] are SlowCollections."""
+
+    def __init__(self, latency):
+        self.database = {"users": SlowCollection(latency), "sessions": SlowCollection(latency)}
+
+    def __getitem__(self, name):
+        return self.database
+
+
+# The shared client is pymongo's AsyncMongoClient, and the request path (registry collections, get_user,
+# find_session, save_history) awaits it: a 10ms heartbeat keeps ticking through concurrent lookups.
+def test_mongo_access_does_not_stall_event_loop(n=200, latency=0.2, tick=0.01):
+    import main
+
+    async def run():
+        client = get_mongo_client("mongodb://localhost:27017")
+        users_collection = client["imdb"]["users"]
+        assert isinstance(client, AsyncMongoClient)
+        assert inspect.iscoroutinefunction(users_collection.find_one) and inspect.iscoroutinefunction(users_collection.update_one)
+        await client.close()
+
+        resources = ResourceRegistry()
+        resources.mongo = SlowMongoClient(latency)
+        lags, done = [], asyncio.Event()
+
+        async def heartbeat():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(tick)
+                lags.append(time.perf_counter() - start - tick)
+
+        async def request(i):
+            user = await get_user(f"user{i}", resources.users)
+            query = main.QueryRequest(user_id=str(i), session_id=str(i), user_query="Who directed Inception?")
+            session = await main.find_session(resources.sessions, query, user.username)
+            await main.save_history(resources.sessions, session, query.user_query, "Christopher Nolan")
+
+        monitor = asyncio.create_task(heartbeat())
+        start = time.perf_counter()
+        await asyncio.gather(*(request(i) for i in range(n)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await monitor
+        return elapsed, max(lags)
+
+    elapsed, max_lag = asyncio.run(run())
+    assert elapsed < 2 * 3 * latency, f"{n} requests took {elapsed:.2f}s, expected about {3 * latency}s"
+    assert max_lag < 0.05, f"Event loop stalled for {max_lag * 1000:.0f}ms"
+    print(f"{n} concurrent Mongo requests in {elapsed:.2f}s, worst event-loop lag {max_lag * 1000:.1f}ms")
+
+
+# The previous df.iterrows() builder, kept as the reference output for the test below.
+def iterrows_documents(path):
+    df = pd.read_csv(path)
+    return [
+        Document(
+            metadata={"title": row["Series_Title"], "year": row["Released_Year"], "genre": row["Genre"], "rating": row["IMDB_Rating"]},
+            page_content=(
+                f"Movie: {row['Series_Title']}, Released: {row['Released_Year']}, Genre: {row['Genre']}, "
+                f"Rating: {row['IMDB_Rating']}, Director: {row['Director']},  Overview: {row['Overview']}"
+                f"Starring: {row['Star1']}, {row['Star2']}, {row['Star3']}, {row['Star4']}."
+            )
+        )
+        for _, row in df.iterrows()
+    ]
+
+
+class CountingReader:
+    """Text file wrapper that hands pandas small reads and counts the characters it consumed."""
+
+    def __init__(self, file, block=4096):
+        self.file, self.block, self.consumed = file, block, 0
+
+    def read(self, size=-1):
+        data = self.file.read(self.block if size is None or size < 0 else min(size, self.block))
+        self.consumed += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+# The streaming builder produces the same documents as iterrows, and yields the first one before the file is read.
+def test_streaming_document_builder(path="data/imdb_top_1000.csv"):
+    baseline = iterrows_documents(path)
+    with open(path, encoding="utf-8") as file:
+        reader = CountingReader(file)
+        documents = iter_documents(reader, chunksize=10)
+        first = next(documents)
+        consumed_before_first = reader.consumed
+        streamed = [first] + list(documents)
+
+    assert [d.page_content for d in streamed] == [d.page_content for d in baseline]
+    assert [d.metadata["title"] for d in streamed] == [d.metadata["title"] for d in baseline]
+    assert consumed_before_first < reader.consumed / 10
+
+
+# Fact lookups are served by the catalog without touching the retriever; open questions still go to RAG.
+def test_catalog_fast_path(path="data/imdb_top_1000.csv"):
+    catalog = MovieCatalog(doc.metadata for doc in iter_documents(path))
+
+    async def run(query):
+        return await answer_query(query=query, retriever=SlowRetriever(0), catalog=catalog)
+
+    lookup = asyncio.run(run("Inception, who are actors in it?"))
+    assert lookup["served_by"] == "catalog"
+    assert "Leonardo DiCaprio" in lookup["answer"]
+    assert asyncio.run(run("Why is Inception so confusing?"))["served_by"] == "rag"
+    assert asyncio.run(run("Who played the Joker in The Dark Knight?"))["served_by"] == "rag"
+    assert asyncio.run(run("Who played in The Dark Knight?"))["served_by"] == "catalog"
+    for compound in ("Who directed Alien and Aliens?", "What year was Heat released and is it good?", "Who starred in Inception and who directed it?"):
+        assert catalog.answer(compound) is None, compound
+    assert "David Yates" in catalog.answer("Who directed Harry Potter and the Deathly Hallows: Part 2?")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        catalog.answer("Who directed The Dark Knight?")
+    print(f"Catalog lookup: {(time.perf_counter() - start) * 1e4:.0f} microseconds per query")
+
+
+def test_extract_filters():
+    people = people_index([{"director": "Christopher Nolan", "stars": ["Tom Hanks", "Tom Cruise"]}])
+    cases = {
+        "90s crime films rated above 8.5": {"year": {"gte": 1990, "lte": 1999}, "genre": {"any": ["Crime"]}, "rating": {"gt": 8.5}},
+        "best movies from 2015 to 2020": {"year": {"gte": 2015, "lte": 2020}},
+        "best films between 1990 and 2000": {"year": {"gte": 1990, "lte": 2000}},
+        "movies of 2010": {"year": {"eq": 2010}},
+        "top 3 films released during 1994": {"year": {"eq": 1994}},
+        "comedies made before 1960 under 2 hours": {"year": {"lt": 1960}, "genre": {"any": ["Comedy"]}, "runtime": {"lt": 120}},
+        "actors in their 40s": {},
+        "Movies directed by Nolan.": {"director": {"any": ["Christopher Nolan"]}},
+        "films starring Tom Hanks, please": {"stars": {"any": ["Tom Hanks"]}},
+        "films starring Someone Unknown": {},
+    }
+    for query, expected in cases.items():
+        assert extract_filters(query, people) == expected, (query, extract_filters(query, people))
+
+
+# The planner answers only what it fully understood; any constraint it could not use sends the question to RAG.
+def test_analytics_planner(path="data/imdb_top_1000.csv"):
+    table = MovieTable(doc.metadata for doc in iter_documents(path))
+    planned = {
+        "highest grossing movies of 2019": ({"year": {"eq": 2019}}, "gross", 10),
+        "top 3 films released during 1994": ({"year": {"eq": 1994}}, "rating", 3),
+        "best films between 1990 and 2000": ({"year": {"gte": 1990, "lte": 2000}}, "rating", 10),
+        "best movies from 2015 to 2020": ({"year": {"gte": 2015, "lte": 2020}}, "rating", 10),
+        "top 10 crime movies of the 90s": ({"year": {"gte": 1990, "lte": 1999}, "genre": {"any": ["Crime"]}}, "rating", 10),
+        "highest rated movies of all time": ({}, "rating", 10),
+    }
+    for question, (filters, field, limit) in planned.items():
+        plan = table.plan(question)
+        assert plan is not None and (plan.filters, plan.field, plan.limit) == (filters, field, limit), (question, plan)
+    assert table.plan("Which director has the most movies?").group_by == "director"
+
+    for question in ["top movies rated R", "best anime", "best horror", "who is the best director?", "Who is the most popular actor?",
+                     "best movies with actors in their 40s", "top 5 movies over 9000 votes"]:
+        assert table.plan(question) is None, (question, table.plan(question))
+
+
+# Analytics plans with values of the wrong type are rejected up front: 422 from /analytics, not a 500 from pandas.
+def test_invalid_analytics_plans_are_rejected(path="data/imdb_top_1000.csv"):
+    import main
+    invalid = [{"title": {"gt": 5}}, {"rating": {"gt": "abc"}}, {"genre": {"any": "Drama"}}, {"stars": {"eq": "Tom Hanks"}}, {"year": {"eq": 1994, "lt": 2000}}]
+    for filters in invalid:
+        try:
+            AnalyticsPlan(filters=filters)
+        except ValidationError:
+            continue
+        raise AssertionError(f"Accepted invalid filters {filters}")
+
+    class Resources:
+        table = MovieTable(doc.metadata for doc in iter_documents(path))
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: None
+    main.app.dependency_overrides[main.get_resources] = Resources
+    try:
+        client = TestClient(main.app)
+        assert all(client.post("/analytics", json={"plan": {"filters": filters}}).status_code == 422 for filters in invalid)
+        valid = client.post("/analytics", json={"plan": {"filters": {"genre": {"any": ["Drama"]}, "rating": {"gte": 8.5}}, "metric": "count"}})
+        assert valid.status_code == 200 and valid.json()["result"]["value"] > 0
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+async def stub_stream(*chunks, delay=0.0, error=None):
+    """Stand-in for a model stream: waits `delay` before each chunk, then raises `error` if given."""
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        yield chunk
+    if error is not None:
+        await asyncio.sleep(delay)
+        raise error
+
+
+# A half-open trial that is cancelled (client gone) must not leave the breaker shut for good.
+def test_cancelled_breaker_trial_is_released():
+    async def run():
+        models = ModelFallbackChain(failure_threshold=1, reset_seconds=0)
+        try:
+            await models.open("m", lambda: stub_stream(error=RuntimeError("down")))
+        except RuntimeError:
+            pass
+        trial = asyncio.create_task(models.open("m", lambda: stub_stream("late", delay=10)))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        return [chunk async for chunk in await models.open("m", lambda: stub_stream("ok"))], models.breaker("m").state
+
+    chunks, state = asyncio.run(run())
+    assert chunks == ["ok"] and state == "closed"
+
+
+
+class FakeClock:
+    """Monotonic clock the test moves by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_model_chain_hedges_and_times_out():
+    async def run():
+        models = ModelFallbackChain(hedge=True, hedge_delay=0.05, first_token_timeout=1)
+        streams = iter([stub_stream("slow", delay=5), stub_stream("fast", "answer", delay=0.01)])
+        hedged = [chunk async for chunk in await models.open("m", lambda: next(streams))]
+
+        first_token = ModelFallbackChain(first_token_timeout=0.05)
+        try:
+            await first_token.open("m", lambda: stub_stream("late", delay=5))
+        except StageTimeout as e:
+            first_token_stage = e.stage
+
+        whole_stream = ModelFallbackChain(stream_timeout=0.1)
+        received = []
+        try:
+            async for chunk in await whole_stream.open("m", lambda: stub_stream(*"abcdefgh", delay=0.03)):
+                received.append(chunk)
+        except StageTimeout as e:
+            stream_stage = e.stage
+        return (hedged, models.hedges, models.hedge_wins, first_token_stage, first_token.breaker("m").failures,
+                received, stream_stage, whole_stream.breaker("m").failures)
+
+    hedged, hedges, wins, first_token_stage, first_token_failures, received, stream_stage, stream_failures = asyncio.run(run())
+    assert hedged == ["fast", "answer"] and hedges == 1 and wins == 1
+    assert first_token_stage == "m first token" and first_token_failures == 1
+    assert 0 < len(received) < 8 and stream_stage == "m generation" and stream_failures == 1
+
+
+def test_model_chain_falls_back_in_order_and_breaker_recovers():
+    clock = FakeClock()
+
+    async def run():
+        models = ModelFallbackChain(failure_threshold=2, reset_seconds=30, clock=clock)
+        tried, results, states = [], [], []
+
+        def attempt(model, *chunks, error=None):
+            def factory():
+                tried.append(model)
+                return stub_stream(*chunks, error=error)
+            return model, factory
+
+        async def answer(*attempts):
+            model, stream = await models.open_first(list(attempts))
+            results.append((model, [chunk async for chunk in stream]))
+
+        # Two failures open the primary's breaker; the third call skips it without a request
+        for _ in range(3):
+            await answer(attempt("primary", error=RuntimeError("down")), attempt("secondary", "ok"), attempt("tertiary", "never"))
+        states.append(models.breaker("primary").state)
+
+        # A failed half-open trial re-opens it, a successful one closes it
+        clock.now += 30
+        states.append(models.breaker("primary").state)
+        try:
+            await answer(attempt("primary", error=RuntimeError("still down")))
+        except RuntimeError:
+            states.append(models.breaker("primary").state)
+        clock.now += 30
+        await answer(attempt("primary", "back"), attempt("secondary", "ok"))
+        states.append(models.breaker("primary").state)
+        return tried, results, states
+
+    tried, results, states = asyncio.run(run())
+    assert tried == ["primary", "secondary", "primary", "secondary", "secondary", "primary", "primary"]
+    assert results == [("secondary", ["ok"])] * 3 + [("primary", ["back"])]
+    assert states == ["open", "half-open", "open", "closed"]
+
+
+def test_admission_queue_is_fair_and_bounded():
+    async def run():
+        admission = AdmissionController(max_concurrency=1, max_queue=4, max_queue_per_user=2, queue_timeout=1)
+        release_first = await admission.hold("a")
+        served, rejections = [], []
+
+        async def ask(user):
+            try:
+                release = await admission.hold(user)
+            except AdmissionRejected as e:
+                rejections.append((user, str(e)))
+                return
+            served.append(user)
+            await asyncio.sleep(0)
+            release()
+            release()       # A second release must not free someone else's slot
+
+        tasks = []
+        for user in ("a", "a", "b", "a", "c", "d"):
+            tasks.append(asyncio.create_task(ask(user)))
+            await asyncio.sleep(0)
+        release_first()
+        release_first()
+        await asyncio.gather(*tasks)
+
+        slow = AdmissionController(max_concurrency=1, queue_timeout=0.05)
+        await slow.hold("a")
+        try:
+            await slow.acquire("b")
+        except AdmissionRejected as e:
+            timed_out = e.retry_after
+        return served, rejections, admission.stats(), timed_out, slow.stats()
+
+    served, rejections, stats, timed_out, slow = asyncio.run(run())
+    assert served == ["a", "b", "c", "a"]       # Round-robin over users, FIFO within one
+    assert [user for user, _ in rejections] == ["a", "d"]
+    assert "already queued" in rejections[0][1] and "queue full" in rejections[1][1]
+    assert stats["active"] == 0 and stats["queued"] == 0 and stats["rejected"] == 2
+    assert timed_out == 1 and slow["queued"] == 0 and slow["active"] == 1 and slow["rejected"] == 1
+
+
+def test_admission_limit_follows_provider_rate_limits():
+    clock = FakeClock()
+
+    async def run():
+        admission = AdmissionController(max_concurrency=4, clock=clock)
+        admission.observe(429, {"retry-after": "5"})
+        paused = (admission.limit, admission.retry_after())
+        waiter = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0.01)
+        admitted_while_paused = waiter.done()
+
+        clock.now += 5
+        admission.observe(200, {})
+        await asyncio.sleep(0.01)
+        admitted_after_reset = waiter.done()
+        admission.release()
+
+        limits = [admission.limit]
+        for _ in range(6):
+            admission.observe(200, {})
+            limits.append(admission.limit)
+
+        admission.observe(200, {"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m30s"})
+        window = admission.paused_until - clock.now
+        for _ in range(4):
+            admission.observe(429, {})
+        return paused, admitted_while_paused, admitted_after_reset, limits, window, admission.limit
+
+    paused, admitted_while_paused, admitted_after_reset, limits, window, floor = asyncio.run(run())
+    assert paused == (2.0, 5)
+    assert not admitted_while_paused and admitted_after_reset
+    assert limits[0] == 2.5 and all(a < b for a, b in zip(limits, limits[1:-1])) and limits[-1] == 4.0
+    assert window == 90 and floor == 1.0
+
+
+def test_local_store_matches_brute_force_search(n=300, dim=16, k=5):
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(n, dim))
+    genres = ["Drama", "Comedy", "Crime", "Sci-Fi"]
+    metadatas = [{"genre": [genres[i % 4], genres[(i * 7) % 4]], "rating": round(7 + (i % 30) / 10, 1), "year": 1950 + i % 70}
+                 for i in range(n)]
+    ids = [str(uuid.UUID(int=i)) for i in range(n)]
+
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(embeddings=None)
+        store.add_vectors(ids, vectors.tolist(), [f"movie {i}" for i in range(n)], metadatas)
+        store.save(path)
+        store = LocalVectorStore.load(path, embeddings=None)       # Searches the memory-mapped matrix
+
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        filters = {"genre": {"any": ["Drama"]}, "rating": {"gte": 8.0}, "year": {"lt": 2000}}
+        for query in rng.normal(size=(10, dim)):
+            cosine = unit @ (query / np.linalg.norm(query))
+            results = store.similarity_search_with_score_by_vector(query.tolist(), k=k)
+            assert [doc.id for doc, _ in results] == [ids[i] for i in np.argsort(-cosine)[:k]]
+            assert np.allclose([score for _, score in results], np.sort(cosine)[::-1][:k], atol=1e-5)
+
+            allowed = [i for i, m in enumerate(metadatas) if "Drama" in m["genre"] and m["rating"] >= 8.0 and m["year"] < 2000]
+            results = store.similarity_search_with_score_by_vector(query.tolist(), k=k, filter=filters)
+            assert [doc.id for doc, _ in results] == [ids[i] for i in sorted(allowed, key=lambda i: -cosine[i])[:k]]
+
+        assert store.similarity_search_with_score_by_vector(vectors[0].tolist(), k=k, filter={"genre": {"any": ["Western"]}}) == []
+
+
+class FakeQdrantClient:
+    """In-memory stand-in for the async Qdrant client calls made by the ingestion."""
+
+    def __init__(self):
+        self.points = {}
+        self.upserted = []
+
+    async def scroll(self, collection_name, with_payload, with_vectors, limit, offset):
+        ids, start = sorted(self.points), offset or 0
+        page = [SimpleNamespace(id=point_id, payload=self.points[point_id]) for point_id in ids[start:start + limit]]
+        return page, start + limit if start + limit < len(ids) else None
+
+    async def upsert(self, collection_name, points):
+        for point in points:
+            self.points[point.id] = point.payload
+            self.upserted.append(point.id)
+
+
+class FakeQdrantStore:
+    """Qdrant vector store backed by `FakeQdrantClient`, embedding each text as [length, 1]."""
+
+    collection_name, metadata_payload_key, content_payload_key, vector_name = "movies", "metadata", "page_content", None
+
+    def __init__(self):
+        self.async_client = FakeQdrantClient()
+        self.embeddings = self
+        self.deleted = []
+
+    async def aembed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    async def adelete(self, ids):
+        for point_id in ids:
+            del self.async_client.points[point_id]
+        self.deleted.extend(ids)
+
+
+def test_ingestion_diff_sync():
+    def chunks(*rows):
+        documents = [Document(page_content="\n".join(lines), metadata={"title": title, "year": 2000}) for title, lines in rows]
+        return list(iter_chunked_documents(documents, CHUNK_SIZE=40, CHUNK_OVERLAP=0))
+
+    long_plot = ["A heist inside a dream inside a dream.", "The spinning top keeps on spinning."]
+    first = chunks(("Alpha", ["Unchanged row."]), ("Beta", ["Removed row."]), ("Gamma", long_plot))
+    second = chunks(("Alpha", ["Unchanged row."]), ("Gamma", ["A shorter plot."]), ("Delta", ["New row."]))
+
+    async def run():
+        store = FakeQdrantStore()
+        initial = await sync_collection(store, first)
+        store.async_client.upserted.clear()
+        return store, initial, await sync_collection(store, second)
+
+    store, initial, summary = asyncio.run(run())
+    ids = lambda documents, title: {doc.id for doc in documents if doc.metadata["title"] == title}
+    assert initial["added"] == 3 and initial["points_upserted"] == 4
+    assert {key: summary[key] for key in ("added", "updated", "deleted", "skipped")} == {"added": 1, "updated": 1, "deleted": 1, "skipped": 1}
+    assert set(store.async_client.upserted) == ids(second, "Gamma") | ids(second, "Delta")
+    assert set(store.deleted) == ids(first, "Beta") | (ids(first, "Gamma") - ids(second, "Gamma"))
+    assert set(store.async_client.points) == {doc.id for doc in second}
+    assert store.async_client.points[next(iter(ids(second, "Gamma")))]["page_content"] == "A shorter plot."
+
+
+def test_think_tags_are_filtered_across_chunks():
+    think = ThinkTagFilter()
+    visible = [think.feed(chunk) for chunk in ["<thi", "nk>plan ", "more</th", "ink>", "\n Ans", "wer <", "b>bold</b>"]]
+    assert "".join(visible) + think.flush() == "Answer <b>bold</b>"
+    assert think.hidden_tokens == 3 and think.visible_tokens == 3
+
+    unterminated = ThinkTagFilter()
+    assert unterminated.feed("Intro <think>still") + unterminated.feed(" thinking</thi") + unterminated.flush() == "Intro "
+    partial = ThinkTagFilter()
+    assert partial.feed("x < y, and <thi") + partial.flush() == "x < y, and <thi"      # Not a tag after all
+
+
+class NoDocuments(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager):
+        return []
+
+
+# A <think> block longer than max_reasoning_tokens stops the reasoning model and regenerates with the fast one.
+def test_reasoning_budget_stops_generation():
+    async def run():
+        reasoning = GenericFakeChatModel(messages=iter([AIMessage(content="<think> " + "step " * 50 + "</think> slow answer")]))
+        fast = GenericFakeChatModel(messages=iter([AIMessage(content="fast answer")]))
+        chain = RetrievalQA.from_chain_type(llm=reasoning, retriever=NoDocuments())
+        usage = {}
+        options = GenerationOptions(model="reasoning", max_reasoning_tokens=5)
+        chunks = [text async for text in stream_response("Why is it good?", chain, options=options, fast_llm=fast, usage=usage)]
+        return "".join(chunks), usage
+
+    answer, usage = asyncio.run(run())
+    assert answer == "fast answer"
+    assert usage["reasoning_budget_exceeded"] and usage["model"] == "fast"
+    assert usage["hidden_tokens"] == 6      # Stopped one chunk past the budget, not at the end of the block
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic stand-in for OpenAIEmbeddings that counts query embeddings."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def embed_documents(self, texts):
+        return [[float(len(text)), float(text.count(" ")), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.queries += 1
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+# On a cache miss the question is embedded once: the dense search reuses the vector of the cache lookup.
+def test_cache_miss_embeds_the_question_once():
+    async def run():
+        counting = CountingEmbeddings()
+        store = LocalVectorStore(TimedEmbeddings(counting))
+        store.add_texts(["Inception, directed by Christopher Nolan", "Heat, directed by Michael Mann"])
+        llm = GenericFakeChatModel(messages=iter([AIMessage(content="Christopher Nolan")] * 2))
+        chain = RetrievalQA.from_chain_type(llm=llm, retriever=store.as_retriever(search_kwargs={"k": 1}))
+        cache = SemanticCache(store.embeddings)
+        miss = "".join([text async for text in stream_response("Who directed Inception?", chain, cache=cache)])
+        calls_on_miss = counting.queries
+        no_cache = "".join([text async for text in stream_response("Who directed Heat?", chain)])
+        return miss, calls_on_miss, no_cache, counting.queries - calls_on_miss
+
+    miss, calls_on_miss, no_cache, calls_without_cache = asyncio.run(run())
+    assert miss == "Christopher Nolan" and calls_on_miss == 1
+    assert no_cache == "Christopher Nolan" and calls_without_cache == 1
+
+
+
+# A stream takes its LLM slot before the first byte, so /query/stream can still answer a shed request with a 429.
+def test_stream_is_admitted_before_it_starts():
+    async def run():
+        store = LocalVectorStore(TimedEmbeddings(CountingEmbeddings()))
+        store.add_texts(["Inception, directed by Christopher Nolan"])
+        llm = GenericFakeChatModel(messages=iter([AIMessage(content="Christopher Nolan")] * 2))
+        chain = RetrievalQA.from_chain_type(llm=llm, retriever=store.as_retriever(search_kwargs={"k": 1}))
+        cache = SemanticCache(store.embeddings)
+        admission = AdmissionController(max_concurrency=1, max_queue=0)
+        history = [{"query": "Any heist films?", "response": "Heat"}]      # Another cache scope, so these miss
+
+        chunks, release = await start_response("Who directed Inception?", chain, cache=cache, admission=admission, user="a")
+        held = admission.stats()["active"]
+        answer = "".join([text async for text in chunks])
+        release()
+
+        blocker, shed = await admission.hold("a"), None
+        try:
+            await start_response("Who directed it?", chain, chat_history=history, cache=cache, admission=admission, user="b")
+        except AdmissionRejected as e:
+            shed = e.retry_after
+        cached, _ = await start_response("Who directed Inception?", chain, cache=cache, admission=admission, user="b")
+        cached = "".join([text async for text in cached])
+        blocker()
+        _, release = await start_response("Who directed it?", chain, chat_history=history, cache=cache, admission=admission, user="b")
+        release()       # The stream was never iterated, its slot is freed all the same
+        return held, answer, shed, cached, admission.stats()
+
+    held, answer, shed, cached, stats = asyncio.run(run())
+    assert held == 1 and answer == "Christopher Nolan"
+    assert shed is not None and shed >= 1
+    assert cached == "Christopher Nolan"        # Cache hits never wait for a slot
+    assert stats["active"] == 0 and stats["rejected"] == 1
+
+
+class MemoryUsers:
+    """In-memory stand-in for the users collection."""
+
+    def __init__(self, *users):
+        self.users = {user["username"]: dict(user, _id=str(i)) for i, user in enumerate(users)}
+
+    async def find_one(self, query):
+        user = self.users.get(query["username"])
+        return dict(user) if user else None
+
+    async def update_one(self, query, update):
+        self.users[query["username"]].update(update["$set"])
+
+
+# Disabling a user or changing the password takes effect on the very next request, cached principal
+# and trusted token claims notwithstanding.
+def test_user_changes_invalidate_cached_principals():
+    import main
+    import src.utils as utils
+    utils.SECRET_KEY, utils.ALGORITHM = utils.SECRET_KEY or "test", utils.ALGORITHM or "HS256"
+    trust = main.AUTH_TRUST_TOKEN_CLAIMS_SECONDS
+    hashed_password = utils.pwd_context.hash("old secret")
+
+    def login(client, resources, username):
+        user = asyncio.run(get_user(username, resources.users))
+        token = asyncio.run(utils.create_access_token({"sub": username, **token_claims(user, main.AUTH_TRUST_TOKEN_CLAIMS_SECONDS)}))
+        return {"Authorization": f"Bearer {token}"}
+
+    try:
+        for main.AUTH_TRUST_TOKEN_CLAIMS_SECONDS in (0, 600):
+            resources = ResourceRegistry()
+            resources.mongo = {config.MONGODB_DB_NAME: {"users": MemoryUsers(
+                {"username": "ann", "hashed_password": hashed_password}, {"username": "bob", "hashed_password": hashed_password})}}
+            resources.principals = PrincipalCache()
+            main.app.dependency_overrides[main.get_resources] = lambda: resources
+            client = TestClient(main.app)
+
+            ann = login(client, resources, "ann")
+            assert client.get("/user_info", headers=ann).status_code == 200       # Now cached
+            assert client.post("/disable_user", headers=ann).status_code == 200
+            assert client.get("/user_info", headers=ann).status_code == 403
+
+            bob = login(client, resources, "bob")
+            assert client.get("/user_info", headers=bob).status_code == 200
+            change = {"current_password": "old secret", "new_password": "new secret"}
+            assert client.post("/change_password", headers=bob, json=change).status_code == 200
+            assert client.get("/user_info", headers=bob).status_code == 401
+            assert client.get("/user_info", headers=login(client, resources, "bob")).status_code == 200
+    finally:
+        main.AUTH_TRUST_TOKEN_CLAIMS_SECONDS = trust
+        main.app.dependency_overrides.clear()
+
+# Live smoke test against Qdrant, OpenAI and Groq (needs the .env keys).
+async def live_query():
+    vector_store = await get_vector_store(QDRANT_HOST=QDRANT_HOST, API_KEY=QDRANT_API_KEY, QDRANT_COLLECTION_NAME=QDRANT_COLLECTION_NAME, OPENAI_API_KEY=OPENAI_API_KEY)
+    retriever = await get_retriever(GROQ_API_KEY=GROQ_API_KEY, MODEL_NAME_LLAMA=MODEL_NAME_LLAMA, vector_store=vector_store)
+
+    query = "Inception, who are actors in it?"
+    print(await get_response(query=query, retriever=retriever))
+
+
+if __name__ == "__main__":
+    test_concurrent_queries_do_not_block_event_loop()
+    test_identical_queries_are_coalesced()
+    test_mongo_access_does_not_stall_event_loop()
+    test_streaming_document_builder()
+    test_catalog_fast_path()
+    test_extract_filters()
+    test_analytics_planner()
+    test_invalid_analytics_plans_are_rejected()
+    test_cancelled_breaker_trial_is_released()
+    test_model_chain_hedges_and_times_out()
+    test_model_chain_falls_back_in_order_and_breaker_recovers()
+    test_admission_queue_is_fair_and_bounded()
+    test_admission_limit_follows_provider_rate_limits()
+    test_local_store_matches_brute_force_search()
+    test_ingestion_diff_sync()
+    test_think_tags_are_filtered_across_chunks()
+    test_reasoning_budget_stops_generation()
+    test_cache_miss_embeds_the_question_once()
+    test_stream_is_admitted_before_it_starts()
+    test_user_changes_invalidate_cached_principals()
+    if "--offline" not in sys.argv:
+        asyncio.run(live_query())